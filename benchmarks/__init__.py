@@ -0,0 +1,3 @@
+"""
+Offline benchmark suite: a fake ESGF index and data nodes, and scripted scenarios.
+"""
@@ -0,0 +1,432 @@
+"""
+Local stand-ins for an ESGF index node and its data nodes.
+
+``FakeIndex`` answers the ``/esg-search/search`` API well enough for pyesgf's
+``SearchConnection``: dataset and file documents are filtered by facet
+constraints and paginated like the Solr responses of a real index.
+``FakeDataNode`` serves the files of a catalog over HTTP with Range support,
+and can inject latency, per-connection bandwidth limits, errors and truncated
+responses. It also serves a synthetic gridded version of every file over
+OPeNDAP (see ``fake_opendap``).
+"""
+
+import json
+import socket
+import random
+import hashlib
+import threading
+from time import sleep, monotonic
+from dataclasses import dataclass, field
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PATTERN_SIZE = 64 * 1024
+
+# Query parameters that control the search rather than constrain it
+CONTROL_PARAMS = {'format', 'limit', 'offset', 'distrib', 'shards', 'facets', 'fields', 'type', 'query'}
+
+
+def _pattern(name: str) -> bytes:
+    """Deterministic pseudo-random bytes a file's content repeats."""
+    return random.Random(name).randbytes(PATTERN_SIZE)
+
+
+def file_bytes(name: str, start: int, end: int) -> bytes:
+    """Bytes ``start`` to ``end`` (exclusive) of a synthetic file."""
+    pattern = _pattern(name)
+    offset = start % PATTERN_SIZE
+    length = end - start
+    repeats = -(-(offset + length) // PATTERN_SIZE)
+    return (pattern * repeats)[offset:offset + length]
+
+
+@dataclass
+class FakeFile:
+    """A synthetic file: its content is derived from its name."""
+    dataset_id: str  # instance ID of the dataset
+    filename: str
+    size: int
+    _checksum: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def path(self) -> str:
+        return self.dataset_id.replace('.', '/') + '/' + self.filename
+
+    @property
+    def checksum(self) -> str:
+        """SHA256 of the content, computed on first use."""
+        if self._checksum is None:
+            digest = hashlib.sha256()
+            pattern = _pattern(self.filename)
+            full, rest = divmod(self.size, PATTERN_SIZE)
+            for _ in range(full):
+                digest.update(pattern)
+            digest.update(pattern[:rest])
+            self._checksum = digest.hexdigest()
+        return self._checksum
+
+
+class Catalog:
+    """Datasets and files published by the fake federation."""
+
+    def __init__(self):
+        self.datasets: list[dict] = []  # dataset facets, one entry per replica
+        self.files: dict[str, list[FakeFile]] = {}  # instance ID -> files
+        self.by_path: dict[str, FakeFile] = {}
+
+    def add_dataset(self, project: str, model: str, scenario: str, variable: str, table: str,
+                    grid: str, variant: str, frequency: str, sizes: list[int],
+                    nodes: list[str], version: str = "20200101", years: tuple = (2015, 2100)) -> str:
+        """
+        Publish a dataset with one file per size, replicated on every given data node
+        (the first one being the original). Returns its instance ID.
+        """
+        instance_id = ".".join([project, "ScenarioMIP", "FAKE", model, scenario, variant, table,
+                                variable, grid, f"v{version}"])
+        start, stop = years
+        step = max(1, (stop - start + 1) // len(sizes))
+        files = []
+        for i, size in enumerate(sizes):
+            first = start + i * step
+            last = stop if i == len(sizes) - 1 else first + step - 1
+            filename = f"{variable}_{table}_{model}_{scenario}_{variant}_{grid}_{first}01-{last}12.nc"
+            file = FakeFile(instance_id, filename, size)
+            files.append(file)
+            self.by_path[file.path] = file
+        self.files[instance_id] = files
+        for i, node in enumerate(nodes):
+            self.datasets.append({
+                'instance_id': instance_id,
+                'data_node': node,
+                'replica': i > 0,
+                'project': project,
+                'source_id': model,
+                'experiment_id': scenario,
+                'variable': variable,
+                'variable_id': variable,
+                'table_id': table,
+                'grid_label': grid,
+                'variant_label': variant,
+                'member_id': variant,
+                'frequency': frequency,
+                'version': version,
+                'datetime_start': f"{start}-01-16T12:00:00Z",
+                'datetime_stop': f"{stop}-12-16T12:00:00Z",
+            })
+        return instance_id
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(file.size for files in self.files.values() for file in files)
+
+    @property
+    def total_files(self) -> int:
+        return sum(len(files) for files in self.files.values())
+
+
+class _Server:
+    """A threaded HTTP server running in the background."""
+
+    def __init__(self, handler: type, host: str):
+        self.httpd = ThreadingHTTPServer((host, 0), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.owner = self  # type: ignore[attr-defined]
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self) -> "_Server":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like real nodes
+
+    def setup(self) -> None:
+        super().setup()
+        # Headers and body are separate writes: don't let Nagle's algorithm hold
+        # back the body of small responses until the client's delayed ACK
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send(self, status: int, body: bytes = b"", headers: Optional[dict] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeIndex(_Server):
+    """
+    ESGF search API over a catalog, at ``http://<host>:<port>/esg-search``.
+
+    Every request can be delayed by ``latency`` seconds, to make search fan-out
+    as costly as against a remote index. Requests are counted, along with the
+    most ever in flight at once, and the time between the first request and the
+    last response is recorded.
+    """
+
+    def __init__(self, catalog: Catalog, host: str = "127.0.0.1", latency: float = 0.0):
+        super().__init__(_IndexHandler, host)
+        self.catalog = catalog
+        self.latency = latency
+        self.data_nodes: dict[str, str] = {}  # data node name -> base URL of its server
+        self.requests = 0
+        self.in_flight = 0
+        self.peak = 0  # most requests in flight at once
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/esg-search"
+
+    @property
+    def busy_time(self) -> float:
+        """Seconds from the first search request to the last response."""
+        return (self.last - self.first) if self.first is not None else 0.0
+
+    def dataset_docs(self) -> list[dict]:
+        """Dataset documents, with data node names mapped to their server addresses."""
+        docs = []
+        for facets in self.catalog.datasets:
+            node = facets['data_node']
+            docs.append({
+                **facets,
+                'id': f"{facets['instance_id']}|{node}",
+                'master_id': facets['instance_id'],
+                'type': 'Dataset',
+                'latest': True,
+                'index_node': self.host,
+                'number_of_files': len(self.catalog.files[facets['instance_id']]),
+                'url': [],
+                '_base': self.data_nodes[node],
+            })
+        return docs
+
+    def file_docs(self, dataset: dict) -> list[dict]:
+        """File documents of a dataset document."""
+        docs = []
+        for file in self.catalog.files[dataset['instance_id']]:
+            docs.append({
+                'id': f"{file.dataset_id}.{file.filename}|{dataset['data_node']}",
+                'dataset_id': dataset['id'],
+                'instance_id': f"{file.dataset_id}.{file.filename}",
+                'type': 'File',
+                'title': file.filename,
+                'size': file.size,
+                'checksum': [file.checksum],
+                'checksum_type': ['SHA256'],
+                'data_node': dataset['data_node'],
+                'index_node': self.host,
+                'url': [
+                    f"{dataset['_base']}/data/{file.path}|application/netcdf|HTTPServer",
+                    f"{dataset['_base']}/thredds/dodsC/{file.path}.html|application/opendap-html|OPENDAP",
+                ],
+                **{key: dataset[key] for key in ('project', 'source_id', 'experiment_id', 'variable',
+                                                 'variable_id', 'table_id', 'frequency', 'version')},
+            })
+        return docs
+
+
+def _matches(doc: dict, constraints: dict) -> bool:
+    for key, values in constraints.items():
+        value = doc.get(key)
+        if value is None:
+            return False
+        have = {str(v).lower() for v in (value if isinstance(value, list) else [value])}
+        if not have & {v.lower() for v in values}:
+            return False
+    return True
+
+
+class _IndexHandler(_Handler):
+
+    def do_GET(self) -> None:
+        index: FakeIndex = self.server.owner  # type: ignore[attr-defined]
+        with index._lock:
+            index.requests += 1
+            index.in_flight += 1
+            index.peak = max(index.peak, index.in_flight)
+            if index.first is None:
+                index.first = monotonic()
+        try:
+            self._search(index)
+        finally:
+            with index._lock:
+                index.in_flight -= 1
+                index.last = monotonic()
+
+    def _search(self, index: FakeIndex) -> None:
+        if index.latency:
+            sleep(index.latency)
+
+        url = urlsplit(self.path)
+        if not url.path.rstrip('/').endswith('/search'):
+            self._send(404)
+            return
+        params = parse_qs(url.query, keep_blank_values=False)
+        constraints = {key: values for key, values in params.items() if key not in CONTROL_PARAMS}
+
+        datasets = index.dataset_docs()
+        if params.get('type', ['Dataset'])[0] == 'File':
+            dataset_ids = constraints.pop('dataset_id', None)
+            docs = [
+                doc for dataset in datasets if dataset_ids is None or dataset['id'] in dataset_ids
+                for doc in index.file_docs(dataset)
+            ]
+        else:
+            docs = datasets
+        docs = [doc for doc in docs if _matches(doc, constraints)]
+
+        offset = int(params.get('offset', ['0'])[0])
+        limit = int(params.get('limit', ['10'])[0])
+        page = [{k: v for k, v in doc.items() if not k.startswith('_')} for doc in docs[offset:offset + limit]]
+        body = json.dumps({
+            'responseHeader': {'params': {'shards': f"{index.host}:{index.port}/solr"}},
+            'response': {'numFound': len(docs), 'start': offset, 'docs': page},
+            'facet_counts': {'facet_fields': {}},
+        }).encode()
+        self._send(200, body, {"Content-Type": "application/json"})
+
+
+@dataclass
+class Faults:
+    """Misbehaviour injected by a data node."""
+    latency: float = 0.0        # seconds before each response
+    bandwidth: float = 0.0      # bytes/s per connection (0 = unlimited)
+    error_rate: float = 0.0     # fraction of requests answered with 503
+    truncate_rate: float = 0.0  # fraction of responses cut off part-way
+    ranges: bool = True         # whether Range headers are honoured (if not, 200 with the whole file)
+
+
+class FakeDataNode(_Server):
+    """
+    Serves the files of a catalog at ``http://<host>:<port>/data/<path>``, and
+    over OPeNDAP at ``http://<host>:<port>/thredds/dodsC/<path>``.
+
+    Use distinct loopback addresses (127.0.0.2, 127.0.0.3, ...) for different
+    nodes, so that the downloader sees them as different hosts.
+    """
+
+    def __init__(self, catalog: Catalog, host: str = "127.0.0.1", faults: Optional[Faults] = None,
+                 seed: int = 0):
+        super().__init__(_DataHandler, host)
+        self.catalog = catalog
+        self.faults = faults or Faults()
+        self.grid = None  # fake_opendap.Grid of the OPeNDAP datasets, created on first use
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self.truncated = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _roll(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self.random.random() < rate
+
+
+class _DataHandler(_Handler):
+
+    def do_GET(self) -> None:
+        node: FakeDataNode = self.server.owner  # type: ignore[attr-defined]
+        faults = node.faults
+        with node._lock:
+            node.requests += 1
+        if faults.latency:
+            sleep(faults.latency)
+
+        url = urlsplit(self.path)
+        path = url.path
+        if path.startswith('/thredds/dodsC/'):
+            self._opendap(node, path.removeprefix('/thredds/dodsC/'), url.query)
+            return
+        file = node.catalog.by_path.get(path.removeprefix('/data/'))
+        if file is None:
+            self._send(404)
+            return
+        if node._roll(faults.error_rate):
+            with node._lock:
+                node.errors += 1
+            self._send(503, headers={"Retry-After": "0"})
+            return
+
+        start, end, status = 0, file.size, 200
+        header = self.headers.get('Range')
+        if header and header.startswith('bytes=') and faults.ranges:
+            first, _, last = header[6:].partition('-')
+            start = int(first)
+            end = min(int(last) + 1, file.size) if last else file.size
+            if start >= file.size:
+                self._send(416, headers={"Content-Range": f"bytes */{file.size}"})
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{file.size}")
+        self.end_headers()
+
+        # Cut the body off part-way if this response is to be truncated
+        stop = end
+        if node._roll(faults.truncate_rate):
+            with node._lock:
+                node.truncated += 1
+            stop = start + (end - start) // 2
+            self.close_connection = True
+
+        chunk = 256 * 1024
+        position = start
+        began = monotonic()
+        try:
+            while position < stop:
+                data = file_bytes(file.filename, position, min(position + chunk, stop))
+                self.wfile.write(data)
+                position += len(data)
+                with node._lock:
+                    node.bytes_sent += len(data)
+                if faults.bandwidth:
+                    ahead = (position - start) / faults.bandwidth - (monotonic() - began)
+                    if ahead > 0:
+                        sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _opendap(self, node: FakeDataNode, path: str, query: str) -> None:
+        """Answer a DAP2 request for ``<path>.dds``, ``.das`` or ``.dods``."""
+        from benchmarks import fake_opendap
+
+        path, _, suffix = path.rpartition('.')
+        file = node.catalog.by_path.get(path)
+        if file is None:
+            self._send(404)
+            return
+        if node.grid is None:
+            node.grid = fake_opendap.Grid()
+        status, body, headers = fake_opendap.respond(file.filename, node.grid, suffix, query)
+        with node._lock:
+            node.bytes_sent += len(body)
+        self._send(status, body, headers)
@@ -0,0 +1,214 @@
+"""
+A minimal OPeNDAP (DAP2) endpoint for the fake data nodes, enough for the
+netCDF-C client behind ``netCDF4.Dataset(url)``.
+
+Every catalog file is served at ``/thredds/dodsC/<path>`` as a synthetic
+gridded dataset: the file's variable on (time, [lev,] lat, lon) with its
+coordinates and bounds, plus an unrelated ``areacell`` field. Values are a
+deterministic function of the indices (see ``values``), so that subsets can be
+checked against what was requested. Requires numpy.
+"""
+
+import re
+import numpy as np
+from dataclasses import dataclass
+from urllib.parse import unquote
+
+# Days before each month in a 365-day calendar
+_MONTH_START = np.cumsum([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+
+@dataclass
+class Grid:
+    """Resolution of the synthetic grids."""
+    nlat: int = 36
+    nlon: int = 72
+    nlev: int = 10
+
+
+def _months(filename: str) -> tuple[int, int]:
+    """First year and number of months of a file, from the dates in its name."""
+    first, last = re.search(r"_(\d{4})\d\d-(\d{4})\d\d\.nc$", filename).groups()
+    return int(first), (int(last) - int(first) + 1) * 12
+
+
+def variables(filename: str, grid: Grid) -> dict:
+    """
+    Variables of a file's synthetic dataset.
+
+    Returns
+    -------
+    dict
+        Mapping of name to (dtype, dimensions, attributes), in declaration order
+    """
+    variable, table = filename.split('_')[:2]
+    dims = ('time', 'lev', 'lat', 'lon') if table.startswith('O') else ('time', 'lat', 'lon')
+    result = {
+        'time': ('>f8', ('time',), {'units': "days since 1850-01-01", 'calendar': "noleap",
+                                    'axis': "T", 'standard_name': "time", 'bounds': "time_bnds"}),
+        'time_bnds': ('>f8', ('time', 'bnds'), {}),
+    }
+    if 'lev' in dims:
+        result['lev'] = ('>f8', ('lev',), {'units': "m", 'axis': "Z", 'positive': "down",
+                                           'standard_name': "depth"})
+    result.update({
+        'lat': ('>f8', ('lat',), {'units': "degrees_north", 'axis': "Y", 'standard_name': "latitude",
+                                  'bounds': "lat_bnds"}),
+        'lat_bnds': ('>f8', ('lat', 'bnds'), {}),
+        'lon': ('>f8', ('lon',), {'units': "degrees_east", 'axis': "X", 'standard_name': "longitude",
+                                  'bounds': "lon_bnds"}),
+        'lon_bnds': ('>f8', ('lon', 'bnds'), {}),
+        'areacell': ('>f4', ('lat', 'lon'), {'units': "m2"}),
+        variable: ('>f4', dims, {'units': "1", '_FillValue': np.float32(1e20)}),
+    })
+    return result
+
+
+def shape(filename: str, grid: Grid) -> dict:
+    """Size of every dimension of a file's synthetic dataset."""
+    _, months = _months(filename)
+    return {'time': months, 'lev': grid.nlev, 'lat': grid.nlat, 'lon': grid.nlon, 'bnds': 2}
+
+
+def values(filename: str, grid: Grid, name: str, index: tuple) -> np.ndarray:
+    """Values of a variable over a tuple of index arrays (or slices), one per dimension."""
+    first_year, months = _months(filename)
+    dtype, dims, _ = variables(filename, grid)[name]
+    sizes = shape(filename, grid)
+    axes = [np.arange(sizes[dim])[i] for dim, i in zip(dims, index)]
+    if name == 'time':
+        month = axes[0] + (first_year - 1850) * 12
+        return (month // 12 * 365 + _MONTH_START[month % 12] + 15).astype(dtype)
+    if name == 'time_bnds':
+        month = axes[0][:, None] + (first_year - 1850) * 12 + axes[1][None, :]
+        return (month // 12 * 365 + _MONTH_START[month % 12]).astype(dtype)
+    if name == 'lev':
+        return (5.0 + 10.0 * axes[0] ** 1.5).astype(dtype)
+    if name in ('lat', 'lat_bnds'):
+        step = 180.0 / grid.nlat
+        edge = axes[1][None, :] if name == 'lat_bnds' else 0.5
+        lat = axes[0][:, None] if name == 'lat_bnds' else axes[0]
+        return (-90.0 + step * (lat + edge)).astype(dtype)
+    if name in ('lon', 'lon_bnds'):
+        step = 360.0 / grid.nlon
+        edge = axes[1][None, :] if name == 'lon_bnds' else 0.5
+        lon = axes[0][:, None] if name == 'lon_bnds' else axes[0]
+        return (step * (lon + edge)).astype(dtype)
+    if name == 'areacell':
+        return np.add.outer(axes[0], axes[1]).astype(dtype)
+    # The data variable: a different value at every index
+    grids = np.meshgrid(*axes, indexing='ij')
+    scales = {'time': 1.0, 'lev': 0.1, 'lat': 0.001, 'lon': 0.00001}
+    return sum(g * scales[dim] for g, dim in zip(grids, dims)).astype(dtype)
+
+
+_TYPES = {'>f8': "Float64", '>f4': "Float32"}
+
+
+def _declaration(name: str, dtype: str, dims: tuple, sizes: dict) -> str:
+    return f"    {_TYPES[dtype]} {name}" + "".join(f"[{dim} = {sizes[dim]}]" for dim in dims) + ";"
+
+
+def dds(filename: str, grid: Grid, projection: list = None) -> str:
+    """DDS of a dataset, or of the given (name, slices) projection of it."""
+    declared = variables(filename, grid)
+    sizes = shape(filename, grid)
+    lines = ["Dataset {"]
+    for name, slices in projection or [(name, None) for name in declared]:
+        dtype, dims, _ = declared[name]
+        counts = dict(sizes) if slices is None else {
+            dim: len(range(sizes[dim])[s]) for dim, s in zip(dims, slices)
+        }
+        lines.append(_declaration(name, dtype, dims, counts))
+    lines.append(f"}} {filename};")
+    return "\n".join(lines) + "\n"
+
+
+def das(filename: str, grid: Grid) -> str:
+    """DAS of a dataset."""
+    lines = ["Attributes {"]
+    for name, (dtype, _, attributes) in variables(filename, grid).items():
+        lines.append(f"    {name} {{")
+        for key, value in attributes.items():
+            if isinstance(value, str):
+                lines.append(f'        String {key} "{value}";')
+            else:
+                lines.append(f"        {_TYPES[dtype]} {key} {float(value)!r};")
+        lines.append("    }")
+    lines.append("    NC_GLOBAL {")
+    lines.append(f'        String title "Synthetic {filename}";')
+    lines.append("    }")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def parse_projection(query: str, filename: str, grid: Grid) -> list:
+    """
+    Parse a DAP2 constraint expression into (name, slices) pairs; slices is None
+    for a whole variable. Selection clauses (after '&') are ignored.
+    """
+    declared = variables(filename, grid)
+    projection = []
+    for item in unquote(query).split('&')[0].split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, rest = item.partition('[')
+        if name not in declared:
+            raise KeyError(name)
+        if not rest:
+            projection.append((name, None))
+            continue
+        slices = []
+        for spec in re.findall(r"\[([^\]]*)\]", '[' + rest):
+            parts = [int(p) for p in spec.split(':')]
+            if len(parts) == 1:
+                start, stride, stop = parts[0], 1, parts[0]
+            elif len(parts) == 2:
+                (start, stop), stride = parts, 1
+            else:
+                start, stride, stop = parts
+            slices.append(slice(start, stop + 1, stride))
+        projection.append((name, slices))
+    return projection or [(name, None) for name in declared]
+
+
+def dods(filename: str, grid: Grid, projection: list) -> bytes:
+    """DAP2 data response: the DDS of the projection, then its values encoded as XDR."""
+    declared = variables(filename, grid)
+    body = [dds(filename, grid, projection).encode(), b"\nData:\n"]
+    for name, slices in projection:
+        dtype, dims, _ = declared[name]
+        index = slices or [slice(None)] * len(dims)
+        data = np.ascontiguousarray(values(filename, grid, name, tuple(index)), dtype=dtype)
+        count = np.array([data.size, data.size], dtype='>u4')
+        body += [count.tobytes(), data.tobytes()]
+    return b"".join(body)
+
+
+def respond(filename: str, grid: Grid, suffix: str, query: str) -> tuple[int, bytes, dict]:
+    """
+    Answer a request for ``<file>.<suffix>?<query>``.
+
+    Returns
+    -------
+    tuple[int, bytes, dict]
+        Status, body and headers
+    """
+    headers = {"XDODS-Server": "dods/3.2", "XOPeNDAP-Server": "fake/1.0"}
+    try:
+        if suffix == 'dds':
+            projection = parse_projection(query, filename, grid) if query else None
+            return 200, dds(filename, grid, projection).encode(), {
+                **headers, "Content-Type": "text/plain", "Content-Description": "dods-dds"}
+        if suffix == 'das':
+            return 200, das(filename, grid).encode(), {
+                **headers, "Content-Type": "text/plain", "Content-Description": "dods-das"}
+        if suffix == 'dods':
+            body = dods(filename, grid, parse_projection(query, filename, grid))
+            return 200, body, {
+                **headers, "Content-Type": "application/octet-stream", "Content-Description": "dods-data"}
+    except (KeyError, ValueError, IndexError) as e:
+        message = f'Error {{\n    code = 400;\n    message = "{e}";\n}};\n'
+        return 400, message.encode(), {**headers, "Content-Type": "text/plain", "Content-Description": "dods-error"}
+    return 404, b"", headers
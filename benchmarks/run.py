@@ -0,0 +1,333 @@
+"""
+Offline benchmarks of searching and downloading, against a local fake ESGF
+index and data nodes.
+
+Run every scenario, or some of them, from the repository root:
+
+    python -m benchmarks.run
+    python -m benchmarks.run many_small flaky_nodes --scale 0.5
+    python -m benchmarks.run huge_files --set download.segments=4 --json after.json
+
+Each scenario is run in a fresh temporary DATA_HOME, and reports the wall-clock
+time of the run, the time the index was busy answering searches, the number of
+index and data node requests, and the download throughput.
+"""
+
+import os
+import sys
+import json
+import yaml
+import argparse
+import tempfile
+from time import monotonic
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+from rich.table import Table
+
+# local imports
+from benchmarks.fake_esgf import Catalog, FakeIndex, FakeDataNode, Faults
+from esgf_download import download
+from esgf_download.console import console
+from esgf_download.parser import load_config
+from esgf_download.manager import DownloadManager
+
+MB = 1024**2
+
+# Minimal configuration; scenarios override parts of it
+BASE_CONFIG = {
+    'esgf': {
+        'myproxy_host': "localhost",
+        'search_node': None,
+        'data_node_preference': "node-0",
+        'search_workers': 4,
+        'search_batching': "model",
+    },
+    'download': {
+        'max_workers': 8,
+        'max_per_node': 4,
+        'adaptive': False,
+        'retries': 3,
+        'report_interval': 3600,
+        'replicas': False,
+        'segments': 1,
+        'segment_threshold_mb': 64,
+        'engine': "threads",
+        'order': "largest",
+        'manifest': True,
+    },
+    'cache': {'enabled': False},
+    'metrics': {'enabled': True},
+    'data': {
+        'project': "CMIP6",
+        'frequency': "mon",
+        'scenarios': ["ssp585"],
+        'variables': ["tas"],
+        'models': ["MODEL-0"],
+        '2300_extensions': False,
+    },
+    'table_mapping': {'tas': "Amon", 'pr': "Amon", 'evspsbl': "Amon", 'mrro': "Lmon",
+                      'thetao': "Omon", 'so': "Omon"},
+    'variant_labels': {'default': "r1i1p1f1"},
+    'grid_labels': {'default': "gn"},
+}
+
+
+@dataclass
+class Scenario:
+    """A benchmark: the catalog it publishes, its data nodes and config overrides."""
+    name: str
+    description: str
+    publish: Callable[[Catalog, dict, list, float], None]  # (catalog, config, nodes, scale)
+    nodes: dict[str, Faults] = field(default_factory=lambda: {"node-0": Faults()})
+    index_latency: float = 0.0
+    config: dict = field(default_factory=dict)
+    expect_faults: bool = False  # the run fails unless faults were injected (and recovered from)
+
+
+def _publish_grid(catalog: Catalog, config: dict, nodes: list, sizes: list[int],
+                  replicated: bool = False) -> None:
+    """Publish one dataset per configured model, scenario and variable."""
+    data = config['data']
+    for model in data['models']:
+        for experiment in data['scenarios']:
+            for variable in data['variables']:
+                catalog.add_dataset(
+                    "CMIP6", model, experiment, variable, BASE_CONFIG['table_mapping'][variable],
+                    "gn", "r1i1p1f1", "mon", sizes, nodes if replicated else nodes[:1],
+                )
+
+
+
+def _publish_mixed(catalog: Catalog, config: dict, nodes: list, scale: float) -> None:
+    """Publish many small atmosphere files, then a few large ocean files."""
+    for variable, sizes in (("tas", [max(1, int(2 * MB * scale))] * 60),
+                            ("thetao", [max(1, int(96 * MB * scale))] * 2)):
+        catalog.add_dataset(
+            "CMIP6", "MODEL-0", "ssp585", variable, BASE_CONFIG['table_mapping'][variable],
+            "gn", "r1i1p1f1", "mon", sizes, nodes[:1],
+        )
+
+
+SCENARIOS = {
+    scenario.name: scenario for scenario in [
+        Scenario(
+            "many_small",
+            "Hundreds of small files per dataset (3-hourly/daily style), 20 ms node latency",
+            lambda catalog, config, nodes, scale: _publish_grid(
+                catalog, config, nodes, [max(1, int(256 * 1024 * scale))] * 200
+            ),
+            nodes={"node-0": Faults(latency=0.02)},
+            config={'data': {'scenarios': ["ssp126", "ssp585"], 'variables': ["tas", "pr"]}},
+        ),
+        Scenario(
+            "huge_files",
+            "A few very large files from a node limited to 40 MB/s per connection",
+            lambda catalog, config, nodes, scale: _publish_grid(
+                catalog, config, nodes, [max(1, int(256 * MB * scale))] * 2
+            ),
+            nodes={"node-0": Faults(bandwidth=40 * MB)},
+            config={'data': {'variables': ["thetao", "so"]}},
+        ),
+        Scenario(
+            "flaky_nodes",
+            "Replicated datasets; the fastest node errors and truncates, the others are slower",
+            lambda catalog, config, nodes, scale: _publish_grid(
+                catalog, config, nodes, [max(1, int(4 * MB * scale))] * 20, replicated=True
+            ),
+            nodes={
+                "node-0": Faults(error_rate=0.3, truncate_rate=0.2),
+                "node-1": Faults(latency=0.05, bandwidth=20 * MB),
+                "node-2": Faults(latency=0.02, bandwidth=40 * MB),
+            },
+            config={'download': {'replicas': True}, 'data': {'variables': ["tas", "pr"]}},
+            expect_faults=True,
+        ),
+        Scenario(
+            "search_fanout",
+            "10 models x 4 scenarios x 6 variables of one small file, 50 ms index latency",
+            lambda catalog, config, nodes, scale: _publish_grid(
+                catalog, config, nodes, [max(1, int(64 * 1024 * scale))]
+            ),
+            index_latency=0.05,
+            config={'data': {
+                'models': [f"MODEL-{i}" for i in range(10)],
+                'scenarios': ["historical", "ssp126", "ssp245", "ssp585"],
+                'variables': ["tas", "pr", "evspsbl", "mrro", "thetao", "so"],
+            }},
+        ),
+        Scenario(
+            "ocean_subset",
+            "A North Atlantic box of the upper ocean read over OPeNDAP instead of whole files",
+            lambda catalog, config, nodes, scale: _publish_grid(
+                catalog, config, nodes, [max(1, int(64 * MB * scale))] * 4
+            ),
+            nodes={"node-0": Faults(latency=0.02)},
+            config={
+                'data': {'variables': ["thetao", "so"]},
+                'subset': {'enabled': True, 'bbox': [-80, 0, 20, 70], 'levels': [0, 700]},
+            },
+        ),
+        Scenario(
+            "mixed_sizes",
+            "60 small files queued before two large ones, 4 workers limited to 40 MB/s each",
+            _publish_mixed,
+            nodes={"node-0": Faults(bandwidth=40 * MB)},
+            config={'download': {'max_workers': 4}, 'data': {'variables': ["tas", "thetao"]}},
+        ),
+    ]
+}
+
+
+def _merge(base: dict, override: dict) -> dict:
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merged[key] = _merge(base[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _parse_override(spec: str) -> dict:
+    """Turn ``section.key=value`` into a nested override, the value parsed as YAML."""
+    path, _, value = spec.partition('=')
+    override: dict = yaml.safe_load(value)
+    for key in reversed(path.split('.')):
+        override = {key: override}
+    return override
+
+
+def run_scenario(scenario: Scenario, scale: float = 1.0, overrides: Optional[list] = None) -> dict:
+    """
+    Run one scenario in a fresh DATA_HOME and measure it.
+
+    Returns
+    -------
+    dict
+        Measurements of the run
+    """
+    config_data = _merge(BASE_CONFIG, scenario.config)
+    for override in overrides or []:
+        config_data = _merge(config_data, override)
+
+    catalog = Catalog()
+    scenario.publish(catalog, config_data, list(scenario.nodes), scale)
+    for files in catalog.files.values():
+        for file in files:
+            file.checksum  # hash outside of the timed run
+
+    nodes = {
+        name: FakeDataNode(catalog, host=f"127.0.0.{i + 2}", faults=faults, seed=i).start()
+        for i, (name, faults) in enumerate(scenario.nodes.items())
+    }
+    index = FakeIndex(catalog, latency=scenario.index_latency).start()
+    index.data_nodes = {name: node.base_url for name, node in nodes.items()}
+
+    with tempfile.TemporaryDirectory(prefix=f"esgf-bench-{scenario.name}-") as tmp:
+        config_data['esgf']['search_node'] = index.url
+        config_path = Path(tmp) / "config.yaml"
+        config_path.write_text(yaml.safe_dump(config_data))
+        os.environ['DATA_HOME'] = str(Path(tmp) / "data")
+        config = load_config(str(config_path))
+
+        download.keyboard_interrupt = False
+        start = monotonic()
+        DownloadManager(config, headless=True).run()
+        wall = monotonic() - start
+
+        complete = sum(
+            1 for files in catalog.files.values() for file in files
+            if (config.DATA_HOME / file.path).is_file()
+            and (config.DATA_HOME / file.path).stat().st_size == file.size
+            or any((config.DATA_HOME / file.path).parent.glob(f"{Path(file.filename).stem}.subset-*.nc"))
+        )
+
+    index.stop()
+    for node in nodes.values():
+        node.stop()
+
+    transferred = sum(node.bytes_sent for node in nodes.values())
+    return {
+        'scenario': scenario.name,
+        'files': catalog.total_files,
+        'complete': complete,
+        'bytes': catalog.total_bytes,
+        'wall_s': round(wall, 3),
+        'search_s': round(index.busy_time, 3),
+        'search_requests': index.requests,
+        'search_peak': index.peak,
+        'node_requests': sum(node.requests for node in nodes.values()),
+        'bytes_served': transferred,
+        'errors_injected': sum(node.errors + node.truncated for node in nodes.values()),
+        'throughput_mb_s': round(catalog.total_bytes / wall / MB, 2) if wall > 0 else 0.0,
+    }
+
+
+def problems(scenario: Scenario, result: dict) -> list[str]:
+    """What went wrong in a scenario's run: files not downloaded, or faults it should have hit."""
+    found = []
+    if result['complete'] != result['files']:
+        found.append(f"{result['files'] - result['complete']} of {result['files']} files not downloaded")
+    if scenario.expect_faults and not result['errors_injected']:
+        found.append("no faults were injected, so failover and retries went untested")
+    return found
+
+
+def report(results: list) -> None:
+    """Print the measurements of every scenario as a table."""
+    table = Table(title="Benchmark results")
+    columns = [
+        ("Scenario", 'scenario'), ("Files", 'files'), ("Done", 'complete'),
+        ("Wall s", 'wall_s'), ("Search s", 'search_s'), ("Index", 'search_requests'), ("Peak", 'search_peak'),
+        ("Node", 'node_requests'), ("Faults", 'errors_injected'), ("MB/s", 'throughput_mb_s'),
+    ]
+    for title, _ in columns:
+        if title == "Scenario":
+            table.add_column(title, no_wrap=True)
+        else:
+            table.add_column(title, justify="right")
+    for result in results:
+        table.add_row(*(str(result[key]) for _, key in columns))
+    console.print(table)
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark esgf_download against a local fake ESGF federation",
+        prog="python -m benchmarks.run",
+    )
+    parser.add_argument("scenarios", nargs="*", default=[],
+                        help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiply every file size by this factor (default: 1)")
+    parser.add_argument("--set", action="append", default=[], metavar="SECTION.KEY=VALUE",
+                        help="Override a config value in every scenario, e.g. download.engine=async")
+    parser.add_argument("--json", default=None, metavar="PATH",
+                        help="Also write the results to a JSON file, for comparing runs")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    overrides = [_parse_override(spec) for spec in args.set]
+    results = []
+    for name in args.scenarios or list(SCENARIOS):
+        scenario = SCENARIOS[name]
+        console.rule(f"[bold]{name}[/bold] [dim]{scenario.description}[/dim]")
+        results.append(run_scenario(scenario, args.scale, overrides))
+
+    report(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    failed = False
+    for result in results:
+        for problem in problems(SCENARIOS[result['scenario']], result):
+            console.print(f"[red]✗ {result['scenario']}:[/red] {problem}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
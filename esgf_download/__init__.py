@@ -8,7 +8,7 @@ __version__ = "1.0.0"
 
 from .classes import Dataset, File
 from .login import login_to_esgf
-from .download import download_dataset
+from .download import download_dataset, DownloadScheduler
 from .console import console
 
-__all__ = ["Dataset", "File", "login_to_esgf", "download_dataset", "console"]
\ No newline at end of file
+__all__ = ["Dataset", "File", "login_to_esgf", "download_dataset", "DownloadScheduler", "console"]
\ No newline at end of file
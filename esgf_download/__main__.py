@@ -1,44 +1,257 @@
+import sys
 import argparse
+from pathlib import Path
+from typing import Optional
 from esgf_download.parser import load_config
 from esgf_download.manager import DownloadManager
+from esgf_download.shards import parse_shard
 
+COMMANDS = ("download", "plan", "verify", "reconcile", "gc")
 
-def main(config_path: str, login: bool) -> None:
+
+def main(config_path: str, login: bool, refresh: bool = False, invalidate: tuple = (),
+         headless: bool = False, plan: Optional[str] = None,
+         shard: Optional[tuple[int, int]] = None, sync_versions: bool = False) -> None:
     """
     Main application function.
-    
+
     Parameters
     ----------
     config_path : str
         Path to YAML configuration file.
+    login : bool
+        Log in to ESGF before downloading.
+    refresh : bool, optional
+        Ignore cached search results.
+    invalidate : tuple, optional
+        Dataset IDs to remove from the search cache.
+    headless : bool, optional
+        Report progress as periodic JSON lines instead of the rich display.
+    plan : str, optional
+        Path to a plan file to download from instead of searching ESGF.
+    shard : tuple[int, int], optional
+        Download only shard ``i`` of ``N`` of the files, as (i, N).
+    sync_versions : bool, optional
+        Link unchanged files from earlier versions of a dataset, whatever the
+        configuration says.
     """
     # Load configuration
     config = load_config(config_path)
-    
+    if sync_versions:
+        config.SYNC_VERSIONS = True
+
     # Create and run download manager
-    manager = DownloadManager(config, login)
-    manager.run()
+    manager = DownloadManager(
+        config, login, refresh=refresh, invalidate=invalidate, headless=headless, shard=shard
+    )
+    manager.run(plan=Path(plan) if plan else None)
 
 
-if __name__ == "__main__":
+def plan(config_path: str, output: str, refresh: bool = False) -> None:
+    """
+    Resolve every dataset of a configuration without downloading, and write a plan.
+
+    Parameters
+    ----------
+    config_path : str
+        Path to YAML configuration file.
+    output : str
+        Path of the plan file to write (JSON, or Parquet if it ends in .parquet).
+    refresh : bool, optional
+        Ignore cached search results.
+    """
+    config = load_config(config_path)
+    DownloadManager(config, refresh=refresh).plan(Path(output))
+
+
+def verify(config_path: str, workers: Optional[int] = None, delete: bool = False,
+           refresh: bool = False) -> None:
+    """
+    Verify the checksums of files already downloaded for a configuration.
+
+    Parameters
+    ----------
+    config_path : str
+        Path to YAML configuration file.
+    workers : int, optional
+        Number of hashing processes. Defaults to the number of CPUs.
+    delete : bool, optional
+        Delete corrupt files so that they are downloaded again.
+    refresh : bool, optional
+        Ignore cached search results.
+    """
+    config = load_config(config_path)
+    manager = DownloadManager(config, refresh=refresh)
+    manager.verify(workers=workers, delete=delete)
+
+
+def reconcile(config_path: str) -> None:
+    """
+    Reconcile the manifest of downloaded files with the filesystem.
+
+    Parameters
+    ----------
+    config_path : str
+        Path to YAML configuration file.
+    """
+    config = load_config(config_path)
+    DownloadManager(config).reconcile()
+
+
+def gc(config_path: str) -> None:
+    """
+    Delete blobs of the content-addressed store that no downloaded file uses.
+
+    Parameters
+    ----------
+    config_path : str
+        Path to YAML configuration file.
+    """
+    config = load_config(config_path)
+    DownloadManager(config).gc()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the command line parser."""
     parser = argparse.ArgumentParser(
         description="Download climate model data from ESGF",
         prog="python -m esgf_download"
     )
     parser.add_argument(
-        "config", 
-        help="Path to YAML configuration file"
+        "--version",
+        action="version",
+        version="%(prog)s 0.1.0"
     )
-    parser.add_argument(
+    subparsers = parser.add_subparsers(dest="command")
+
+    download = subparsers.add_parser(
+        "download",
+        help="Download the datasets in a configuration (default command)"
+    )
+    _add_common_arguments(download)
+    download.add_argument(
         "--login",
         action="store_true",
         help="Log in to ESGF before downloading"
     )
+    download.add_argument(
+        "--invalidate",
+        action="append",
+        default=[],
+        metavar="DATASET_ID",
+        help="Remove a dataset from the search cache before running (can be repeated)"
+    )
+    download.add_argument(
+        "--headless",
+        action="store_true",
+        help="Print periodic JSON-lines progress summaries on stdout instead of progress bars, "
+             "with other messages on stderr (for batch jobs)"
+    )
+    download.add_argument(
+        "--plan",
+        default=None,
+        metavar="PLAN",
+        help="Download the files of a plan written by the plan command, without searching ESGF"
+    )
+    download.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        metavar="I/N",
+        help="Download only shard I of N (counting from 0) of the files, sharing DATA_HOME with the other shards"
+    )
+    download.add_argument(
+        "--sync-versions",
+        action="store_true",
+        help="Hard-link files that haven't changed from earlier versions of a dataset instead of downloading them"
+    )
+
+    dry_run = subparsers.add_parser(
+        "plan",
+        help="Resolve datasets and report their size without downloading, and write a plan file"
+    )
+    _add_common_arguments(dry_run)
+    dry_run.add_argument(
+        "-o", "--output",
+        default="plan.json",
+        help="Plan file to write, JSON or .parquet (default: plan.json)"
+    )
+
+    check = subparsers.add_parser(
+        "verify",
+        help="Verify the checksums of files already downloaded"
+    )
+    _add_common_arguments(check)
+    check.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of hashing processes (default: number of CPUs)"
+    )
+    check.add_argument(
+        "--delete",
+        action="store_true",
+        help="Delete corrupt files so that the next run downloads them again"
+    )
+
+    tidy = subparsers.add_parser(
+        "reconcile",
+        help="Drop manifest entries of files that are missing or truncated on disk"
+    )
+    tidy.add_argument(
+        "config",
+        help="Path to YAML configuration file"
+    )
+
+    collect = subparsers.add_parser(
+        "gc",
+        help="Delete blobs of the content-addressed store that no downloaded file links to"
+    )
+    collect.add_argument(
+        "config",
+        help="Path to YAML configuration file"
+    )
+    return parser
+
+
+def _add_common_arguments(parser: argparse.ArgumentParser) -> None:
+    """Arguments shared by every command."""
     parser.add_argument(
-        "--version", 
-        action="version", 
-        version="%(prog)s 0.1.0"
+        "config",
+        help="Path to YAML configuration file"
     )
-    
-    args = parser.parse_args()
-    main(args.config, args.login)
\ No newline at end of file
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore cached search results and query the ESGF index again"
+    )
+
+
+def cli(argv: Optional[list] = None) -> None:
+    """Command line entry point."""
+    argv = sys.argv[1:] if argv is None else list(argv)
+
+    # `python -m esgf_download [options] config.yaml` is shorthand for the download command
+    if argv and not set(argv) & {*COMMANDS, "-h", "--help", "--version"}:
+        argv.insert(0, "download")
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == "download":
+        main(args.config, args.login, args.refresh, tuple(args.invalidate), args.headless, args.plan,
+             args.shard, args.sync_versions)
+    elif args.command == "plan":
+        plan(args.config, args.output, args.refresh)
+    elif args.command == "verify":
+        verify(args.config, args.workers, args.delete, args.refresh)
+    elif args.command == "reconcile":
+        reconcile(args.config)
+    elif args.command == "gc":
+        gc(args.config)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    cli()
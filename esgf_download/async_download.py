@@ -0,0 +1,294 @@
+"""
+asyncio transfer engine: many concurrent downloads on a single event loop.
+
+Selected with ``download.engine: async`` in the config file. Requires aiohttp
+(``pip install esgf-download[async]``).
+"""
+
+import asyncio
+import threading
+from time import monotonic
+from pathlib import Path
+from concurrent.futures import Future
+from typing import BinaryIO, Callable, Optional
+
+try:
+    import aiohttp # type: ignore
+except ImportError:  # optional dependency
+    aiohttp = None
+
+# local imports
+import esgf_download.download as download
+from esgf_download.classes import File
+from esgf_download.checksum import new_hasher, update_from_file
+from esgf_download.mirrors import NodeHealth
+from esgf_download.progress import FileTask
+from esgf_download.sessions import SessionPool, host_of
+from esgf_download.throttle import backoff_delay, is_throttled, retry_after
+
+# Bytes received before they are written and hashed off the event loop
+WRITE_BUFFER = 1024**2
+
+
+class AsyncEngine:
+    """
+    Runs file transfers as coroutines on one event loop in a background thread.
+
+    Transfers have the same behaviour as ``download_file``: existing files are
+    skipped, downloads are staged in resumable .part files, checksums are verified
+    as bytes arrive, replicas are failed over, and the global keyboard interrupt
+    flag stops every transfer. Segmented downloads are not supported by this engine.
+
+    Only the network I/O runs on the loop. Received bytes are written and hashed
+    in the default executor, up to ``WRITE_BUFFER`` bytes at a time, so that many
+    concurrent transfers don't queue behind each other's disk writes.
+    """
+
+    def __init__(self, concurrency: int = 64, max_per_node: int = 4,
+                 sessions: Optional[SessionPool] = None, health: Optional[NodeHealth] = None,
+                 retries: int = 0, link: Optional[Callable[[File, FileTask], bool]] = None):
+
+        """
+        Parameters
+        ----------
+        concurrency : int, optional
+            Maximum number of connections open at once. Default is 64.
+        max_per_node : int, optional
+            Maximum number of connections to any single data node. Default is 4.
+        sessions : SessionPool, optional
+            Blocking sessions, used to probe data nodes when ranking replicas. Its
+            per-node limiters and bandwidth cap also apply to this engine.
+        health : NodeHealth, optional
+            Data node health shared across the run.
+        retries : int, optional
+            Number of retries, with jittered backoff, after every replica of a
+            file has failed. Default is 0.
+        link : callable, optional
+            Called with each file and its task before downloading it; puts the file
+            in place from a local copy and returns True if it can.
+        """
+
+        if aiohttp is None:
+            raise ImportError(
+                "The async download engine requires aiohttp: pip install esgf-download[async]"
+            )
+        self.concurrency = concurrency
+        self.max_per_node = max_per_node
+        self.sessions = sessions or SessionPool(max_per_node)
+        self.health = health or NodeHealth()
+        self.retries = retries
+        self.link = link
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="download-async", daemon=True)
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._freed: Optional[asyncio.Condition] = None  # notified when a node slot is released
+        self._interrupt: Optional[asyncio.Event] = None  # set on a keyboard interrupt
+
+    def start(self) -> None:
+        """Start the event loop thread and open the HTTP session."""
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+
+    async def _open(self) -> None:
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.max_per_node)
+        timeout = aiohttp.ClientTimeout(sock_connect=download.TIMEOUT[0], sock_read=download.TIMEOUT[1])
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=False)
+        self._freed = asyncio.Condition()
+        self._interrupt = asyncio.Event()
+
+    def submit(self, file: File, task: FileTask) -> Future:
+        """
+        Schedule a file transfer on the event loop.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to True if the file is present locally afterwards
+        """
+        return asyncio.run_coroutine_threadsafe(self.download_file(file, task), self.loop)
+
+    def interrupt(self) -> None:
+        """Wake every transfer backing off before a retry, so that it stops now."""
+        self.loop.call_soon_threadsafe(self._interrupt.set)
+
+    def close(self) -> None:
+        """Let in-flight transfers finish, close the HTTP session and stop the event loop."""
+        asyncio.run_coroutine_threadsafe(self._drain(), self.loop).result()
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    async def _drain(self) -> None:
+        current = asyncio.current_task()
+        pending = [task for task in asyncio.all_tasks() if task is not current]
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def download_file(self, file: File, task: FileTask) -> bool:
+        """Asynchronous counterpart of ``download.download_file``."""
+        # The manifest is SQLite and the filesystem may be remote: query them off the loop
+        if await self.loop.run_in_executor(None, download._skip_existing, file, task):
+            return True
+
+        if not file.download_urls:
+            task.fail("no URL", f"[red]✗ {file.filename} (no URL)")
+            return False
+
+        # Finding a local copy may hash files on disk, so do it off the loop
+        if self.link is not None and await self.loop.run_in_executor(None, self.link, file, task):
+            return True
+
+        await self.loop.run_in_executor(None, download._prepare, file)
+
+        # Probing nodes is blocking but happens once per node, so do it off the loop
+        urls = file.download_urls
+        if len(urls) > 1:
+            urls = await self.loop.run_in_executor(None, self.health.rank, urls, self.sessions)
+
+        error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Every replica failed: back off before trying them all again
+                delay = backoff_delay(attempt - 1, retry_after=retry_after(error) if error else None)
+                task.describe(f"[yellow]↻ {file.filename} (retry {attempt} in {delay:.0f}s)")
+                if not await self._sleep(delay):
+                    download._interrupted(file, task)
+                    return False
+                task.describe(f"[cyan]⬇ {file.filename}")
+            for url in urls:
+                try:
+                    if not await self._transfer(file, url, task):
+                        download._interrupted(file, task)
+                        return False
+                    await self.loop.run_in_executor(None, download._complete, file, task)
+                    return True
+                except (aiohttp.ClientError, asyncio.TimeoutError, download.DownloadError) as e:
+                    # Fail over to the next replica, which resumes from the .part file.
+                    # A node answering 429/503 isn't dead, but gets fewer connections.
+                    overloaded = is_throttled(e)
+                    if overloaded or isinstance(e, asyncio.TimeoutError):
+                        self.sessions.backoff(url)
+                    if not overloaded:
+                        self.health.record_failure(url)
+                    task.failed_nodes.append(host_of(url))
+                    error = e
+
+        download._fail(file, task, error)
+        return False
+
+    async def _sleep(self, seconds: float) -> bool:
+        """Asynchronous counterpart of ``download._sleep``. Returns False if interrupted."""
+        try:
+            await asyncio.wait_for(self._interrupt.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            return not download.keyboard_interrupt
+        return False
+
+    async def _acquire(self, url: str) -> None:
+        """Wait for a slot on the data node's (adaptive) limiter without blocking the loop."""
+        limiter = self.sessions.limiter(url)
+        async with self._freed:
+            while not limiter.try_acquire():
+                try:
+                    # Woken when a transfer ends; the timeout catches the limit being raised
+                    await asyncio.wait_for(self._freed.wait(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _release(self, url: str) -> None:
+        """Give back a slot on the data node and wake the transfers waiting for one."""
+        self.sessions.limiter(url).release()
+        async with self._freed:
+            self._freed.notify_all()
+
+    async def _throttle(self, url: str, nbytes: int) -> None:
+        """Asynchronous counterpart of ``SessionPool.throttle``."""
+        self.sessions.limiter(url).add_bytes(nbytes)
+        if self.sessions.bandwidth is not None:
+            delay = self.sessions.bandwidth.reserve(nbytes)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _transfer(self, file: File, url: str, task: FileTask) -> bool:
+        """Asynchronous counterpart of ``download._transfer`` (single stream only)."""
+        part = file.part_path
+        offset = await self.loop.run_in_executor(None, _size_of, part)
+        hasher = new_hasher(file.checksum_type) if file.checksum else None
+
+        start = monotonic()
+        received = 0
+        if not file.size or offset < file.size:
+            await self._acquire(url)
+            try:
+                with task.attempt(url):
+                    requested = monotonic()
+                    response, offset = await self._open_stream(url, offset)
+                    task.ttfb = monotonic() - requested
+                    if hasher is not None and offset:
+                        await self.loop.run_in_executor(None, update_from_file, hasher, part, offset)
+                    async with response:
+                        task.begin(file.size, offset)
+                        f = await self.loop.run_in_executor(None, open, part, 'ab' if offset else 'wb')
+                        buffer = bytearray()
+                        try:
+                            async for chunk in response.content.iter_chunked(64 * 1024):
+                                if download.keyboard_interrupt:  # Check for interrupts during download
+                                    return False
+                                buffer += chunk
+                                if len(buffer) >= WRITE_BUFFER:
+                                    data, buffer = buffer, bytearray()
+                                    await self.loop.run_in_executor(None, _write, f, hasher, data)
+                                received += len(chunk)
+                                task.completed += len(chunk)
+                                await self._throttle(url, len(chunk))
+                        finally:
+                            # Bytes received before an interrupt or a failure are kept to resume from
+                            await self.loop.run_in_executor(None, _write_and_close, f, hasher, buffer)
+            finally:
+                await self._release(url)
+        elif hasher is not None:
+            await self.loop.run_in_executor(None, update_from_file, hasher, part)
+
+        await self.loop.run_in_executor(None, download._check_part, file, hasher)
+        self.health.record_success(url, received, monotonic() - start)
+        return True
+
+    async def _open_stream(self, url: str, offset: int) -> tuple:
+        """Asynchronous counterpart of ``download._open_stream``."""
+        assert self._session is not None, "engine not started"
+        if offset:
+            response = await self._session.get(url, headers={'Range': f"bytes={offset}-"})
+            if response.status == 206 and download._range_start(response) == offset:
+                return response, offset
+            if response.status == 200:
+                # Range ignored: the body is the whole file
+                return response, 0
+            response.release()
+            if response.status not in (206, 416):
+                response.raise_for_status()
+
+        response = await self._session.get(url)
+        response.raise_for_status()
+        return response, 0
+
+
+def _size_of(path: Path) -> int:
+    """Size of a file, or 0 if it doesn't exist."""
+    return path.stat().st_size if path.exists() else 0
+
+
+def _write(f: BinaryIO, hasher, data: bytes) -> None:
+    """Append received bytes to a .part file and the running checksum."""
+    f.write(data)
+    if hasher is not None:
+        hasher.update(data)
+
+
+def _write_and_close(f: BinaryIO, hasher, data: bytes) -> None:
+    """Write the last received bytes of a transfer and close its .part file."""
+    try:
+        if data:
+            _write(f, hasher, data)
+    finally:
+        f.close()
@@ -0,0 +1,161 @@
+"""
+Persistent on-disk cache for ESGF search and file-listing results.
+"""
+
+import json
+import sqlite3
+import threading
+from time import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+
+class SearchCache:
+    """
+    SQLite-backed cache of the json documents returned by ESGF searches.
+
+    Dataset searches are keyed by the search node and the normalised query dict,
+    file listings by dataset ID. Entries expire after ``ttl`` seconds, and the least
+    recently used entries are evicted once the cache grows beyond ``max_size`` bytes.
+    """
+
+    def __init__(self, path: Path, ttl: float = 24 * 3600, max_size: int = 256 * 1024**2,
+                 refresh: bool = False):
+
+        """
+        Open (or create) the cache database.
+
+        Parameters
+        ----------
+        path : Path
+            Path to the SQLite database file.
+        ttl : float, optional
+            Time to live of an entry in seconds. Default is 24 hours.
+        max_size : int, optional
+            Maximum total size of cached documents in bytes. Default is 256 MB.
+        refresh : bool, optional
+            If True, ignore existing entries (but still write new ones). Default is False.
+        """
+
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.refresh = refresh
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    dataset_ids TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    @staticmethod
+    def search_key(search_node: str, query: dict) -> str:
+        """Cache key for a dataset search, independent of facet and value ordering."""
+        normalised = {
+            key: sorted(str(v) for v in value) if isinstance(value, (list, tuple, set)) else value
+            for key, value in query.items()
+        }
+        return "search:" + json.dumps([search_node, normalised], sort_keys=True, default=str)
+
+    @staticmethod
+    def files_key(dataset_id: str) -> str:
+        """Cache key for the file listing of a dataset."""
+        return f"files:{dataset_id}"
+
+    def get(self, key: str) -> Optional[list]:
+        """Return the cached documents for a key, or None if missing or expired."""
+        if self.refresh:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            now = time()
+            if now - created > self.ttl:
+                with self._conn:
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def put(self, key: str, docs: list, dataset_ids: Iterable[str]) -> None:
+        """Store a list of json documents under a key."""
+        value = json.dumps(docs)
+        # Newline-delimited so that a single dataset can be matched with instr()
+        ids = "\n" + "\n".join(dataset_ids) + "\n"
+        now = time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (key, ids, value, len(value), now, now),
+            )
+            self._evict()
+
+    def get_search(self, search_node: str, query: dict) -> Optional[list]:
+        """Cached dataset documents for a search query."""
+        return self.get(self.search_key(search_node, query))
+
+    def put_search(self, search_node: str, query: dict, docs: list) -> None:
+        """Cache the dataset documents returned by a search query."""
+        self.put(self.search_key(search_node, query), docs, [doc.get('id', '') for doc in docs])
+
+    def get_files(self, dataset_id: str) -> Optional[list]:
+        """Cached file documents for a dataset."""
+        return self.get(self.files_key(dataset_id))
+
+    def put_files(self, dataset_id: str, docs: list) -> None:
+        """Cache the file documents of a dataset."""
+        self.put(self.files_key(dataset_id), docs, [dataset_id])
+
+    def invalidate(self, dataset_id: str) -> int:
+        """
+        Remove the file listing of a dataset and every search that returned it.
+
+        Parameters
+        ----------
+        dataset_id : str
+            Dataset ID, with or without the ``|data_node`` suffix.
+
+        Returns
+        -------
+        int
+            Number of entries removed
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM entries WHERE instr(dataset_ids, ?) > 0 OR instr(dataset_ids, ?) > 0",
+                (f"\n{dataset_id}\n", f"\n{dataset_id}|"),
+            )
+        return cursor.rowcount
+
+    def _evict(self) -> None:
+        """Delete the least recently used entries until the cache fits in max_size."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
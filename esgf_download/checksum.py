@@ -0,0 +1,114 @@
+"""
+Checksum helpers for verifying downloaded files against ESGF metadata.
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from rich.progress import Progress, BarColumn, TextColumn, TaskProgressColumn, TimeRemainingColumn
+
+# local imports
+from esgf_download.classes import File
+from esgf_download.console import console
+
+CHUNK_SIZE = 1024 * 1024  # 1MB reads when hashing files on disk
+
+
+def new_hasher(checksum_type: Optional[str]):
+    """
+    Create a hashlib object for an ESGF checksum type (e.g. 'SHA256', 'MD5').
+
+    Returns
+    -------
+    hashlib hash object | None
+        None if the checksum type is missing or not supported by hashlib
+    """
+    if not checksum_type:
+        return None
+    try:
+        return hashlib.new(checksum_type.lower().replace('-', ''))
+    except ValueError:
+        return None
+
+
+def update_from_file(hasher, path: Path, length: Optional[int] = None) -> None:
+    """Feed the first ``length`` bytes (or all) of a file into a hasher."""
+    remaining = length
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+
+
+def file_checksum(path: Path, checksum_type: str) -> Optional[str]:
+    """Hex digest of a file on disk, or None if the checksum type is unsupported."""
+    hasher = new_hasher(checksum_type)
+    if hasher is None:
+        return None
+    update_from_file(hasher, path)
+    return hasher.hexdigest()
+
+
+def matches(hasher, checksum: Optional[str]) -> bool:
+    """Whether a hasher's digest matches an expected checksum (True if either is missing)."""
+    if hasher is None or not checksum:
+        return True
+    return hasher.hexdigest() == checksum.lower()
+
+
+def _check(path: str, checksum_type: str, checksum: str) -> tuple[str, bool]:
+    """Process pool job: hash one file and compare it with its expected checksum."""
+    digest = file_checksum(Path(path), checksum_type)
+    return path, digest is None or digest == checksum.lower()
+
+
+def verify_files(files: list[File], workers: Optional[int] = None) -> tuple[list[File], int]:
+
+    """
+    Hash existing local files in parallel and compare them with their ESGF checksums.
+
+    Parameters
+    ----------
+    files : list[File]
+        Files to verify. Files that don't exist locally are ignored.
+    workers : int, optional
+        Number of hashing processes. Defaults to the number of CPUs.
+
+    Returns
+    -------
+    tuple[list[File], int]
+        The corrupt files, and the number of existing files with no usable checksum
+    """
+
+    present = [file for file in files if file.local_path.exists()]
+    checkable = [file for file in present if file.checksum and new_hasher(file.checksum_type)]
+    by_path = {str(file.local_path): file for file in checkable}
+    corrupt = []
+
+    with Progress(
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        TaskProgressColumn(),
+        TimeRemainingColumn(),
+        console=console,
+        transient=True,
+    ) as progress, ProcessPoolExecutor(max_workers=workers) as executor:
+        task_id = progress.add_task("[cyan]🔍 Verifying checksums", total=sum(f.size or 0 for f in checkable))
+        futures = {
+            executor.submit(_check, path, file.checksum_type, file.checksum): file
+            for path, file in by_path.items()
+        }
+        for future in as_completed(futures):
+            path, ok = future.result()
+            file = futures[future]
+            if not ok:
+                corrupt.append(file)
+            progress.update(task_id, advance=file.size or 0)
+
+    return sorted(corrupt, key=lambda f: str(f.local_path)), len(present) - len(checkable)
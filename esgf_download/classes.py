@@ -1,56 +1,113 @@
 import os
 import re
+import sys
 from pathlib import Path
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 from datetime import datetime
 from pyesgf.search.results import FileResult, DatasetResult # type: ignore
 
-class Dataset(DatasetResult):
+if TYPE_CHECKING:
+    from esgf_download.cache import SearchCache
+    from esgf_download.manifest import Manifest
+    from esgf_download.subset import Subset
 
-    def __init__(self, dataset: DatasetResult, data_home: Path = Path(".")):
+def _iso_date(value: Optional[str]) -> Optional[datetime]:
+    """Datetime of an ISO 8601 date from the index, or None if there is none."""
+    if not value:
+        return None
+    # remove Z from end to make it a valid ISO 8601 string
+    return datetime.fromisoformat(value.replace('Z', ''))
+
+
+def _first(value):
+    """First value of a multi-valued facet of an index document."""
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+class Dataset:
+    """
+    A dataset to download, holding only the metadata of its search result that
+    the downloader uses. The result's JSON document is not kept, so that plans
+    of many datasets stay small in memory.
+    """
+
+    __slots__ = (
+        'dataset_id', 'version', 'model', 'instance_id', 'index_node', 'start_date', 'end_date',
+        'time_range', 'subset', 'data_home', 'cache', 'manifest',
+        '_search', '_all_files', '_files', '_local_path', '_completed',
+    )
+
+    def __init__(self, dataset: DatasetResult, data_home: Path = Path("."),
+                 cache: Optional["SearchCache"] = None, manifest: Optional["Manifest"] = None,
+                 time_range: Optional[tuple] = None, subset: Optional["Subset"] = None):
 
-        # Copy all attributes from the original DatasetResult
-        self.__dict__.update(dataset.__dict__)
+        doc = dataset.json
+        self.dataset_id: str = dataset.dataset_id
+        self.version: Optional[str] = doc.get('version')
+        self.model: Optional[str] = _first(doc.get('source_id'))
+        self.instance_id: Optional[str] = doc.get('instance_id')
+        self.index_node: Optional[str] = doc.get('index_node')
+        self.start_date = _iso_date(doc.get('datetime_start'))
+        # Try datetime_stop first, then datetime_end
+        self.end_date = _iso_date(doc.get('datetime_stop') or doc.get('datetime_end'))
+        # Search context of the result, shared by every result of its search, to
+        # search for the dataset's files
+        self._search = dataset.context
+        self._all_files: Optional[list] = None  # Cache for the full file listing
         self._files: Optional[list] = None  # Cache for files
+        # (start year, end year) of the files wanted, either may be None; must be
+        # set before files is first read
+        self.time_range = time_range
+        self.subset = subset  # region to subset over OPeNDAP instead of downloading whole files
         self._local_path: Optional[Path] = None  # Cache for local path
         self.data_home = data_home
+        self.cache = cache  # On-disk cache for the file listing
+        self.manifest = manifest  # Record of completely downloaded files
+        self._completed: Optional[dict] = None  # Cache for manifest entries
 
     @property
     def files(self) -> list:
 
         """
-        Searches ESGF for files in the dataset and returns a list of File objects
-        sorted by start date in chronological order.
-        Caches the files in the instance variable _files.
+        Files of the dataset to download: those overlapping the dataset's time
+        range if it has one, otherwise all of them, in chronological order.
         """
 
         if self._files is None:
-            search = self.file_context().search(ignore_facet_check=True)
-            file_objects = [File(item, self) for item in search]
-            # Sort files by start_date (chronological order)
-            self._files = sorted(file_objects, key=lambda f: f.filename)
+            if self.time_range is None:
+                self._files = self.all_files
+            else:
+                self._files = [file for file in self.all_files if file.overlaps(self.time_range)]
         return self._files
-    
-    @property
-    def start_date(self) -> Optional[datetime]:
-        """Get the start date of the dataset."""
-        start = self.json.get('datetime_start')
-        if start:
-            # remove Z from end to make it a valid ISO 8601 string
-            start_iso = start.replace('Z', '')
-            return datetime.fromisoformat(start_iso)
-        return None
-    
+
     @property
-    def end_date(self) -> Optional[datetime]:
-        """Get the end date of the dataset."""
-        # Try datetime_stop first, then datetime_end
-        stop = self.json.get('datetime_stop') or self.json.get('datetime_end')
-        if stop:
-            # remove Z from end to make it a valid ISO 8601 string
-            stop_iso = stop.replace('Z', '')
-            return datetime.fromisoformat(stop_iso)
-        return None
+    def all_files(self) -> list:
+
+        """
+        Searches ESGF for files in the dataset and returns a list of File objects
+        sorted by start date in chronological order.
+        Caches the files in the instance variable _all_files, and in the on-disk
+        cache if there is one.
+        """
+
+        if self._all_files is None:
+            docs = self.cache.get_files(self.dataset_id) if self.cache is not None else None
+            if docs is not None:
+                items = [FileResult(doc, None) for doc in docs]
+            else:
+                items = list(self.file_context().search(ignore_facet_check=True))
+                if self.cache is not None:
+                    self.cache.put_files(self.dataset_id, [item.json for item in items])
+            file_objects = [File(item, self) for item in items]
+            # Sort files by start_date (chronological order)
+            self._all_files = sorted(file_objects, key=lambda f: f.filename)
+        return self._all_files
+
+    def file_context(self):
+        """Search context for the files of this dataset, restricted to its index node as pyesgf does."""
+        return DatasetResult({'id': self.dataset_id, 'index_node': self.index_node}, self._search).file_context()
 
     @property
     def local_path(self) -> Path:
@@ -74,22 +131,86 @@ class Dataset(DatasetResult):
             self._local_path = self.data_home / Path(*identifiers)
         return self._local_path
 
+    @property
+    def completed_files(self) -> dict:
+        """
+        Manifest entries of this dataset's completely downloaded files, loaded with
+        a single query and cached. Empty if there is no manifest.
+        """
+        if self._completed is None:
+            self._completed = self.manifest.completed(self.dataset_id) if self.manifest is not None else {}
+        return self._completed
+
     def exists(self) -> bool:
         """Check if all files in this dataset already exist locally."""
         if len(self.files) == 0:
             return False
         return all(file.exists() for file in self.files)
 
+    def record(self, file: "File", verified: bool = True) -> None:
+        """Record a completely downloaded file of this dataset in the manifest."""
+        if self.manifest is None:
+            return
+        self.manifest.record(file, verified)
+        self.completed_files[file.local_path.name] = (file.local_size, file.checksum if verified else None)
+
     def is_empty(self) -> bool:
         """Check if the dataset is empty."""
         return len(self.files) == 0
 
-class File(FileResult):
+    def add_replicas(self, replicas: list) -> None:
+        """
+        Add the download URLs of replicas of this dataset to its files.
+
+        Replica files are matched by filename, and skipped if their checksum
+        differs from the one of this dataset's file.
+
+        Parameters
+        ----------
+        replicas : list[Dataset]
+            Other copies of this dataset on different data nodes
+        """
+        by_name = {file.filename: file for file in self.files}
+        for replica in replicas:
+            for replica_file in replica.files:
+                file = by_name.get(replica_file.filename)
+                if file is None or not replica_file.download_urls:
+                    continue
+                if file.checksum and replica_file.checksum and file.checksum != replica_file.checksum:
+                    continue
+                for url in replica_file.download_urls[:1]:
+                    if url not in file.download_urls:
+                        file.download_urls.append(url)
+                for url in replica_file.opendap_urls[:1]:
+                    if url not in file.opendap_urls:
+                        file.opendap_urls.append(url)
+
+class File:
+    """
+    A file to download, holding only the fields of its search result that the
+    downloader uses, parsed once. The result's JSON document is not kept.
+    """
+
+    __slots__ = (
+        'dataset', 'filename', 'size', 'checksum', 'checksum_type', 'download_urls', 'opendap_urls',
+        '_start_date', '_end_date',
+    )
 
     def __init__(self, file: FileResult, dataset: Dataset):
-        self.__dict__.update(file.__dict__)
         self.dataset = dataset
-        self.local_path: Path = self.dataset.local_path / self.filename
+        self.filename: str = file.filename
+        self.size: Optional[int] = file.size
+        self.checksum: Optional[str] = file.checksum
+        # A handful of algorithm names, shared by every file
+        self.checksum_type: Optional[str] = sys.intern(file.checksum_type) if file.checksum_type else None
+        download_url, opendap_url = file.download_url, file.opendap_url
+        # Download URLs of every known replica, preferred data node first
+        self.download_urls: list[str] = [download_url] if download_url else []
+        # OPeNDAP URLs of every known replica, for subsetting
+        self.opendap_urls: list[str] = [opendap_url] if opendap_url else [
+            url.replace('/thredds/fileServer/', '/thredds/dodsC/')
+            for url in self.download_urls[:1] if '/thredds/fileServer/' in url
+        ]
         self._start_date: Optional[datetime] = None  # cache for start_date
         self._end_date: Optional[datetime] = None  # cache for end_date
     
@@ -107,13 +228,83 @@ class File(FileResult):
             self._start_date, self._end_date = self._date_range()
         return self._end_date
         
+    @property
+    def local_path(self) -> Path:
+        """Path of the downloaded file, or of its subset if the dataset is subset."""
+        subset = self.dataset.subset
+        return self.dataset.local_path / (self.filename if subset is None else subset.filename(self.filename))
+
+    @property
+    def local_size(self) -> Optional[int]:
+        """Size of the complete local file: the remote size, or the size on disk of a subset."""
+        if self.dataset.subset is None:
+            return self.size
+        return self.local_path.stat().st_size
+
+    @property
+    def part_path(self) -> Path:
+        """Staging path the file is downloaded to before being moved into place."""
+        local_path = self.local_path
+        return local_path.with_name(local_path.name + '.part')
+
+    @property
+    def segments_path(self) -> Path:
+        """Sidecar recording the progress of a segmented download of the .part file."""
+        local_path = self.local_path
+        return local_path.with_name(local_path.name + '.part.segments')
+
+    @property
+    def lease_path(self) -> Path:
+        """Lease claiming the file for one shard of a sharded download."""
+        local_path = self.local_path
+        return local_path.with_name(local_path.name + '.lease')
+
+    def overlaps(self, time_range: tuple) -> bool:
+        """
+        Whether the file's dates overlap a (start year, end year) range, inclusive.
+        Either year may be None for an open range. Files without a date range in
+        their name (e.g. fixed fields) always overlap.
+        """
+        start, end = time_range
+        try:
+            first, last = self.start_date, self.end_date
+        except ValueError:
+            return True
+        return (start is None or last.year >= start) and (end is None or first.year <= end)
+
     def exists(self) -> bool:
-        return self.local_path.exists()
+        """
+        Check if the complete file exists locally.
+
+        Answered from the manifest when the file is recorded there. Otherwise the
+        file is checked on disk, and recorded (unverified) if it is complete.
+        Subsets are only moved into place once complete, so any size will do.
+        """
+        local_path = self.local_path
+        expected = self.size if self.dataset.subset is None else None
+        entry = self.dataset.completed_files.get(local_path.name)
+        if entry is not None:
+            size, checksum = entry
+            if (not expected or size == expected) and (not checksum or not self.checksum
+                                                      or checksum == self.checksum):
+                return True
+        try:
+            stat = local_path.stat()
+        except FileNotFoundError:
+            return False
+        complete = not expected or stat.st_size == expected
+        if complete and entry is None:
+            self.dataset.record(self, verified=False)
+        return complete
     
     def remove(self) -> None:
-        """Delete the downloaded file if it exists."""
-        if self.exists():
-            os.remove(self.local_path)
+        """Delete the downloaded file and any partial download."""
+        for path in (self.local_path, self.part_path, self.segments_path):
+            if path.exists():
+                os.remove(path)
+        if self.dataset.manifest is not None:
+            self.dataset.manifest.forget(self)
+            self.dataset.completed_files.pop(self.local_path.name, None)
     
     def _date_range(self) -> tuple[datetime, datetime]:
         """
@@ -2,9 +2,15 @@
 Shared rich console instance for consistent formatting throughout the package.
 """
 
+import sys
 from rich.console import Console
 
 # Shared rich console instance for consistent formatting
 console = Console()
 
-MAX_DISPLAY_ROWS = 40 # max number of rows to display in progress bar
\ No newline at end of file
+MAX_DISPLAY_ROWS = 40 # max number of rows to display in progress bar
+
+
+def use_stderr() -> None:
+    """Send console messages to stderr, leaving stdout to machine-readable output."""
+    console.file = sys.stderr
@@ -0,0 +1,409 @@
+"""
+Consolidation of downloaded datasets: the per-period files of a complete dataset
+are appended, in chronological order, to a single chunked and compressed Zarr
+or NetCDF4 store next to them, so that analyses open one store instead of
+concatenating dozens of files.
+
+Selected with the ``consolidate`` section of the config file. Requires netCDF4,
+and zarr for Zarr stores (``pip install esgf-download[consolidate]``). Datasets
+are consolidated in a pool of worker processes while the run goes on.
+"""
+
+import json
+import shutil
+import threading
+from pathlib import Path
+from typing import Optional
+from concurrent.futures import Future
+
+try:
+    import numpy as np # type: ignore
+    import netCDF4 # type: ignore
+except ImportError:  # optional dependency
+    netCDF4 = None
+
+try:
+    import zarr # type: ignore
+except ImportError:  # optional dependency
+    zarr = None
+
+# local imports
+import esgf_download.download as download
+from esgf_download.classes import Dataset
+from esgf_download.console import console
+from esgf_download.subset import axis_of, related_variables, copy_blocks, spawn_pool
+
+FORMATS = {'zarr': '.zarr', 'netcdf': '.nc'}
+
+# Attributes of a store recording which files it holds, in order
+SOURCES_ATTR = 'esgf_download_sources'
+LENGTH_ATTR = 'esgf_download_length'
+TIME_ATTR = 'esgf_download_time_dim'
+
+
+class Consolidator:
+    """
+    Consolidates complete datasets in the background, in a pool of worker
+    processes. Stores are updated incrementally: only files that aren't in a
+    dataset's store yet are appended.
+    """
+
+    def __init__(self, fmt: str = 'zarr', chunks: Optional[dict] = None, compression: int = 4,
+                 workers: int = 2, chunk_bytes: int = 64 * 1024**2):
+
+        """
+        Parameters
+        ----------
+        fmt : str, optional
+            'zarr' (default) or 'netcdf'.
+        chunks : dict, optional
+            Chunk size of the store along each dimension, by dimension name.
+            Dimensions not listed are not split. Default is 12 time steps.
+        compression : int, optional
+            zlib level of NetCDF4 stores, 0 for none. Zarr stores use zarr's
+            default compressor. Default is 4.
+        workers : int, optional
+            Number of datasets consolidated at once. Default is 2.
+        chunk_bytes : int, optional
+            Upper bound on the bytes held in memory by each read. Default is 64 MB.
+        """
+
+        if netCDF4 is None:
+            raise ImportError("Consolidation requires netCDF4: pip install esgf-download[consolidate]")
+        if fmt == 'zarr' and zarr is None:
+            raise ImportError("Zarr consolidation requires zarr: pip install esgf-download[consolidate]")
+        self.fmt = fmt
+        self.chunks = chunks or {'time': 12}
+        self.compression = compression
+        self.chunk_bytes = chunk_bytes
+        self._processes = spawn_pool(workers)
+        self._lock = threading.Lock()
+        self._pending: dict[Path, Future] = {}
+        self.datasets = 0  # datasets whose store was updated
+        self.files = 0     # files appended to stores
+
+    def path(self, dataset: Dataset) -> Path:
+        """
+        Store of a dataset, in its version directory and named after its files
+        without their dates, e.g. ``tas_Amon_<model>_<experiment>_<variant>_gn.zarr``.
+        """
+        stem, *suffixes = dataset.files[0].local_path.name.split('.')
+        parts = stem.split('_')
+        if len(parts) > 1 and parts[-1][:1].isdigit():
+            parts = parts[:-1]
+        # Keep a subset's tag, so that different subsets get different stores
+        tags = [suffix for suffix in suffixes if suffix.startswith('subset-')]
+        return dataset.local_path / ('.'.join(['_'.join(parts), *tags]) + FORMATS[self.fmt])
+
+    def submit(self, dataset: Dataset) -> None:
+        """Append the files of a complete dataset that aren't in its store yet, in the background."""
+        files = dataset.files
+        if not files:
+            return
+        out = self.path(dataset)
+        with self._lock:
+            pending = self._pending.get(out)
+            if pending is not None and not pending.done():
+                return
+            future = self._processes.submit(
+                consolidate, [str(file.local_path) for file in files], files[0].filename.split('_')[0],
+                str(out), self.fmt, self.chunks, self.compression, self.chunk_bytes,
+            )
+            self._pending[out] = future
+        future.add_done_callback(lambda f, dataset_id=dataset.dataset_id: self._done(dataset_id, f))
+
+    def _done(self, dataset_id: str, future: Future) -> None:
+        id, _ = dataset_id.split('|')
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            console.print(f"[red]✗ Could not consolidate {id}:[/red] {error}")
+            return
+        appended = future.result()
+        if appended:
+            with self._lock:
+                self.datasets += 1
+                self.files += appended
+            console.print(f"[green]🧱 {id}[/green] [dim](consolidated {appended} new files)[/dim]")
+
+    def close(self) -> None:
+        """Wait for the datasets being consolidated (unless interrupted) and stop the workers."""
+        self._processes.shutdown(wait=True, cancel_futures=download.keyboard_interrupt)
+        if self.files:
+            console.print(
+                f"[blue]🧱 Consolidated {self.files} new files into {self.datasets} {self.fmt} stores[/blue]"
+            )
+
+
+def consolidate(paths: list, variable: str, out: str, fmt: str, chunks: dict,
+                compression: int, chunk_bytes: int) -> int:
+    """
+    Append the files of a dataset that aren't in its store yet to the store,
+    creating it if needed. Runs in a worker process.
+
+    The store records the names of the files it holds and its length along
+    time after each file. If those no longer match the dataset (a file was added
+    before the end, or an append was interrupted), the store is rebuilt.
+
+    Parameters
+    ----------
+    paths : list[str]
+        Files of the dataset, in chronological order
+    variable : str
+        Name of the data variable
+    out : str
+        Path of the store
+    fmt : str
+        'zarr' or 'netcdf'
+    chunks : dict
+        Chunk size along each dimension, by dimension name
+    compression : int
+        zlib level of NetCDF4 stores
+    chunk_bytes : int
+        Upper bound on the bytes of each read
+
+    Returns
+    -------
+    int
+        Number of files appended
+    """
+    out_path = Path(out)
+    names = [Path(path).name for path in paths]
+    store = _open_store(out_path, fmt)
+    done: list = []
+    if store is not None:
+        done = store.sources()
+        if names[:len(done)] != done or store.length() != store.recorded_length():
+            store.close()
+            _remove(out_path)
+            store, done = None, []
+
+    appended = 0
+    try:
+        for path in paths[len(done):]:
+            with netCDF4.Dataset(path) as src:
+                src.set_auto_maskandscale(False)
+                var = src.variables[variable]
+                time_dim = next((dim for dim in var.dimensions if axis_of(src, dim) == 'T'), None)
+                if time_dim is None:
+                    raise ValueError(f"{variable} has no time dimension to concatenate along")
+                related = related_variables(src, var)
+                if store is None:
+                    store = _create_store(out_path, fmt, src, related, time_dim, chunks, compression, chunk_bytes)
+                _append(store, src, related, time_dim, chunk_bytes)
+            done.append(Path(path).name)
+            store.save(done)
+            appended += 1
+    finally:
+        if store is not None:
+            store.close()
+    return appended
+
+
+def _append(store, src, names: list, time_dim: str, chunk_bytes: int) -> None:
+    """Append the time steps of a source file to every time-dependent variable of a store."""
+    offset = store.length()
+    steps = len(src.dimensions[time_dim])
+    store.grow(offset + steps)
+    time = src.variables[time_dim]
+    units, calendar = store.time_units()
+    time_bounds = getattr(time, 'bounds', None)
+    for name in names:
+        source = src.variables[name]
+        if time_dim not in source.dimensions:
+            continue
+        if name in (time_dim, time_bounds):
+            # Files may count time from different reference dates: convert to the store's
+            values = source[:]
+            source_units = getattr(time, 'units', units)
+            if units and source_units != units:
+                dates = netCDF4.num2date(values, source_units, calendar)
+                values = netCDF4.date2num(dates, units, calendar).astype(source.dtype)
+            store[name][offset:offset + steps] = values
+        else:
+            copy_blocks(source, store[name], {}, chunk_bytes, {time_dim: offset})
+
+
+def _plain(value):
+    """An attribute value as plain Python data."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _chunking(source, src, time_dim: str, chunks: dict) -> tuple:
+    sizes = []
+    for dim in source.dimensions:
+        size = len(src.dimensions[dim])
+        wanted = chunks.get(dim, 1 if dim == time_dim else size)
+        sizes.append(max(1, min(int(wanted), size) if dim != time_dim else int(wanted)))
+    return tuple(sizes)
+
+
+def _open_store(path: Path, fmt: str):
+    """An existing store, or None if there is none."""
+    if not path.exists():
+        return None
+    if fmt == 'netcdf':
+        return _NetCDFStore(netCDF4.Dataset(path, 'a'))
+    return _ZarrStore(path, _zarr_group(path, 'a'))
+
+
+def _create_store(path: Path, fmt: str, src, names: list, time_dim: str, chunks: dict,
+                  compression: int, chunk_bytes: int):
+    """A new store with the variables of a source file, time-independent ones already written."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == 'netcdf':
+        store = _NetCDFStore.create(path, src, names, time_dim, chunks, compression)
+    else:
+        store = _ZarrStore.create(path, src, names, time_dim, chunks)
+    for name in names:
+        source = src.variables[name]
+        if time_dim not in source.dimensions:
+            copy_blocks(source, store[name], {}, chunk_bytes)
+    return store
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+
+
+class _NetCDFStore:
+    """A NetCDF4 store, with an unlimited time dimension."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.dataset.set_auto_maskandscale(False)
+        self.time_dim = self.dataset.getncattr(TIME_ATTR)
+
+    @classmethod
+    def create(cls, path: Path, src, names: list, time_dim: str, chunks: dict, compression: int):
+        dataset = netCDF4.Dataset(path, 'w', format='NETCDF4')
+        dataset.setncatts({key: src.getncattr(key) for key in src.ncattrs()})
+        dataset.setncattr(TIME_ATTR, time_dim)
+        dims = dict.fromkeys(dim for name in names for dim in src.variables[name].dimensions)
+        for dim in dims:
+            dataset.createDimension(dim, None if dim == time_dim else len(src.dimensions[dim]))
+        for name in names:
+            source = src.variables[name]
+            attributes = {key: source.getncattr(key) for key in source.ncattrs()}
+            fill_value = attributes.pop('_FillValue', None)
+            target = dataset.createVariable(
+                name, source.dtype, source.dimensions, zlib=compression > 0, complevel=compression or None,
+                chunksizes=_chunking(source, src, time_dim, chunks) if source.dimensions else None,
+                fill_value=fill_value,
+            )
+            target.setncatts(attributes)
+        return cls(dataset)
+
+    def sources(self) -> list:
+        return json.loads(getattr(self.dataset, SOURCES_ATTR, '[]'))
+
+    def recorded_length(self) -> int:
+        return int(getattr(self.dataset, LENGTH_ATTR, 0))
+
+    def length(self) -> int:
+        return len(self.dataset.dimensions[self.time_dim])
+
+    def time_units(self) -> tuple:
+        time = self.dataset.variables[self.time_dim]
+        return getattr(time, 'units', None), getattr(time, 'calendar', 'standard')
+
+    def grow(self, length: int) -> None:
+        """The unlimited dimension grows as it is written."""
+
+    def __getitem__(self, name: str):
+        return self.dataset.variables[name]
+
+    def save(self, sources: list) -> None:
+        self.dataset.setncattr(SOURCES_ATTR, json.dumps(sources))
+        self.dataset.setncattr(LENGTH_ATTR, self.length())
+        self.dataset.sync()
+
+    def close(self) -> None:
+        self.dataset.close()
+
+
+def _zarr_3() -> bool:
+    return int(zarr.__version__.split('.')[0]) >= 3
+
+
+def _zarr_group(path: Path, mode: str):
+    """
+    Open a Zarr group in the version 2 format, which every xarray version reads.
+    zarr 3 would otherwise open it from its consolidated metadata, whose array
+    shapes go stale as the arrays are resized.
+    """
+    if _zarr_3():
+        return zarr.open_group(str(path), mode=mode, zarr_format=2, use_consolidated=False)
+    return zarr.open_group(str(path), mode=mode)
+
+
+class _ZarrStore:
+    """
+    A Zarr store laid out as xarray expects (dimension names in each array's
+    ``_ARRAY_DIMENSIONS``), with consolidated metadata.
+    """
+
+    def __init__(self, path: Path, group):
+        self.path = path
+        self.group = group
+        self.time_dim = self.group.attrs[TIME_ATTR]
+        # The arrays are resized and written through the same objects, which
+        # hold their shape
+        self.arrays = {name: self.group[name] for name in self.group.array_keys()}
+
+    @classmethod
+    def create(cls, path: Path, src, names: list, time_dim: str, chunks: dict):
+        group = _zarr_group(path, 'w')
+        group.attrs.update({key: _plain(src.getncattr(key)) for key in src.ncattrs()})
+        group.attrs[TIME_ATTR] = time_dim
+        for name in names:
+            source = src.variables[name]
+            attributes = {key: _plain(source.getncattr(key)) for key in source.ncattrs()}
+            fill_value = attributes.pop('_FillValue', None)
+            shape = tuple(0 if dim == time_dim else len(src.dimensions[dim]) for dim in source.dimensions)
+            create = group.create_array if _zarr_3() else group.create_dataset
+            target = create(
+                name, shape=shape, chunks=_chunking(source, src, time_dim, chunks) or shape,
+                dtype=source.dtype, fill_value=fill_value,
+            )
+            target.attrs.update({**attributes, '_ARRAY_DIMENSIONS': list(source.dimensions)})
+        return cls(path, group)
+
+    def sources(self) -> list:
+        return list(self.group.attrs.get(SOURCES_ATTR, []))
+
+    def recorded_length(self) -> int:
+        return int(self.group.attrs.get(LENGTH_ATTR, 0))
+
+    def length(self) -> int:
+        return self.arrays[self.time_dim].shape[0]
+
+    def time_units(self) -> tuple:
+        attributes = self.arrays[self.time_dim].attrs
+        return attributes.get('units'), attributes.get('calendar', 'standard')
+
+    def grow(self, length: int) -> None:
+        """Resize every array along time, so that the new steps can be written."""
+        for array in self.arrays.values():
+            dims = array.attrs['_ARRAY_DIMENSIONS']
+            if self.time_dim in dims:
+                shape = list(array.shape)
+                shape[dims.index(self.time_dim)] = length
+                array.resize(tuple(shape))
+
+    def __getitem__(self, name: str):
+        return self.arrays[name]
+
+    def save(self, sources: list) -> None:
+        self.group.attrs.update({SOURCES_ATTR: sources, LENGTH_ATTR: self.length()})
+
+    def close(self) -> None:
+        zarr.consolidate_metadata(str(self.path))
@@ -1,85 +1,800 @@
+import os
+import re
+import json
+import threading
 import requests
-from time import sleep
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, \
-    TaskProgressColumn, TimeRemainingColumn, TaskID
+from time import sleep, monotonic
+from queue import Empty
+from pathlib import Path
+from typing import Callable, Optional, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 # local imports
 from esgf_download.classes import Dataset, File
-from esgf_download.console import console, MAX_DISPLAY_ROWS
+from esgf_download.progress import FileTask, ProgressTracker, RichRenderer, JsonRenderer
+from esgf_download.sessions import SessionPool, host_of
+from esgf_download.checksum import new_hasher, update_from_file, matches
+from esgf_download.mirrors import NodeHealth
+from esgf_download.shards import Shard
+from esgf_download.metrics import RunMetrics
+from esgf_download.versions import VersionSync
+from esgf_download.store import BlobStore
+from esgf_download.priority import FileOrder, FileQueue
+from esgf_download.throttle import TokenBucket, backoff_delay, is_throttled, retry_after
+
+if TYPE_CHECKING:
+    from esgf_download.consolidate import Consolidator
 
 
 # Global keyboard_interrupt instance for thread-safe interrupt handling
 keyboard_interrupt = False
 
-def download_file(file: File, progress: Progress, task_id: TaskID) -> None:
+# (connect, read) timeouts in seconds - a read timeout means the transfer stalled
+TIMEOUT = (15, 60)
+
+
+class DownloadError(Exception):
+    """Raised when a transfer finishes without producing a complete file."""
+
+
+class _RangeIgnored(DownloadError):
+    """Raised by a segment whose data node answers with the whole file instead of its range."""
+
+
+def download_file(file: File, task: FileTask,
+                  sessions: Optional[SessionPool] = None,
+                  health: Optional[NodeHealth] = None,
+                  segments: int = 1, segment_threshold: int = 0, retries: int = 0) -> bool:
     
     """
     Downloads a single file from ESGF to a local directory.
 
+    The file's replica URLs are tried from the fastest data node to the slowest,
+    failing over to the next replica on errors or stalls. If every replica fails,
+    the whole round is retried up to ``retries`` times after a jittered backoff.
+
     Parameters
     ----------
     file : File
         File object to download from ESGF.
-    progress : Progress
-        Progress object to track download progress in ui.
-    task_id : TaskID
-        Pre-created task ID for this file's progress tracking.
+    task : FileTask
+        Progress counters of this file, sampled by the progress display.
+    sessions : SessionPool, optional
+        Pooled per-host sessions to download through. A private pool is used
+        if not given.
+    health : NodeHealth, optional
+        Data node health shared across the run. A private one is used if not given.
+    segments : int, optional
+        Number of byte ranges to fetch concurrently for large files. Default is 1
+        (no segmentation).
+    segment_threshold : int, optional
+        Minimum file size in bytes for segmented download. Default is 0.
+    retries : int, optional
+        Number of times to retry after every replica has failed. Default is 0.
+
+    Returns
+    -------
+    bool
+        True if the file is present locally afterwards, False otherwise.
     """
 
     
-    # Check if file already exists locally
-    if file.exists():
-        if len(file.dataset.files) > MAX_DISPLAY_ROWS:
-            progress.remove_task(task_id)
-            return
-        progress.update(task_id, description=f"[yellow]⚠ {file.filename} (already exists)")
-        progress.update(task_id, completed=file.size or 100)
-        return
-
-    url = file.download_url
-    if not url:
-        progress.update(task_id, description=f"[red]✗ {file.filename} (no URL)")
-        return
-
-    filename = file.filename
-    filepath = file.local_path
-    filepath.parent.mkdir(parents=True, exist_ok=True)
-    
-    # Update the pre-created task description to show it's starting
-    progress.update(task_id, description=f"[cyan]⬇ {filename}")
-    
+    if _skip_existing(file, task):
+        return True
+
+    if not file.download_urls:
+        task.fail("no URL", f"[red]✗ {file.filename} (no URL)")
+        return False
+
+    _prepare(file)
+    if sessions is None:
+        sessions = SessionPool()
+    if health is None:
+        health = NodeHealth()
+
+    segmented = segments > 1 and (file.size or 0) >= max(segment_threshold, segments)
+
+    def fetch(url: str) -> bool:
+        if not _transfer(file, url, sessions, health, task, segments if segmented else 1):
+            return False
+        _complete(file, task)
+        return True
+
+    return _with_failover(
+        file, task, file.download_urls, fetch, (requests.exceptions.RequestException, DownloadError),
+        sessions, health, retries, f"[cyan]⬇ {file.filename}",
+    )
+
+
+def _with_failover(file: File, task: FileTask, urls: list[str], fetch: Callable[[str], bool],
+                   errors: tuple, sessions: SessionPool, health: NodeHealth, retries: int,
+                   description: str, probe: bool = True) -> bool:
+    """
+    Get a file into place from one of its replica URLs, from the most promising
+    data node to the least, failing over to the next replica when ``fetch``
+    raises one of ``errors``. If every replica fails, the whole round is retried
+    up to ``retries`` times after a jittered backoff.
+
+    Parameters
+    ----------
+    fetch : callable
+        Gets the file from one URL into place. Returns False if interrupted.
+    description : str
+        Status line of the file while it is being fetched again after a backoff.
+    probe : bool, optional
+        Probe the data nodes to rank them, which takes plain HTTP URLs. Default is True.
+
+    Returns
+    -------
+    bool
+        True if the file is in place, False if interrupted or every attempt failed.
+    """
+    error: Optional[Exception] = None
+    for attempt in range(retries + 1):
+        if attempt:
+            # Every replica failed: back off before trying them all again
+            delay = backoff_delay(attempt - 1, retry_after=retry_after(error) if error else None)
+            task.describe(f"[yellow]↻ {file.filename} (retry {attempt} in {delay:.0f}s)")
+            if not _sleep(delay):
+                _interrupted(file, task)
+                return False
+            task.describe(description)
+        for url in health.rank(urls, sessions, probe=probe):
+            try:
+                if not fetch(url):
+                    _interrupted(file, task)
+                    return False
+                return True
+            except errors as e:
+                # Fail over to the next replica, which resumes from the .part file.
+                # A node answering 429/503 isn't dead, but gets fewer connections.
+                if is_throttled(e):
+                    sessions.backoff(url)
+                if not isinstance(e, requests.exceptions.HTTPError) or not is_throttled(e):
+                    health.record_failure(url)
+                task.failed_nodes.append(host_of(url))
+                error = e
+
+    _fail(file, task, error)
+    return False
+
+
+def _sleep(seconds: float) -> bool:
+    """Sleep, waking early on a keyboard interrupt. Returns False if interrupted."""
+    deadline = monotonic() + seconds
+    while not keyboard_interrupt:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return True
+        sleep(min(remaining, 0.5))
+    return False
+
+
+def _skip_existing(file: File, task: FileTask) -> bool:
+    """Report a file that already exists locally. Returns True if it does."""
+    if not file.exists():
+        return False
+    task.skip()
+    return True
+
+
+def _prepare(file: File) -> None:
+    """Create the file's directory and discard a .part file that is too large to resume."""
+    file.local_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Downloads are staged in a .part file, which is resumed if one is left over
+    part = file.part_path
+    if file.size and part.exists() and part.stat().st_size > file.size:
+        part.unlink()
+
+
+def _check_part(file: File, hasher) -> None:
+    """
+    Check the size and checksum of a finished .part file.
+
+    Raises
+    ------
+    DownloadError
+        If the file is incomplete or corrupt. Corrupt or oversized files are
+        deleted so that they are downloaded again; short ones are kept to resume.
+    """
+    part = file.part_path
+    size = part.stat().st_size
+    if file.size and size != file.size:
+        if size > file.size:
+            part.unlink()
+        raise DownloadError(f"incomplete ({size} of {file.size} bytes)")
+    if not matches(hasher, file.checksum):
+        # Corrupt: discard it so that it is downloaded again
+        part.unlink()
+        raise DownloadError(f"{file.checksum_type} checksum mismatch")
+
+
+def _complete(file: File, task: FileTask) -> None:
+    """Move a complete, verified .part file into place, record and report it."""
+    os.replace(file.part_path, file.local_path)
+    file.dataset.record(file, verified=new_hasher(file.checksum_type) is not None and bool(file.checksum))
+    task.succeed()
+
+
+def _fail(file: File, task: FileTask, error: Optional[Exception]) -> None:
+    """Report a failed download."""
+    error_msg = str(error)
+    if len(error_msg) > 80:  # Truncate if longer than 50 characters
+        error_msg = error_msg[:77] + "..."
+    task.fail(error_msg)
+
+
+def _interrupted(file: File, task: FileTask) -> None:
+    """Report a download stopped by a keyboard interrupt."""
+    task.fail("interrupted", f"[red]✗ {file.filename} (partial kept)")
+
+
+def _transfer(file: File, url: str, sessions: SessionPool, health: NodeHealth,
+              task: FileTask, segments: int = 1) -> bool:
+    """
+    Download a file from one replica URL into its .part file, resuming from
+    whatever is already there, and check its size and checksum.
+
+    With ``segments`` > 1 (or a segmented download left over from an earlier
+    attempt) the file is fetched as concurrent byte ranges, falling back to a
+    single stream if the data node doesn't honour Range requests. Every replica
+    is checked, since after a failover the next node may not support them.
+
+    Returns
+    -------
+    bool
+        False if interrupted, True once the .part file is complete
+
+    Raises
+    ------
+    requests.exceptions.RequestException
+        If the request fails or stalls
+    DownloadError
+        If the transfer ends early or the checksum doesn't match
+    """
+    part = file.part_path
+    if file.size and (segments > 1 or file.segments_path.exists()) and hasattr(os, 'pwrite'):
+        done = _transfer_segmented(file, url, sessions, health, task, max(segments, 2))
+        if done is not None:
+            return done
+        # Range requests not supported: discard the segmented .part and stream the whole file
+        file.segments_path.unlink(missing_ok=True)
+        part.unlink(missing_ok=True)
+
+    offset = part.stat().st_size if part.exists() else 0
+
+    # The checksum is computed as the file is written; bytes already in the
+    # .part file from an earlier attempt are hashed from disk first
+    hasher = new_hasher(file.checksum_type) if file.checksum else None
+
+    # Wait for a free slot on this data node
+    with sessions.slot(url), task.attempt(url):
+        start = monotonic()
+        received = 0
+        if not file.size or offset < file.size:
+            response, offset = _open_stream(sessions, url, offset)
+            task.ttfb = monotonic() - start
+            if hasher is not None and offset:
+                update_from_file(hasher, part, offset)
+            with response:
+                chunk_size = 64 * 1024  # 64KB - good balance of speed and memory use
+
+                # Update task with total size and any bytes already on disk
+                task.begin(file.size, offset)
+
+                # download with progress tracking
+                with open(part, 'ab' if offset else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if keyboard_interrupt:  # Check for interrupts during download
+                            return False
+                        if chunk:
+                            f.write(chunk)
+                            if hasher is not None:
+                                hasher.update(chunk)
+                            received += len(chunk)
+                            task.completed += len(chunk)
+                            sessions.throttle(url, len(chunk))
+        elif hasher is not None:
+            update_from_file(hasher, part)
+
+    _check_part(file, hasher)
+
+    health.record_success(url, received, monotonic() - start)
+    return True
+
+
+def _transfer_segmented(file: File, url: str, sessions: SessionPool, health: NodeHealth,
+                        task: FileTask, segments: int) -> Optional[bool]:
+    """
+    Download a file as ``segments`` concurrent byte ranges, written with positional
+    writes into a preallocated .part file.
+
+    Progress of each segment is kept in a small json sidecar next to the .part file
+    so that an interrupted segmented download resumes where each segment stopped.
+    Each segment holds its own slot on the data node. The checksum is computed from
+    disk once all segments are complete, since bytes arrive out of order. Only this
+    thread updates the file's progress, from the segments' counters.
+
+    Returns
+    -------
+    bool | None
+        None if the data node doesn't honour Range requests, False if interrupted,
+        True once the .part file is complete
+    """
+    if not _supports_range(sessions, url):
+        return None
+    part = file.part_path
+    state_path = file.segments_path
+    state = _load_segments(state_path, file.size)
+    if state is None:
+        step = -(-file.size // segments)  # ceiling division
+        state = [[start, min(start + step, file.size), 0] for start in range(0, file.size, step)]
+        with open(part, 'wb') as f:
+            f.truncate(file.size)  # preallocate
+        _save_segments(state_path, state)
+
+    already = sum(done for _, _, done in state)
+    task.begin(file.size, already)
+    start = monotonic()
+    ttfbs: list[float] = []
+    fd = os.open(part, os.O_WRONLY)
     try:
-        response = requests.get(url, stream=True, timeout=60)
+        with task.attempt(url), ThreadPoolExecutor(max_workers=len(state)) as executor:
+            futures = [
+                executor.submit(_fetch_segment, sessions, url, fd, segment, ttfbs)
+                for segment in state if segment[2] < segment[1] - segment[0]
+            ]
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=0.25)
+                task.completed = sum(done for _, _, done in state)
+            for future in futures:
+                future.result()
+    except _RangeIgnored:
+        # Some nodes behind a load balancer honour Range requests and others don't
+        return None
+    finally:
+        os.close(fd)
+        _save_segments(state_path, state)
+        if ttfbs:
+            task.ttfb = min(ttfbs)
+
+    if keyboard_interrupt:
+        return False
+
+    state_path.unlink()
+    hasher = new_hasher(file.checksum_type) if file.checksum else None
+    if hasher is not None:
+        update_from_file(hasher, part)
+    _check_part(file, hasher)
+
+    health.record_success(url, file.size - already, monotonic() - start)
+    return True
+
+
+def _fetch_segment(sessions: SessionPool, url: str, fd: int, segment: list, ttfbs: list) -> None:
+    """
+    Download one [start, end, done] segment, updating ``done`` as bytes are written
+    and appending the seconds to its response headers to ``ttfbs``.
+    """
+    start, end, _ = segment
+    with sessions.slot(url):
+        headers = {'Range': f"bytes={start + segment[2]}-{end - 1}"}
+        requested = monotonic()
+        with sessions.get(url, stream=True, timeout=TIMEOUT, headers=headers) as response:
+            ttfbs.append(monotonic() - requested)
+            response.raise_for_status()
+            if response.status_code == 200:
+                raise _RangeIgnored("data node stopped honouring Range requests")
+            if _range_start(response) != start + segment[2]:
+                raise DownloadError("data node answered with the wrong range")
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                if keyboard_interrupt:
+                    return
+                chunk = chunk[:end - start - segment[2]]
+                if not chunk:
+                    continue
+                os.pwrite(fd, chunk, start + segment[2])
+                segment[2] += len(chunk)
+                sessions.throttle(url, len(chunk))
+    if segment[2] < end - start:
+        raise DownloadError(f"segment ended early ({segment[2]} of {end - start} bytes)")
+
+
+def _supports_range(sessions: SessionPool, url: str) -> bool:
+    """Whether a data node answers a one-byte Range request with 206 Partial Content."""
+    with sessions.get(url, stream=True, timeout=TIMEOUT, headers={'Range': "bytes=0-0"}) as response:
         response.raise_for_status()
-        chunk_size = 64 * 1024  # 64KB - good balance of speed and progress updates
+        return response.status_code == 206 and _range_start(response) == 0
+
+
+def _load_segments(path: Path, size: Optional[int]) -> Optional[list]:
+    """Load segment progress from a sidecar file, if it exists and is consistent."""
+    try:
+        state = json.loads(path.read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    if not state or state[-1][1] != size:
+        return None
+    return state
+
+
+def _save_segments(path: Path, state: list) -> None:
+    """Atomically write segment progress to a sidecar file."""
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, path)
+
+
+def _open_stream(sessions: SessionPool, url: str, offset: int) -> tuple[requests.Response, int]:
+    """
+    Open a streaming GET request, resuming from ``offset`` with a Range request.
+
+    Servers that ignore the Range header (200 instead of 206) or answer with a
+    range that doesn't start at ``offset`` cause a clean restart from byte 0, as
+    does a 416 (e.g. the remote file changed size).
+
+    Returns
+    -------
+    tuple[requests.Response, int]
+        The response, and the offset its body starts at (0 if restarting)
+    """
+    if offset:
+        response = sessions.get(url, stream=True, timeout=TIMEOUT, headers={'Range': f"bytes={offset}-"})
+        if response.status_code == 206 and _range_start(response) == offset:
+            return response, offset
+        if response.status_code == 200:
+            # Range ignored: the body is the whole file
+            return response, 0
+        response.close()
+        if response.status_code not in (206, 416):
+            response.raise_for_status()
+
+    response = sessions.get(url, stream=True, timeout=TIMEOUT)
+    response.raise_for_status()
+    return response, 0
+
+
+def _range_start(response: requests.Response) -> Optional[int]:
+    """First byte position of a 206 response, from its Content-Range header."""
+    match = re.match(r"bytes (\d+)-", response.headers.get('Content-Range', ''))
+    return int(match.group(1)) if match else None
+
+
 
-        # Update task with total size
-        progress.update(task_id, total=file.size)
+class DownloadScheduler:
+    """
+    Long-lived download scheduler shared by every dataset in a run.
+
+    Files from all submitted datasets go into a single work queue served by
+    ``max_workers`` threads, so a slow file in one dataset never leaves workers
+    idle while other datasets still have files to fetch. Datasets can be
+    submitted while earlier ones are still downloading. The queue hands out
+    files by priority and size (largest first by default), whichever dataset
+    they belong to.
+    """
+
+    def __init__(self, max_workers: int = 3, max_per_node: Optional[int] = None,
+                 segments: int = 1, segment_threshold: int = 0,
+                 engine: str = 'threads', async_concurrency: int = 64,
+                 adaptive: bool = False, bandwidth_limit: Optional[float] = None,
+                 retries: int = 0, headless: bool = False, report_interval: float = 30.0,
+                 shard: Optional[Shard] = None, metrics: Optional[RunMetrics] = None,
+                 subsets: bool = False, versions: Optional[VersionSync] = None,
+                 store: Optional[BlobStore] = None, consolidator: Optional["Consolidator"] = None,
+                 order: Optional[FileOrder] = None):
+
+        """
+        Parameters
+        ----------
+        max_workers : int, optional
+            Number of parallel download threads. Default is 3.
+        max_per_node : int, optional
+            Maximum concurrent transfers from any single data node. Defaults to
+            max_workers.
+        segments : int, optional
+            Number of concurrent byte ranges for large files. Default is 1 (off).
+        segment_threshold : int, optional
+            Minimum file size in bytes for segmented download. Default is 0.
+        engine : str, optional
+            'threads' (default) to download on ``max_workers`` threads, or 'async'
+            to run up to ``async_concurrency`` transfers on one event loop.
+        async_concurrency : int, optional
+            Maximum concurrent transfers with the async engine. Default is 64.
+        adaptive : bool, optional
+            Adapt the concurrency per data node (up to max_per_node) to its
+            throughput and errors. Default is False.
+        bandwidth_limit : float, optional
+            Cap on the aggregate transfer rate in bytes/s. Default is no cap.
+        retries : int, optional
+            Number of retries, with jittered backoff, after every replica of a
+            file has failed. Default is 0.
+        headless : bool, optional
+            Write JSON-lines progress summaries to stdout instead of showing the
+            rich progress display. Default is False.
+        report_interval : float, optional
+            Seconds between headless progress summaries. Default is 30.
+        shard : Shard, optional
+            Shard of a sharded run. Files are leased before they are downloaded,
+            and files leased by another shard are checked again later.
+        metrics : RunMetrics, optional
+            Collects the timings of every finished file transfer.
+        subsets : bool, optional
+            Start worker processes to subset the files of datasets with a subset
+            over OPeNDAP. Default is False.
+        versions : VersionSync, optional
+            Links files unchanged since another downloaded version of their
+            dataset instead of downloading them.
+        store : BlobStore, optional
+            Content-addressed store: stored files are linked instead of downloaded,
+            and downloaded files are added to it.
+        consolidator : Consolidator, optional
+            Consolidates every dataset whose files all downloaded into a single
+            analysis store.
+        order : FileOrder, optional
+            Order in which queued files are downloaded. Default is largest first.
+        """
+
+        self.max_workers = max_workers
+        self.engine = engine
+        self.async_concurrency = async_concurrency
+        self._engine = None  # AsyncEngine, if engine == 'async'
+        self.subsets = subsets
+        self._subsetter = None  # Subsetter, if subsets
+        self._slots = threading.BoundedSemaphore(async_concurrency)
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.retries = retries
+        self.shard = shard
+        self.metrics = metrics
+        self.versions = versions
+        self.store = store
+        self.consolidator = consolidator
+        # Workers wait in the queue while every node of its next files is at its cap,
+        # and are woken when a node frees a slot
+        self.queue = FileQueue(order or FileOrder(), self._ready)
+        bandwidth = TokenBucket(bandwidth_limit) if bandwidth_limit else None
+        self.sessions = SessionPool(
+            max_per_node or max_workers, adaptive=adaptive, bandwidth=bandwidth, on_release=self.queue.wake
+        )
+        self.health = NodeHealth()
+        if metrics is not None:
+            metrics.set_slots(async_concurrency if engine == 'async' else max_workers, self.sessions.max_per_node)
+        self.tracker = ProgressTracker()
+        if headless:
+            self.renderer = JsonRenderer(self.tracker, report_interval)
+        else:
+            self.renderer = RichRenderer(self.tracker)
+        self._workers: list[threading.Thread] = []
+        self._lock = threading.Condition()
+        self._unfinished = 0  # files submitted but not yet finished
+        self._remaining: dict[str, int] = {}  # dataset_id -> files not yet finished
+        self._failed: dict[str, int] = {}  # dataset_id -> failed files
+        self._submitted: dict[str, int] = {}  # dataset_id -> files submitted
+
+    def __enter__(self) -> "DownloadScheduler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def start(self) -> None:
+        """Start the progress display and the worker threads (or the event loop)."""
+        if self.engine == 'async':
+            from esgf_download.async_download import AsyncEngine
+            self._engine = AsyncEngine(
+                self.async_concurrency, self.sessions.max_per_node, self.sessions, self.health,
+                self.retries, self._link
+            )
+            self._engine.start()
+            targets = [self._feed]
+        else:
+            targets = [self._work] * self.max_workers
+        if self.subsets:
+            from esgf_download.subset import Subsetter
+            self._subsetter = Subsetter(self.max_workers, self.sessions, self.health, self.retries)
+
+        self.renderer.start()
+        if self.shard is not None:
+            self.shard.start(self.tracker.summary)
+        for i, target in enumerate(targets):
+            worker = threading.Thread(target=target, name=f"download-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, dataset: Dataset, files: Optional[list] = None) -> None:
+        """Queue the files of a dataset (all of them by default) for download."""
+        dataset.local_path.mkdir(parents=True, exist_ok=True)
+        files = dataset.files if files is None else files
+        dataset_id = dataset.dataset_id
+        with self._lock:
+            self._remaining[dataset_id] = self._remaining.get(dataset_id, 0) + len(files)
+            self._failed.setdefault(dataset_id, 0)
+            self._submitted[dataset_id] = self._submitted.get(dataset_id, 0) + len(files)
+            self._unfinished += len(files)
+        self.tracker.expect(len(files))
+        for file in files:
+            self.queue.put(file)
+
+    def wait(self) -> bool:
+        """
+        Block until every submitted file has finished.
+
+        Returns
+        -------
+        bool
+            True if the downloads were interrupted.
+        """
+        with self._lock:
+            while self._unfinished > 0:
+                # Wake up regularly so that KeyboardInterrupt is delivered promptly
+                self._lock.wait(timeout=0.5)
+        return keyboard_interrupt
+
+    def interrupt(self) -> None:
+        """Stop in-flight downloads and drop every file still in the queue."""
+        global keyboard_interrupt
+        keyboard_interrupt = True
+        self.queue.wake()  # every file is ready now, to be dropped
+        if self._engine is not None:
+            self._engine.interrupt()
+        while True:
+            try:
+                file = self.queue.get_nowait()
+            except Empty:
+                break
+            if file is not None:
+                self._finish(file, None, False)
+
+    def close(self) -> None:
+        """Stop the worker threads once they are idle, and the progress display."""
+        for _ in self._workers:
+            self.queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        if self._engine is not None:
+            self._engine.close()
+        if self._subsetter is not None:
+            self._subsetter.close()
+        self.renderer.stop()
+        self.sessions.report()
+        self.health.report()
+        self.sessions.close()
+        if self.shard is not None:
+            self.shard.stop(complete=not keyboard_interrupt)
+            self.shard.report()
 
-        # download with progress tracking
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                if keyboard_interrupt:  # Check for interrupts during download
-                    progress.update(task_id, description=f"[red]✗ {filename}")
-                    file.remove()
+    def _work(self) -> None:
+        """Worker thread: download files from the queue until told to stop."""
+        while True:
+            file = self.queue.get()
+            if file is None:
+                return
+            if not keyboard_interrupt and not self._claim(file):
+                continue
+            task: Optional[FileTask] = None
+            success = False
+            try:
+                if not keyboard_interrupt:
+                    task = self.tracker.add(file)
+                    if file.dataset.subset is not None:
+                        success = self._subsetter.subset_file(file, task)
+                    elif self._link(file, task):
+                        success = True
+                    else:
+                        success = download_file(
+                            file, task, self.sessions, self.health,
+                            self.segments, self.segment_threshold, self.retries
+                        )
+            finally:
+                self._finish(file, task, success)
+
+    def _feed(self) -> None:
+        """
+        Feeder thread for the async engine: hand files from the queue to the event
+        loop, keeping at most ``async_concurrency`` transfers in flight.
+        """
+        while True:
+            self._slots.acquire()
+            file = self.queue.get()
+            if file is None or keyboard_interrupt:
+                self._slots.release()
+                if file is None:
                     return
-                if chunk:
-                    f.write(chunk)
-                    progress.update(task_id, advance=len(chunk))
+                self._finish(file, None, False)
+                continue
+            if not self._claim(file):
+                self._slots.release()
+                continue
+            task = self.tracker.add(file)
+            if file.dataset.subset is not None:
+                future = self._subsetter.submit(file, task)
+            else:
+                future = self._engine.submit(file, task)
+            future.add_done_callback(lambda f, file=file, task=task: self._done(file, task, f))
+
+    def _ready(self, file: File) -> bool:
+        """Whether a file could start now: one of its data nodes is below its cap."""
+        urls = file.download_urls if file.dataset.subset is None else file.opendap_urls
+        return keyboard_interrupt or not urls or any(self.sessions.has_capacity(url) for url in urls)
+
+    def _link(self, file: File, task: FileTask) -> bool:
+        """
+        Put a file in place from a local copy instead of downloading it: its blob
+        in the store, or an unchanged copy in another version of its dataset.
 
-        # Mark task as completed
-        progress.update(task_id, description=f"[green]✓ {filename}")
-        if len(file.dataset.files) > MAX_DISPLAY_ROWS:
-            sleep(0.5)
-            progress.remove_task(task_id)
-        
-    except requests.exceptions.RequestException as e:
-        error_msg = str(e)
-        if len(error_msg) > 80:  # Truncate if longer than 50 characters
-            error_msg = error_msg[:77] + "..."
-        progress.update(task_id, description=f"[red]✗ {filename} - {error_msg}")
-        file.remove()
+        Returns
+        -------
+        bool
+            True if the file was linked into place
+        """
+        if self.store is not None and self.store.link(file, task):
+            return True
+        return self.versions is not None and self.versions.link(file, task)
 
+    def _claim(self, file: File) -> bool:
+        """
+        Take the lease of a file when sharding. A file leased by another live shard
+        is finished if it is complete by now, and otherwise queued again after a
+        while in case that shard crashes.
+
+        Returns
+        -------
+        bool
+            True if the file can be downloaded now
+        """
+        if self.shard is None or self.shard.claim(file):
+            return True
+        if file.exists():
+            self._finish(file, None, True)
+        else:
+            timer = threading.Timer(self.shard.poll, self.queue.put, (file,))
+            timer.daemon = True
+            timer.start()
+        return False
+
+    def _done(self, file: File, task: FileTask, future: Future) -> None:
+        """Completion callback of an async transfer."""
+        self._slots.release()
+        success = False
+        if not future.cancelled():
+            error = future.exception()
+            if error is not None:
+                _fail(file, task, error)
+            else:
+                success = bool(future.result())
+        self._finish(file, task, success)
+
+    def _finish(self, file: File, task: Optional[FileTask], success: bool) -> None:
+        """Record a finished file and report its dataset once all of its files are done."""
+        dataset_id = file.dataset.dataset_id
+        try:
+            if task is not None:
+                if success and task.state == 'done' and self.store is not None:
+                    self.store.add(file)
+                self.tracker.finish(task, success)
+                if self.metrics is not None:
+                    self.metrics.record_file(task)
+            if self.shard is not None:
+                self.shard.release(file)
+        finally:
+            # Whatever failed above, the file is accounted for, so wait() still returns
+            with self._lock:
+                self._remaining[dataset_id] -= 1
+                if not success:
+                    self._failed[dataset_id] += 1
+                complete = self._remaining[dataset_id] == 0
+                self._unfinished -= 1
+                self._lock.notify_all()
+        if not complete or keyboard_interrupt:
+            return
+
+        # The renderer collapses the dataset's progress rows into a single summary line
+        self.tracker.dataset_done(dataset_id, self._failed[dataset_id], self._submitted[dataset_id])
+        if self.consolidator is not None and not self._failed[dataset_id]:
+            self.consolidator.submit(file.dataset)
 
 
 def download_dataset(dataset: Dataset, max_workers: int = 3) -> bool:
@@ -94,44 +809,18 @@ def download_dataset(dataset: Dataset, max_workers: int = 3) -> bool:
         ESGF Dataset object whose files will be downloaded.
     max_workers : int, optional
         Number of parallel download threads. Default is 3.
+
+    Returns
+    -------
+    bool
+        True if the download was interrupted.
     """
 
-    dataset.local_path.mkdir(parents=True, exist_ok=True)
-    dataset_size = len(dataset.files)
-    
-    # Create rich Progress instance using the shared console
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TaskProgressColumn(),
-        TimeRemainingColumn(),
-        console=console,  # Use shared console for consistency
-        transient=dataset_size > MAX_DISPLAY_ROWS  # Remove completed tasks if true
-    ) as progress:
-        
-        # Pre-create all progress tasks in chronological order
-        file_tasks = []
-        for file in dataset.files:
-            task_id = progress.add_task(f"[dim]{file.filename} (queued)", total=file.size)
-            file_tasks.append((file, task_id))
-        
-        # Use ThreadPoolExecutor for parallel downloads
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all download tasks with their pre-created task IDs
-            futures = [
-                executor.submit(download_file, file, progress, task_id) 
-                for file, task_id in file_tasks
-            ]
-            
-            try:
-                for f in as_completed(futures):
-                    f.result()
-            except KeyboardInterrupt:
-                # Handle keyboard interrupt: cancel remaining tasks
-                global keyboard_interrupt
-                keyboard_interrupt = True
-                for f in futures:
-                    f.cancel()
-
-    return keyboard_interrupt
\ No newline at end of file
+    with DownloadScheduler(max_workers) as scheduler:
+        scheduler.submit(dataset)
+        try:
+            scheduler.wait()
+        except KeyboardInterrupt:
+            scheduler.interrupt()
+
+    return keyboard_interrupt
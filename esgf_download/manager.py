@@ -1,22 +1,39 @@
 import os
+from pathlib import Path
 from itertools import product
+from typing import Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor
 from pyesgf.search import SearchConnection # type: ignore
 
 from esgf_download.classes import Dataset
+from esgf_download.cache import SearchCache
+from esgf_download.manifest import Manifest
 from esgf_download.login import login_to_esgf
-from esgf_download.download import download_dataset
+from esgf_download.download import DownloadScheduler
+from esgf_download.checksum import verify_files
+from esgf_download.plan import write_plan, load_plan, summarise
+from esgf_download.shards import Shard, shard_manifests
+from esgf_download.metrics import RunMetrics
+from esgf_download.sessions import IndexSession
+from esgf_download.subset import Subset
+from esgf_download.versions import VersionSync
+from esgf_download.store import BlobStore
+from esgf_download.priority import FileOrder
 from esgf_download.search import (
     search_dataset, filter_2300_extensions, get_latest_result,
-    should_filter_2300_extensions, build_query
+    should_filter_2300_extensions, build_query, batch_groups, batch_key,
+    search_batch, find_replicas
 )
 
-from esgf_download.console import console
+from rich.table import Table
+from esgf_download.console import console, use_stderr
 
 
 class DownloadManager:
     """Manages the ESGF download process."""
     
-    def __init__(self, config, login: bool = False):
+    def __init__(self, config, login: bool = False, refresh: bool = False, invalidate: tuple = (),
+                 headless: bool = False, shard: Optional[tuple[int, int]] = None):
         """
         Initialize the download manager.
         
@@ -24,10 +41,31 @@ class DownloadManager:
         ----------
         config : object
             Configuration object with all necessary settings
+        login : bool, optional
+            Log in to ESGF before downloading
+        refresh : bool, optional
+            Ignore cached search results and query the ESGF index again
+        invalidate : tuple, optional
+            Dataset IDs to remove from the search cache before running
+        headless : bool, optional
+            Report download progress as JSON lines instead of the rich display
+        shard : tuple[int, int], optional
+            Download only shard ``i`` of ``N`` (index, count) of the files, leasing
+            them on the shared DATA_HOME
         """
         self.config = config
         self.login  = login
+        self.refresh = refresh
+        self.invalidate = invalidate
+        self.headless = headless
+        if headless:
+            use_stderr()  # keep stdout to the JSON progress lines
+        self.shard = Shard(*shard, config.DATA_HOME) if shard else None
+        self.metrics = RunMetrics() if config.METRICS_ENABLED else None
         self.conn = None
+        self.cache: Optional[SearchCache] = None
+        self.manifest: Optional[Manifest] = None
+        self._batches: Optional[dict] = None  # batched search futures, if batching
         
     def setup(self):
         """Logs into ESGF, sets environment variables, and creates a search connection."""
@@ -42,11 +80,104 @@ class DownloadManager:
                 console.print(f"[red]✗ ESGF login failed:[/red] {e}")
                 return False
             
-        # Create search connection
-        self.conn = SearchConnection(self.config.SEARCH_NODE, distrib=True)
+        # Open the manifest of completed downloads. Shards each keep their own
+        # manifest and cache, as SQLite locking is unsafe on shared filesystems
+        if self.config.MANIFEST:
+            self.manifest = Manifest(self.shard.manifest_path if self.shard else self.config.MANIFEST_PATH)
+
+        # Create search connection, with at most SEARCH_WORKERS queries in flight
+        # however searches are nested, timing every query if collecting metrics
+        workers = self.config.SEARCH_WORKERS
+        session = self.metrics.session(workers) if self.metrics is not None else IndexSession(workers)
+        self.conn = SearchConnection(self.config.SEARCH_NODE, distrib=True, session=session)
+
+        # Open the on-disk search cache
+        if self.config.CACHE_ENABLED:
+            self.cache = SearchCache(
+                self.shard.cache_path if self.shard else self.config.CACHE_PATH,
+                ttl=self.config.CACHE_TTL,
+                max_size=self.config.CACHE_MAX_SIZE,
+                refresh=self.refresh,
+            )
+            for dataset_id in self.invalidate:
+                removed = self.cache.invalidate(dataset_id)
+                console.print(f"[blue]🗑 Invalidated {removed} cached entries for[/blue] [dim]{dataset_id}[/dim]")
         console.print(f"[blue]📁 Downloading data to[/blue] [bold]{self.config.DATA_HOME}[/bold]")
         return True
     
+    def search_combination(self, scenario: str, model: str, variable: str):
+        """
+        Search results for one combination, either from its own query or, when
+        search batching is enabled, from the bucket of the batched search covering it.
+
+        Returns
+        -------
+        ResultSet | list | None
+            Search results, or None if nothing was found
+        """
+        if self._batches is not None:
+            buckets = self._batches[batch_key(self.config, model, variable)].result()
+            return buckets.get((scenario, variable)) or None
+
+        query = build_query(self.config, scenario, model, variable)
+        return search_dataset(self.conn, query, cache=self.cache)
+
+    def resolve_dataset(self, scenario: str, model: str, variable: str) -> tuple[Optional[Dataset], Optional[str]]:
+        """
+        Resolve the dataset for a scenario, model, and variable combination without
+        printing anything, so that it can be run from a worker thread.
+
+        The file listing of the resolved dataset is fetched here too, so that the
+        search round-trips behind ``Dataset.files`` also happen concurrently.
+
+        Returns
+        -------
+        tuple[Dataset | None, str | None]
+            The dataset (None if not found or filtered out) and a warning message
+            to report for this combination, if any.
+        """
+        if self.conn is None:
+            return None, "[red]✗ No search connection available[/red]"
+
+        results = self.search_combination(scenario, model, variable)
+
+        if results is None:
+            return None, f"[yellow]⚠ No datasets found for[/yellow] [dim]{scenario}, {model}, {variable}[/dim]"
+
+        # Filter for 2300 extensions if enabled, keeping the latest qualifying
+        # version (with the file listing fetched while filtering, if any)
+        if should_filter_2300_extensions(scenario, self.config):
+            filtered = filter_2300_extensions(
+                results, self.config, cache=self.cache, manifest=self.manifest, latest=True
+            )
+            if len(filtered) == 0:
+                return None, f"[yellow]⚠ No 2300 extensions found for[/yellow] [dim]{scenario}, {model}, {variable}[/dim]"
+            dataset = filtered[0]
+            dataset.time_range = self.config.TIME_RANGE.get(scenario)
+            dataset.subset = self.subset_for(scenario, variable)
+        else:
+            # Get the most recent version
+            latest_result = get_latest_result(results)
+            dataset = Dataset(
+                latest_result, data_home=self.config.DATA_HOME, cache=self.cache, manifest=self.manifest,
+                time_range=self.config.TIME_RANGE.get(scenario), subset=self.subset_for(scenario, variable),
+            )
+        dataset.files  # populate the file cache while still on the worker thread
+
+        # Collect the URLs of every replica so downloads can fail over between nodes
+        if self.config.REPLICAS:
+            dataset.add_replicas(find_replicas(self.conn, dataset, cache=self.cache))
+        return dataset, None
+
+    def subset_for(self, scenario: str, variable: str) -> Optional[Subset]:
+        """The subset to cut out of a scenario's files of a variable, if subsetting is enabled."""
+        if not self.config.SUBSET_ENABLED or variable not in self.config.SUBSET_VARIABLES:
+            return None
+        return Subset(
+            self.config.SUBSET_BBOX, self.config.SUBSET_LEVELS, self.config.TIME_RANGE.get(scenario),
+            chunk_bytes=self.config.SUBSET_CHUNK,
+        )
+
     def fetch_dataset(self, scenario: str, model: str, variable: str):
         """
         Fetch a dataset for the given scenario, model, and variable combination.
@@ -65,53 +196,306 @@ class DownloadManager:
         Dataset | None
             Dataset object if found, None if not found or filtered out
         """
-        if self.conn is None:
-            console.print("[red]✗ No search connection available[/red]")
-            return None
-            
-        query = build_query(self.config, scenario, model, variable)
-        results = search_dataset(self.conn, query)
+        dataset, warning = self.resolve_dataset(scenario, model, variable)
+        if warning:
+            console.print(warning)
+        return dataset
 
-        if results is None:
-            console.print(f"[yellow]⚠ No datasets found for[/yellow] [dim]{scenario}, {model}, {variable}[/dim]")
-            return None
-        
-        # Filter for 2300 extensions if enabled
-        if should_filter_2300_extensions(scenario, self.config):
-            results = filter_2300_extensions(results, self.config)
-            if len(results) == 0:
-                console.print(f"[yellow]⚠ No 2300 extensions found for[/yellow] [dim]{scenario}, {model}, {variable}[/dim]")
-                return None
-        
-        # Get the most recent version
-        latest_result = get_latest_result(results)
-        return Dataset(latest_result, data_home=self.config.DATA_HOME)
+    def resolve_datasets(self) -> Iterator[Dataset]:
+        """
+        Resolve every scenario, model, and variable combination concurrently on a
+        pool of SEARCH_WORKERS threads.
+
+        Datasets (and warnings) are yielded in config order, as soon as each one
+        and all those before it have been resolved, so downloading can start while
+        later searches are still in flight.
+        """
+        combinations = list(product(self.config.SCENARIOS, self.config.MODELS, self.config.VARIABLES))
+        executor = ThreadPoolExecutor(max_workers=self.config.SEARCH_WORKERS)
+
+        # Batched searches get their own pool so that combination workers waiting
+        # on a batch can never starve it of threads
+        batch_executor = None
+        if self.config.SEARCH_BATCHING != 'none' and self.conn is not None:
+            batch_executor = ThreadPoolExecutor(max_workers=self.config.SEARCH_WORKERS)
+            self._batches = {
+                key: batch_executor.submit(
+                    search_batch, self.conn, self.config, key[0], variables, self.cache
+                )
+                for key, variables in batch_groups(self.config).items()
+            }
+        try:
+            for dataset, warning in executor.map(lambda c: self.resolve_dataset(*c), combinations):
+                if warning:
+                    console.print(warning)
+                if dataset is not None:
+                    yield dataset
+        finally:
+            # Don't start any more searches if the caller stops early
+            executor.shutdown(wait=False, cancel_futures=True)
+            if batch_executor is not None:
+                batch_executor.shutdown(wait=False, cancel_futures=True)
     
-    def run(self):
-        """Run the complete download process."""
+    def run(self, plan: Optional[Path] = None):
+        """
+        Run the complete download process.
+
+        Parameters
+        ----------
+        plan : Path, optional
+            Download the datasets of a plan file instead of searching ESGF
+        """
         if not self.setup():
             return
-            
-        # Process all combinations
-        for scenario, model, variable in product(self.config.SCENARIOS, self.config.MODELS, self.config.VARIABLES):
-            # Fetch the dataset
-            dataset = self.fetch_dataset(scenario, model, variable)
-            if dataset is None:
-                continue
-
-            # Check if dataset is empty
-            if dataset.is_empty():
-                console.print(f"[yellow]⚠ No files found for[/yellow] [dim]{dataset.dataset_id}[/dim]")
-                continue
-                
-            # Check if dataset already exists
-            id, node = dataset.dataset_id.split('|')
-            if dataset.exists():
-                console.print(f"[green]✓ {id}[/green] [dim](already exists)[/dim]")
-                continue
-
-            # Download the dataset
-            console.print(dataset.dataset_id)
-            interrupt = download_dataset(dataset, self.config.MAX_WORKERS)
-            if interrupt:
-                break 
\ No newline at end of file
+
+        # One scheduler for the whole run: files from every dataset share the same
+        # workers, and downloads start while later searches are still resolving
+        if plan is not None:
+            console.print(f"[blue]📋 Downloading from plan[/blue] [bold]{plan}[/bold]")
+            datasets = self.configure_plan(load_plan(plan, self.config.DATA_HOME, self.manifest))
+        else:
+            datasets = self.resolve_datasets()
+        versions = VersionSync(self.manifest) if self.config.SYNC_VERSIONS else None
+        store = BlobStore(self.config.STORE_PATH) if self.config.STORE_ENABLED else None
+        consolidator = self.consolidator()
+        scheduler = DownloadScheduler(
+            self.config.MAX_WORKERS,
+            self.config.MAX_PER_NODE,
+            segments=self.config.SEGMENTS,
+            segment_threshold=self.config.SEGMENT_THRESHOLD,
+            engine=self.config.ENGINE,
+            async_concurrency=self.config.ASYNC_CONCURRENCY,
+            adaptive=self.config.ADAPTIVE,
+            bandwidth_limit=self.config.BANDWIDTH_LIMIT,
+            retries=self.config.RETRIES,
+            headless=self.headless,
+            report_interval=self.config.REPORT_INTERVAL,
+            shard=self.shard,
+            metrics=self.metrics,
+            subsets=self.config.SUBSET_ENABLED,
+            versions=versions,
+            store=store,
+            consolidator=consolidator,
+            order=FileOrder(self.config.ORDER, self.config.PRIORITY),
+        )
+        sharded: list[Dataset] = []  # incomplete datasets, when sharding
+        with scheduler:
+            try:
+                for dataset in datasets:
+
+                    # Check if dataset is empty
+                    if dataset.is_empty():
+                        reason = "in the time range " if dataset.time_range and dataset.all_files else ""
+                        console.print(f"[yellow]⚠ No files found {reason}for[/yellow] [dim]{dataset.dataset_id}[/dim]")
+                        continue
+                        
+                    # Check if dataset already exists
+                    id, node = dataset.dataset_id.split('|')
+                    if dataset.exists():
+                        console.print(f"[green]✓ {id}[/green] [dim](already exists)[/dim]")
+                        if consolidator is not None:
+                            consolidator.submit(dataset)
+                        continue
+
+                    # A newer version of a downloaded dataset: unchanged files are linked
+                    previous = versions.previous_versions(dataset) if versions is not None else []
+                    if previous:
+                        console.print(f"[blue]🔄 {id}[/blue] [dim](updating from {previous[0].name})[/dim]")
+
+                    # Queue the dataset (or this shard's part of it) for download
+                    files = None
+                    if self.shard is not None:
+                        sharded.append(dataset)
+                        files = [file for file in dataset.files if self.shard.owns(file)]
+                        if not files:
+                            continue
+                    console.print(dataset.dataset_id)
+                    scheduler.submit(dataset, files)
+
+                if not scheduler.wait() and self.shard is not None:
+                    self.pick_up(scheduler, sharded)
+            except KeyboardInterrupt:
+                scheduler.interrupt()
+            finally:
+                datasets.close()
+        if consolidator is not None:
+            consolidator.close()
+        if versions is not None:
+            versions.report()
+        if store is not None:
+            store.report()
+        if self.metrics is not None:
+            self.write_metrics()
+
+    def consolidator(self):
+        """Consolidator of complete datasets, or None if consolidation is off or the run is sharded."""
+        if not self.config.CONSOLIDATE_ENABLED:
+            return None
+        if self.shard is not None:
+            # No shard knows when a dataset is complete across all the shards
+            console.print("[yellow]⚠ Consolidation is skipped in sharded runs[/yellow]")
+            return None
+        from esgf_download.consolidate import Consolidator
+        return Consolidator(
+            self.config.CONSOLIDATE_FORMAT,
+            self.config.CONSOLIDATE_CHUNKS,
+            self.config.CONSOLIDATE_COMPRESSION,
+            self.config.CONSOLIDATE_WORKERS,
+            self.config.CONSOLIDATE_CHUNK,
+        )
+
+    def configure_plan(self, datasets: Iterator[Dataset]) -> Iterator[Dataset]:
+        """Give the datasets of a plan the configured time ranges and subsets, by their experiment and variable."""
+        for dataset in datasets:
+            identifiers = dataset.dataset_id.split('|')[0].split('.')
+            if len(identifiers) > 7:
+                dataset.time_range = self.config.TIME_RANGE.get(identifiers[4])
+                dataset.subset = self.subset_for(identifiers[4], identifiers[7])
+            yield dataset
+
+    def write_metrics(self):
+        """Report where the run's time went, and write its JSON and OpenMetrics files."""
+        paths = [self.config.METRICS_JSON, self.config.METRICS_OPENMETRICS]
+        if self.shard is not None:
+            # Shards share DATA_HOME: give each its own files
+            tag = f"shard-{self.shard.index}-of-{self.shard.count}"
+            paths = [path.with_name(f"{path.stem}.{tag}{path.suffix}") for path in paths]
+        self.metrics.report()
+        try:
+            self.metrics.write_json(paths[0])
+            self.metrics.write_openmetrics(paths[1])
+        except OSError as e:
+            console.print(f"[yellow]⚠ Could not write metrics:[/yellow] {e}")
+            return
+        console.print(f"[blue]📈 Metrics written to[/blue] [dim]{paths[0]}, {paths[1]}[/dim]")
+
+    def pick_up(self, scheduler: DownloadScheduler, datasets: list):
+        """
+        Once this shard's own files are done, download the files of shards that
+        crashed or never started. Files are leased as usual, so shards picking
+        up the same work never download a file twice.
+        """
+        abandoned = self.shard.abandoned()
+        if not abandoned:
+            return
+        count = 0
+        for dataset in datasets:
+            files = [
+                file for file in dataset.files
+                if self.shard.owner(file) in abandoned and not self.shard.leased(file) and not file.exists()
+            ]
+            if files:
+                scheduler.submit(dataset, files)
+                count += len(files)
+        if count:
+            shards = ", ".join(str(index) for index in sorted(abandoned))
+            console.print(f"[yellow]🧩 Picking up {count} files of shards {shards}[/yellow] [dim](crashed or not started)[/dim]")
+            scheduler.wait()
+
+    def plan(self, output: Path):
+        """
+        Resolve every dataset and its files without downloading anything, report
+        how much data the configuration implies and write it to a plan file.
+
+        Parameters
+        ----------
+        output : Path
+            Plan file to write (JSON, or Parquet if it ends in .parquet)
+        """
+        if not self.setup():
+            return
+
+        datasets = [dataset for dataset in self.resolve_datasets() if not dataset.is_empty()]
+        summary = summarise(datasets)
+
+        table = Table(title="Download plan")
+        for column in ("", "Files", "Size (GB)", "Present", "Present (GB)", "To download (GB)"):
+            table.add_column(column, justify="left" if not column else "right")
+        rows = [("Total", summary['total'], "bold")]
+        rows += [(node, counts, "blue") for node, counts in sorted(summary['nodes'].items())]
+        rows += [(model, counts, "cyan") for model, counts in sorted(summary['models'].items())]
+        for i, (name, (files, size, present, present_size), style) in enumerate(rows):
+            table.add_row(
+                f"[{style}]{name}[/{style}]", str(files), f"{size / 1024**3:.1f}",
+                str(present), f"{present_size / 1024**3:.1f}", f"{(size - present_size) / 1024**3:.1f}",
+                end_section=i in (0, len(summary['nodes'])),
+            )
+        console.print(table)
+
+        write_plan(datasets, output)
+        console.print(f"[green]✓ Wrote plan of {len(datasets)} datasets to[/green] [bold]{output}[/bold]")
+
+    def verify(self, workers: Optional[int] = None, delete: bool = False):
+        """
+        Verify the checksums of downloaded files: every file recorded in the
+        manifest, against the checksum it was recorded with, without searching
+        ESGF. With the manifest disabled, every configured file that exists
+        locally is verified against the checksums found by searching ESGF.
+
+        Parameters
+        ----------
+        workers : int, optional
+            Number of hashing processes. Defaults to the number of CPUs.
+        delete : bool, optional
+            Delete corrupt files so that the next run downloads them again.
+        """
+        manifest = None
+        if self.config.MANIFEST:
+            manifest = Manifest(self.config.MANIFEST_PATH)
+            files = manifest.entries()
+            console.print(f"[blue]📒 Verifying the {len(files)} files recorded in[/blue] [dim]{manifest.path}[/dim]")
+        else:
+            if not self.setup():
+                return
+            # Subsets are cut from the files, so the files' checksums don't apply to them
+            files = [
+                file for dataset in self.resolve_datasets() if dataset.subset is None for file in dataset.files
+            ]
+        corrupt, unchecked = verify_files(files, workers)
+        checked = sum(1 for file in files if file.local_path.exists()) - unchecked
+
+        for file in corrupt:
+            console.print(f"[red]✗ {file.local_path}[/red] [dim]({file.checksum_type} mismatch)[/dim]")
+            if delete and manifest is not None:
+                file.local_path.unlink(missing_ok=True)
+                manifest.discard(file.dataset_id, file.filename)
+            elif delete:
+                file.remove()
+        if manifest is not None:
+            manifest.close()
+
+        if delete and corrupt:
+            console.print(f"[yellow]🗑 Deleted {len(corrupt)} corrupt files[/yellow]")
+        if unchecked:
+            console.print(f"[yellow]⚠ {unchecked} files have no usable checksum[/yellow]")
+        style = "red" if corrupt else "green"
+        console.print(f"[{style}]🔍 {len(corrupt)} of {checked} verified files are corrupt[/{style}]")
+
+    def gc(self):
+        """Delete the blobs of the content-addressed store that no file links to any more."""
+        store = BlobStore(self.config.STORE_PATH)
+        removed, reclaimed = store.gc()
+        console.print(
+            f"[green]✓ Store garbage collected:[/green] {removed} unreferenced blobs removed, "
+            f"{reclaimed / 1024**3:.2f} GB reclaimed"
+        )
+
+    def reconcile(self):
+        """
+        Merge the manifests of finished shards into the main manifest, then check
+        it against the files on disk and drop stale entries.
+        """
+        manifest = Manifest(self.config.MANIFEST_PATH)
+        done, running = shard_manifests(self.config.DATA_HOME)
+        for path in done:
+            merged = manifest.merge(path)
+            path.unlink()
+            console.print(f"[blue]🧩 Merged {merged} entries from[/blue] [dim]{path.name}[/dim]")
+        for path in running:
+            console.print(f"[yellow]⚠ Shard still running, not merged:[/yellow] [dim]{path.name}[/dim]")
+        checked, removed = manifest.reconcile()
+        manifest.close()
+        console.print(
+            f"[green]✓ Manifest reconciled:[/green] {checked} entries checked, "
+            f"{removed} missing or truncated files removed"
+        )
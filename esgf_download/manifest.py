@@ -0,0 +1,181 @@
+"""
+Local SQLite manifest of completely downloaded files.
+"""
+
+import sqlite3
+import threading
+from time import time
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    from esgf_download.classes import File
+
+
+class Entry(NamedTuple):
+    """A recorded file, with the attributes of a ``File`` needed to verify it."""
+    dataset_id: str
+    filename: str
+    local_path: Path
+    size: Optional[int]
+    checksum: Optional[str]
+    checksum_type: Optional[str]
+
+
+class Manifest:
+    """
+    Records every file that has been completely downloaded under DATA_HOME, so that
+    completeness checks need one indexed query per dataset instead of one stat()
+    per file, and can tell a complete file from a truncated one.
+
+    Files are keyed by the dataset's instance ID (its dataset_id without the
+    ``|data_node`` suffix), which also identifies its directory under DATA_HOME,
+    so replicas of a dataset share their entries, and by their local filename,
+    so that subsets of a file are recorded separately from the whole file.
+    """
+
+    def __init__(self, path: Path):
+
+        """
+        Open (or create) the manifest database.
+
+        Parameters
+        ----------
+        path : Path
+            Path to the SQLite database file.
+        """
+
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    dataset_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER,
+                    checksum TEXT,
+                    checksum_type TEXT,
+                    version TEXT,
+                    completed REAL NOT NULL,
+                    PRIMARY KEY (dataset_id, filename)
+                )
+                """
+            )
+
+    @staticmethod
+    def instance_id(dataset_id: str) -> str:
+        """Dataset ID without its data node suffix."""
+        return dataset_id.split('|')[0]
+
+    def record(self, file: "File", verified: bool = True) -> None:
+        """
+        Record a completely downloaded file.
+
+        Parameters
+        ----------
+        file : File
+            The downloaded file.
+        verified : bool, optional
+            Whether the file's checksum was verified. Unverified files are recorded
+            without a checksum. Default is True.
+        """
+        dataset = file.dataset
+        row = (
+            self.instance_id(dataset.dataset_id),
+            file.local_path.name,
+            str(file.local_path),
+            file.local_size,
+            file.checksum if verified else None,
+            file.checksum_type if verified else None,
+            dataset.version,
+            time(),
+        )
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def forget(self, file: "File") -> None:
+        """Remove a file from the manifest."""
+        self.discard(self.instance_id(file.dataset.dataset_id), file.local_path.name)
+
+    def discard(self, dataset_id: str, filename: str) -> None:
+        """Remove the entry of a file, by its dataset's instance ID and filename."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE dataset_id = ? AND filename = ?", (dataset_id, filename))
+
+    def entries(self) -> list[Entry]:
+        """Every recorded file, with the checksum it was verified against (None if unverified)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT dataset_id, filename, path, size, checksum, checksum_type FROM files ORDER BY path"
+            ).fetchall()
+        return [
+            Entry(dataset_id, filename, Path(path), size, checksum, checksum_type)
+            for dataset_id, filename, path, size, checksum, checksum_type in rows
+        ]
+
+    def completed(self, dataset_id: str) -> dict[str, tuple]:
+        """
+        Files of a dataset recorded as complete.
+
+        Returns
+        -------
+        dict[str, tuple]
+            Mapping of filename to (size, checksum)
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename, size, checksum FROM files WHERE dataset_id = ?",
+                (self.instance_id(dataset_id),),
+            ).fetchall()
+        return {filename: (size, checksum) for filename, size, checksum in rows}
+
+    def reconcile(self) -> tuple[int, int]:
+        """
+        Check every recorded file against the filesystem and drop the entries of
+        files that are missing or whose size no longer matches.
+
+        Returns
+        -------
+        tuple[int, int]
+            Number of entries checked, and number removed
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT dataset_id, filename, path, size FROM files").fetchall()
+        stale = []
+        for dataset_id, filename, path, size in rows:
+            try:
+                actual = Path(path).stat().st_size
+            except FileNotFoundError:
+                actual = None
+            if actual is None or (size is not None and actual != size):
+                stale.append((dataset_id, filename))
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM files WHERE dataset_id = ? AND filename = ?", stale)
+        return len(rows), len(stale)
+
+    def merge(self, path: Path) -> int:
+        """
+        Add the entries of another manifest, such as a shard's, replacing the
+        entries of the same files.
+
+        Returns
+        -------
+        int
+            Number of entries merged
+        """
+        with self._lock:
+            self._conn.execute("ATTACH DATABASE ? AS other", (str(path),))
+            try:
+                with self._conn:
+                    merged = self._conn.execute("INSERT OR REPLACE INTO files SELECT * FROM other.files").rowcount
+            finally:
+                self._conn.execute("DETACH DATABASE other")
+        return merged
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
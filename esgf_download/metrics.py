@@ -0,0 +1,366 @@
+"""
+Performance metrics of a run: the latency of every ESGF index query and the
+timings of every file transfer, aggregated per data node and per dataset.
+
+At the end of a download run they are written as a JSON summary and as an
+OpenMetrics text file, which node_exporter's textfile collector can scrape.
+"""
+
+import os
+import json
+import threading
+import requests
+from time import monotonic, time
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs
+
+# local imports
+from esgf_download.console import console
+from esgf_download.progress import FileTask
+from esgf_download.sessions import IndexSession
+
+
+def _quantile(values: list, q: float) -> Optional[float]:
+    """Nearest-rank quantile of a list of numbers, or None if it is empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _timings(values: list) -> dict:
+    """Count, total, mean, median, 95th percentile and maximum of a list of seconds."""
+    return {
+        'count': len(values),
+        'seconds': round(sum(values), 6),
+        'mean': round(sum(values) / len(values), 6) if values else None,
+        'p50': _quantile(values, 0.5),
+        'p95': _quantile(values, 0.95),
+        'max': max(values) if values else None,
+    }
+
+
+def _group() -> dict:
+    """Empty per-node or per-dataset transfer counters."""
+    return {'files': 0, 'done': 0, 'skipped': 0, 'failed': 0, 'bytes': 0, 'retries': 0,
+            'errors': 0, 'transfer_time': 0.0, 'ttfb': []}
+
+
+def search_kind(url: str) -> str:
+    """
+    Kind of an index query: 'files' (a dataset's file listing), 'count' (a hit
+    count, sent before a search) or 'datasets'.
+    """
+    query = parse_qs(urlsplit(url).query)
+    if query.get('type') == ['File']:
+        return 'files'
+    if query.get('limit') == ['0']:
+        return 'count'
+    return 'datasets'
+
+
+class _TimedSession(IndexSession):
+    """
+    Session for the ESGF index that records the latency of every query, from
+    when it gets a slot (time waiting for one is not the index's latency).
+    """
+
+    def __init__(self, metrics: "RunMetrics", limit: int):
+        super().__init__(limit)
+        self._metrics = metrics
+
+    def _send(self, method, url, *args, **kwargs):
+        start = monotonic()
+        try:
+            response = super()._send(method, url, *args, **kwargs)
+        except requests.exceptions.RequestException:
+            self._metrics.record_search(url, monotonic() - start, None, 0)
+            raise
+        self._metrics.record_search(url, monotonic() - start, response.status_code, len(response.content))
+        return response
+
+
+class RunMetrics:
+    """
+    Collects search and transfer metrics over a run, thread-safely.
+
+    Index queries are timed by the session returned by ``session()``, which is
+    passed to the ``SearchConnection``; file transfers are recorded from their
+    finished ``FileTask``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = monotonic()
+        self.started_at = time()
+        self.searches: list[dict] = []
+        self.files: list[dict] = []
+        self.slots: Optional[int] = None  # transfers that can run at once
+        self.slots_per_node: Optional[int] = None
+
+    def set_slots(self, slots: int, per_node: int) -> None:
+        """Set how many transfers could run at once, in all and per data node, for the makespan bound."""
+        self.slots = slots
+        self.slots_per_node = per_node
+
+    def session(self, limit: int = 10) -> IndexSession:
+        """
+        An ``IndexSession`` that times every request, shared by all search threads
+        so that connections to the index are also reused.
+
+        Parameters
+        ----------
+        limit : int, optional
+            Maximum number of queries in flight, and of connections kept open to
+            the index. Default is 10.
+        """
+        return _TimedSession(self, limit)
+
+    def record_search(self, url: str, seconds: float, status: Optional[int], nbytes: int) -> None:
+        """Record one index query; ``status`` is None if it failed without a response."""
+        record = {
+            'kind': search_kind(url),
+            'url': url,
+            'seconds': round(seconds, 6),
+            'status': status,
+            'bytes': nbytes,
+        }
+        with self._lock:
+            self.searches.append(record)
+
+    def record_file(self, task: FileTask) -> None:
+        """Record a finished file transfer."""
+        wall = (task.ended or monotonic()) - task.started
+        record = {
+            'filename': task.filename,
+            'dataset_id': task.dataset_id,
+            'state': task.state,
+            'node': task.node,
+            'size': task.total,
+            'bytes': task.transferred,
+            'attempts': task.attempts,
+            'retries': max(task.attempts - 1, 0),
+            'failed_nodes': list(task.failed_nodes),
+            'ttfb': round(task.ttfb, 6) if task.ttfb is not None else None,
+            'transfer_time': round(task.transfer_time, 6),
+            'start': round(task.started - self.started, 6),  # seconds into the run
+            'wall_time': round(wall, 6),
+            'throughput': round(task.transferred / task.transfer_time) if task.transfer_time > 0 else None,
+            'error': task.error,
+        }
+        with self._lock:
+            self.files.append(record)
+
+    def summary(self) -> dict:
+        """
+        Aggregates of the run so far.
+
+        Returns
+        -------
+        dict
+            ``run``, plus ``searches`` per query kind and ``nodes`` and ``datasets``
+            breakdowns of the transfers
+        """
+        with self._lock:
+            searches, files = list(self.searches), list(self.files)
+
+        by_kind: dict[str, list] = {}
+        for search in searches:
+            by_kind.setdefault(search['kind'], []).append(search)
+        search_summary = {
+            kind: {**_timings([s['seconds'] for s in items]),
+                   'errors': sum(1 for s in items if s['status'] is None or s['status'] >= 400)}
+            for kind, items in sorted(by_kind.items())
+        }
+
+        nodes: dict[str, dict] = {}
+        datasets: dict[str, dict] = {}
+        for file in files:
+            groups = [datasets.setdefault(file['dataset_id'], _group())]
+            if file['node'] is not None:
+                groups.append(nodes.setdefault(file['node'], _group()))
+            for group in groups:
+                group['files'] += 1
+                group[file['state'] if file['state'] in ('done', 'skipped') else 'failed'] += 1
+                group['bytes'] += file['bytes']
+                group['retries'] += file['retries']
+                group['transfer_time'] += file['transfer_time']
+                if file['ttfb'] is not None:
+                    group['ttfb'].append(file['ttfb'])
+            # A dataset's wall time runs from its first file starting to its last finishing
+            dataset = datasets[file['dataset_id']]
+            dataset['first'] = min(dataset.get('first', file['start']), file['start'])
+            dataset['last'] = max(dataset.get('last', 0.0), file['start'] + file['wall_time'])
+            # Failed attempts are charged to the node they were made on, whichever
+            # node the file ended up coming from
+            for node in file['failed_nodes']:
+                nodes.setdefault(node, _group())['errors'] += 1
+                dataset['errors'] += 1
+        for dataset in datasets.values():
+            dataset['wall_time'] = round(dataset.pop('last') - dataset.pop('first'), 6)
+        for group in (*nodes.values(), *datasets.values()):
+            group['transfer_time'] = round(group['transfer_time'], 6)
+            group['throughput'] = round(group['bytes'] / group['transfer_time']) if group['transfer_time'] > 0 else None
+            ttfb = group.pop('ttfb')
+            group['ttfb_mean'] = round(sum(ttfb) / len(ttfb), 6) if ttfb else None
+            group['ttfb_p95'] = _quantile(ttfb, 0.95)
+
+        elapsed = monotonic() - self.started
+        transferred = sum(file['bytes'] for file in files)
+        makespan, bound = self._makespan(files)
+        return {
+            'run': {
+                'started': self.started_at,
+                'elapsed': round(elapsed, 3),
+                'bytes': transferred,
+                'rate': round(transferred / elapsed) if elapsed > 0 else 0,
+                'files': len(files),
+                'files_failed': sum(1 for file in files if file['state'] == 'failed'),
+                'searches': len(searches),
+                'search_time': round(sum(search['seconds'] for search in searches), 6),
+                'makespan': makespan,
+                'makespan_bound': bound,
+            },
+            'searches': search_summary,
+            'nodes': dict(sorted(nodes.items())),
+            'datasets': dict(sorted(datasets.items())),
+        }
+
+    def _makespan(self, files: list) -> tuple[Optional[float], Optional[float]]:
+        """
+        Makespan of the transfers (first start to last finish), and a lower bound
+        on it: the makespan if the same transfers had been packed perfectly into
+        the available slots. No schedule finishes before the longest transfer,
+        before the total transfer time divided among all the slots, or before a
+        node's transfer time divided among its slots.
+
+        The bound counts only the time each file held a connection, not the time
+        it waited for a node slot or backed off between retries, which a better
+        schedule could have avoided.
+        """
+        if not files:
+            return None, None
+        makespan = max(file['start'] + file['wall_time'] for file in files) - min(file['start'] for file in files)
+        bound = max(file['transfer_time'] for file in files)
+        if self.slots:
+            bound = max(bound, sum(file['transfer_time'] for file in files) / self.slots)
+        if self.slots_per_node:
+            per_node: dict[str, float] = {}
+            for file in files:
+                if file['node'] is not None:
+                    per_node[file['node']] = per_node.get(file['node'], 0.0) + file['transfer_time']
+            bound = max([bound, *(seconds / self.slots_per_node for seconds in per_node.values())])
+        return round(makespan, 6), round(bound, 6)
+
+    def write_json(self, path: Path) -> None:
+        """Write the summary, every index query and every file transfer as JSON."""
+        with self._lock:
+            detail = {'search_log': list(self.searches), 'file_log': list(self.files)}
+        _write_atomic(Path(path), json.dumps({**self.summary(), **detail}, indent=1))
+
+    def write_openmetrics(self, path: Path) -> None:
+        """
+        Write the summary in the OpenMetrics text format. Every metric is a gauge
+        holding the value for the latest run, which suits node_exporter's textfile
+        collector (point ``--collector.textfile.directory`` at the file's directory).
+        """
+        _write_atomic(Path(path), openmetrics(self.summary()))
+
+    def report(self) -> None:
+        """Print where the time went: searches, and transfers per data node."""
+        summary = self.summary()
+        run = summary['run']
+        if run['makespan']:
+            console.print(
+                f"[blue]⏱ Makespan:[/blue] {run['makespan']:.1f} s of transfers "
+                f"[dim](ideal bound {run['makespan_bound']:.1f} s, "
+                f"{min(run['makespan_bound'] / run['makespan'], 1):.0%} efficient)[/dim]"
+            )
+        for kind, stats in summary['searches'].items():
+            console.print(
+                f"[blue]⏱ Search ({kind}):[/blue] {stats['count']} queries, {stats['seconds']:.1f} s "
+                f"[dim](mean {stats['mean'] * 1000:.0f} ms, p95 {stats['p95'] * 1000:.0f} ms"
+                f"{', ' + str(stats['errors']) + ' errors' if stats['errors'] else ''})[/dim]"
+            )
+        for node, stats in summary['nodes'].items():
+            if not stats['files']:
+                continue
+            rate = f"{stats['throughput'] / 1024**2:.1f} MB/s" if stats['throughput'] else "-"
+            ttfb = f"TTFB {stats['ttfb_mean'] * 1000:.0f} ms" if stats['ttfb_mean'] is not None else "no transfers"
+            console.print(
+                f"[blue]⏱ {node}:[/blue] {stats['done']} files, {stats['bytes'] / 1024**3:.2f} GB at {rate} "
+                f"[dim]({ttfb}, {stats['retries']} retries, {stats['errors']} failed attempts)[/dim]"
+            )
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    """Write a file through a temporary file, so that scrapers never see half of it."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def _label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# (name, help, summary key) of the metrics exported per data node and per dataset
+GROUP_METRICS = [
+    ('files', "Files finished", 'files'),
+    ('files_failed', "Files that could not be downloaded", 'failed'),
+    ('bytes', "Bytes transferred", 'bytes'),
+    ('retries', "Transfer attempts beyond the first, including failovers", 'retries'),
+    ('errors', "Failed transfer attempts", 'errors'),
+    ('transfer_seconds', "Seconds spent holding a connection", 'transfer_time'),
+    ('throughput_bytes_per_second', "Bytes transferred per second of transfer time", 'throughput'),
+    ('ttfb_seconds_mean', "Mean seconds from request to response headers", 'ttfb_mean'),
+    ('ttfb_seconds_p95', "95th percentile of seconds from request to response headers", 'ttfb_p95'),
+]
+
+
+def openmetrics(summary: dict) -> str:
+    """Render a ``RunMetrics.summary()`` in the OpenMetrics text format."""
+    lines: list[str] = []
+
+    def gauge(name: str, help: str, samples: list) -> None:
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            return
+        name = f"esgf_download_{name}"
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{_label(val)}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    run = summary['run']
+    gauge('run_start_time_seconds', "Unix time the latest run started", [({}, run['started'])])
+    gauge('run_seconds', "Duration of the latest run", [({}, run['elapsed'])])
+    gauge('run_bytes', "Bytes transferred by the latest run", [({}, run['bytes'])])
+    gauge('run_files', "Files finished by the latest run", [({}, run['files'])])
+    gauge('run_files_failed', "Files that failed in the latest run", [({}, run['files_failed'])])
+    gauge('run_makespan_seconds', "Seconds from the first transfer starting to the last finishing",
+          [({}, run['makespan'])])
+    gauge('run_makespan_bound_seconds', "Lower bound on the makespan with perfect packing of the transfers",
+          [({}, run['makespan_bound'])])
+
+    searches = summary['searches']
+    for name, help, key in [
+        ('search_queries', "Index queries sent", 'count'),
+        ('search_errors', "Index queries that failed", 'errors'),
+        ('search_seconds', "Seconds spent waiting for index queries", 'seconds'),
+        ('search_seconds_mean', "Mean latency of index queries", 'mean'),
+        ('search_seconds_p95', "95th percentile latency of index queries", 'p95'),
+        ('search_seconds_max', "Maximum latency of index queries", 'max'),
+    ]:
+        gauge(name, help, [({'kind': kind}, stats[key]) for kind, stats in searches.items()])
+
+    for group, label in (('nodes', 'node'), ('datasets', 'dataset')):
+        for name, help, key in GROUP_METRICS:
+            gauge(f"{label}_{name}", f"{help}, per {'data node' if label == 'node' else 'dataset'}",
+                  [({label: id}, stats[key]) for id, stats in summary[group].items()])
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,147 @@
+"""
+Replica-aware data node selection, shared across all transfers of a run.
+"""
+
+import threading
+import requests
+from time import monotonic
+from typing import Optional
+
+# local imports
+from esgf_download.console import console
+from esgf_download.sessions import SessionPool, host_of
+
+
+class NodeStats:
+    """Health and performance of a single data node."""
+
+    def __init__(self):
+        self.latency: Optional[float] = None     # seconds to first byte of the probe
+        self.throughput: Optional[float] = None  # bytes/s, moving average
+        self.failures = 0                        # consecutive failures
+        self.probing = False                     # a probe has been started
+        self.probed = threading.Event()          # ...and has finished
+
+    @property
+    def score(self) -> float:
+        """Higher is better: throughput, penalised by latency for small transfers."""
+        if self.throughput is None:
+            return 0.0
+        return self.throughput / (1.0 + (self.latency or 0.0))
+
+
+class NodeHealth:
+    """
+    Tracks the latency, throughput and failures of every data node used in a run,
+    and ranks the replica URLs of a file by them.
+
+    Each node is probed once, with a small ranged request, the first time one of
+    its URLs is ranked. Nodes that fail ``max_failures`` times in a row are marked
+    dead and skipped for the rest of the run, unless no other replica is left.
+    """
+
+    def __init__(self, max_failures: int = 3, probe_bytes: int = 256 * 1024,
+                 timeout: float = 30):
+
+        """
+        Parameters
+        ----------
+        max_failures : int, optional
+            Consecutive failures after which a node is considered dead. Default is 3.
+        probe_bytes : int, optional
+            Number of bytes fetched to probe a node's throughput. Default is 256 KB.
+        timeout : float, optional
+            Timeout of probe requests in seconds. Default is 30.
+        """
+
+        self.max_failures = max_failures
+        self.probe_bytes = probe_bytes
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._nodes: dict[str, NodeStats] = {}
+
+    def _stats(self, host: str) -> NodeStats:
+        with self._lock:
+            if host not in self._nodes:
+                self._nodes[host] = NodeStats()
+            return self._nodes[host]
+
+    def is_dead(self, url: str) -> bool:
+        """Whether the node serving a URL has failed too many times in a row."""
+        return self._stats(host_of(url)).failures >= self.max_failures
+
+    def record_success(self, url: str, nbytes: int, seconds: float) -> None:
+        """Record a completed transfer and update the node's throughput estimate."""
+        stats = self._stats(host_of(url))
+        with self._lock:
+            stats.failures = 0
+            if seconds > 0 and nbytes > 0:
+                rate = nbytes / seconds
+                stats.throughput = rate if stats.throughput is None else 0.7 * stats.throughput + 0.3 * rate
+
+    def record_failure(self, url: str) -> None:
+        """Record a failed or stalled transfer."""
+        stats = self._stats(host_of(url))
+        with self._lock:
+            stats.failures += 1
+            dead = stats.failures == self.max_failures
+        if dead:
+            console.print(f"[red]✗ Data node {host_of(url)} marked unavailable[/red] [dim](repeated failures)[/dim]")
+
+    def probe(self, url: str, sessions: SessionPool) -> None:
+        """
+        Measure the latency and throughput of a URL's node, once per node. Concurrent
+        callers for the same node wait for the first probe instead of repeating it.
+        """
+        stats = self._stats(host_of(url))
+        with self._lock:
+            first = not stats.probing
+            stats.probing = True
+        if not first:
+            stats.probed.wait(timeout=self.timeout)
+            return
+
+        try:
+            start = monotonic()
+            headers = {'Range': f"bytes=0-{self.probe_bytes - 1}"}
+            with sessions.get(url, stream=True, timeout=self.timeout, headers=headers) as response:
+                response.raise_for_status()
+                latency = monotonic() - start
+                received = 0
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    received += len(chunk)
+                    if received >= self.probe_bytes:
+                        break
+            with self._lock:
+                stats.latency = latency
+            self.record_success(url, received, monotonic() - start)
+        except requests.exceptions.RequestException:
+            self.record_failure(url)
+        finally:
+            stats.probed.set()
+
+    def rank(self, urls: list[str], sessions: SessionPool, probe: bool = True) -> list[str]:
+        """
+        Order replica URLs from most to least promising.
+
+        Nodes are probed on first use (only if there is more than one replica to
+        choose from, and ``probe`` is set; OPeNDAP URLs can't be probed with a
+        ranged request). Dead nodes are dropped unless every replica is dead.
+        """
+        if probe and len(urls) > 1:
+            for url in urls:
+                self.probe(url, sessions)
+        alive = [url for url in urls if not self.is_dead(url)] or list(urls)
+        # sorted() is stable, so ties keep the preferred-node-first search order
+        return sorted(alive, key=lambda url: self._stats(host_of(url)).score, reverse=True)
+
+    def report(self) -> None:
+        """Print the measured performance of every node that was used."""
+        with self._lock:
+            nodes = sorted(self._nodes.items())
+        for host, stats in nodes:
+            if stats.throughput is None:
+                continue
+            rate = stats.throughput / 1024**2
+            latency = f", {stats.latency * 1000:.0f} ms latency" if stats.latency is not None else ""
+            console.print(f"[blue]📡 {host}:[/blue] {rate:.1f} MB/s{latency}")
@@ -52,10 +52,53 @@ class Config:
         self.MYPROXY_HOST = esgf['myproxy_host']
         self.SEARCH_NODE = esgf['search_node']
         self.DATA_NODE_PREFERENCE = esgf['data_node_preference']
+        self.SEARCH_WORKERS = esgf.get('search_workers', 4)
+        self.SEARCH_BATCHING = esgf.get('search_batching') or 'none'
+        if self.SEARCH_BATCHING not in ('none', 'model', 'model_table'):
+            raise ValueError(
+                f"Invalid search_batching '{self.SEARCH_BATCHING}' - expected none, model or model_table"
+            )
         
         # Download settings
         download = self._config['download']
         self.MAX_WORKERS = download['max_workers']
+        self.MAX_PER_NODE = download.get('max_per_node') or self.MAX_WORKERS
+        self.REPLICAS = download.get('replicas', False)
+        self.SEGMENTS = download.get('segments', 1)
+        self.SEGMENT_THRESHOLD = download.get('segment_threshold_mb', 1024) * 1024**2
+        self.ENGINE = download.get('engine', 'threads')
+        if self.ENGINE not in ('threads', 'async'):
+            raise ValueError(f"Invalid download engine '{self.ENGINE}' - expected threads or async")
+        self.ASYNC_CONCURRENCY = download.get('async_concurrency', 64)
+        self.MANIFEST = download.get('manifest', True)
+        self.ADAPTIVE = download.get('adaptive', False)
+        self.BANDWIDTH_LIMIT = download.get('bandwidth_limit')
+        self.RETRIES = download.get('retries', 0)
+        self.REPORT_INTERVAL = download.get('report_interval', 30)
+        self.SYNC_VERSIONS = download.get('sync_versions', False)
+        self.ORDER = download.get('order', 'submitted')
+        if self.ORDER not in ('largest', 'smallest', 'submitted'):
+            raise ValueError(f"Invalid download order '{self.ORDER}' - expected largest, smallest or submitted")
+        self.PRIORITY = download.get('priority') or {}
+        self.MANIFEST_PATH = self.DATA_HOME / '.esgf_manifest.sqlite'
+
+        # Search cache settings
+        cache = self._config.get('cache', {})
+        self.CACHE_ENABLED = cache.get('enabled', False)
+        self.CACHE_PATH = Path(cache.get('path', self.DATA_HOME / '.esgf_cache.sqlite'))
+        self.CACHE_TTL = cache.get('ttl_hours', 24) * 3600
+        self.CACHE_MAX_SIZE = cache.get('max_size_mb', 256) * 1024**2
+
+        # Content-addressed store settings
+        store = self._config.get('store', {})
+        self.STORE_ENABLED = store.get('enabled', False)
+        self.STORE_PATH = Path(store.get('path', self.DATA_HOME / '.esgf_store'))
+
+        # Performance metrics settings
+        metrics = self._config.get('metrics', {})
+        self.METRICS_ENABLED = metrics.get('enabled', False)
+        self.METRICS_JSON = Path(metrics.get('json', self.DATA_HOME / '.esgf_metrics.json'))
+        self.METRICS_OPENMETRICS = Path(metrics.get('openmetrics', self.DATA_HOME / '.esgf_metrics.prom'))
         
         # Data settings
         data = self._config['data']
@@ -65,6 +108,32 @@ class Config:
         self.VARIABLES = data['variables']
         self.MODELS = data['models']
         self.EXTENSIONS_2300 = data.get('2300_extensions', False)
+
+        # Time ranges - (start year, end year) of the files wanted per scenario, or None for all
+        time_config = data.get('time_range') or {}
+        default_range = time_config.get('default')
+        self.TIME_RANGE = {}
+        for scenario in self.SCENARIOS:
+            self.TIME_RANGE[scenario] = _year_range(time_config.get(scenario, default_range), scenario)
+
+        # Subsetting settings - the time window of a subset is the scenario's time_range
+        subset = self._config.get('subset') or {}
+        self.SUBSET_ENABLED = subset.get('enabled', False)
+        self.SUBSET_BBOX = _numbers(subset.get('bbox'), 4, 'bbox', "[lon_min, lat_min, lon_max, lat_max]")
+        self.SUBSET_LEVELS = _numbers(subset.get('levels'), 2, 'levels', "[min, max]")
+        self.SUBSET_VARIABLES = subset.get('variables') or self.VARIABLES
+        self.SUBSET_CHUNK = int(subset.get('chunk_mb', 64) * 1024**2)
+
+        # Consolidation settings
+        consolidate = self._config.get('consolidate') or {}
+        self.CONSOLIDATE_ENABLED = consolidate.get('enabled', False)
+        self.CONSOLIDATE_FORMAT = consolidate.get('format', 'zarr')
+        if self.CONSOLIDATE_FORMAT not in ('zarr', 'netcdf'):
+            raise ValueError(f"Invalid consolidation format '{self.CONSOLIDATE_FORMAT}' - expected zarr or netcdf")
+        self.CONSOLIDATE_CHUNKS = consolidate.get('chunks') or {'time': 12}
+        self.CONSOLIDATE_COMPRESSION = consolidate.get('compression', 4)
+        self.CONSOLIDATE_WORKERS = consolidate.get('workers', 2)
+        self.CONSOLIDATE_CHUNK = int(consolidate.get('chunk_mb', 64) * 1024**2)
         
         # Mappings
         self.TABLE_ID = self._config['table_mapping']
@@ -84,6 +153,36 @@ class Config:
             self.GRID_LABEL[var] = grid_config.get(var, default_grid)
 
 
+def _year_range(value, scenario: str):
+
+    """
+    Parse a time_range entry: a [start, end] pair of years (inclusive), either of
+    which may be null for an open range, or null for no restriction.
+    """
+
+    if value is None:
+        return None
+    if not isinstance(value, (list, tuple)) or len(value) != 2 \
+            or not all(year is None or isinstance(year, int) for year in value):
+        raise ValueError(f"Invalid time_range for '{scenario}': {value!r} - expected [start_year, end_year]")
+    start, end = value
+    if start is not None and end is not None and start > end:
+        raise ValueError(f"Invalid time_range for '{scenario}': {start} is after {end}")
+    return (start, end)
+
+
+def _numbers(value, count: int, name: str, expected: str):
+
+    """Parse a subset entry of ``count`` numbers, or null for no restriction."""
+
+    if value is None:
+        return None
+    if not isinstance(value, (list, tuple)) or len(value) != count \
+            or not all(isinstance(number, (int, float)) for number in value):
+        raise ValueError(f"Invalid subset {name}: {value!r} - expected {expected}")
+    return tuple(value)
+
+
 def load_config(config_path: str) -> Config:
 
     """
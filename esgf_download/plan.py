@@ -0,0 +1,185 @@
+"""
+Download plans: the resolved datasets and files of a configuration, saved so
+that later download runs can start straight from them without searching ESGF.
+
+Plans are written as compact JSON, or as Parquet (one row per file) if the path
+ends in ``.parquet``, which requires pyarrow (``pip install esgf-download[plan]``).
+"""
+
+import json
+from time import strftime
+from pathlib import Path
+from typing import Iterator, Optional, TYPE_CHECKING
+from pyesgf.search.results import FileResult, DatasetResult # type: ignore
+
+# local imports
+from esgf_download.classes import Dataset, File
+from esgf_download.sessions import host_of
+
+if TYPE_CHECKING:
+    from esgf_download.manifest import Manifest
+
+PLAN_VERSION = 1
+
+# Columns of a Parquet plan, one row per file
+COLUMNS = ('dataset_id', 'version', 'model', 'filename', 'size', 'checksum', 'checksum_type', 'urls', 'opendap_urls')
+
+
+def model_of(dataset: Dataset) -> str:
+    """The model (source_id) of a dataset, from its metadata or its dataset ID."""
+    return dataset.model or dataset.dataset_id.split('|')[0].split('.')[3]
+
+
+def plan_entry(dataset: Dataset) -> dict:
+    """Compact description of a resolved dataset and its files."""
+    return {
+        'dataset_id': dataset.dataset_id,
+        'version': dataset.version,
+        'model': model_of(dataset),
+        'files': [
+            {
+                'filename': file.filename,
+                'size': file.size,
+                'checksum': file.checksum,
+                'checksum_type': file.checksum_type,
+                'urls': file.download_urls,
+                'opendap_urls': file.opendap_urls,
+            }
+            for file in dataset.files
+        ],
+    }
+
+
+def write_plan(datasets: list, path: Path) -> None:
+    """
+    Write the plan of resolved datasets to a JSON or Parquet file.
+
+    Parameters
+    ----------
+    datasets : list[Dataset]
+        Resolved datasets, with their files
+    path : Path
+        Output file; Parquet if it ends in ``.parquet``, JSON otherwise
+    """
+    path = Path(path)
+    entries = [plan_entry(dataset) for dataset in datasets]
+    if path.suffix == '.parquet':
+        _write_parquet(entries, path)
+        return
+    plan = {'plan_version': PLAN_VERSION, 'created': strftime('%Y-%m-%dT%H:%M:%S'), 'datasets': entries}
+    path.write_text(json.dumps(plan, separators=(',', ':')))
+
+
+def load_plan(path: Path, data_home: Path, manifest: Optional["Manifest"] = None) -> Iterator[Dataset]:
+    """
+    Datasets of a plan file, with their files already listed so that nothing is
+    searched on ESGF. A time range set on a dataset afterwards still applies to
+    its files.
+
+    Parameters
+    ----------
+    path : Path
+        Plan file written by ``write_plan``
+    data_home : Path
+        Directory the datasets are downloaded to
+    manifest : Manifest, optional
+        Manifest of completely downloaded files
+
+    Raises
+    ------
+    ValueError
+        If the file is not a plan, or was written by a newer version
+    """
+    path = Path(path)
+    if path.suffix == '.parquet':
+        entries = _read_parquet(path)
+    else:
+        plan = json.loads(path.read_text())
+        if not isinstance(plan, dict) or plan.get('plan_version', 0) > PLAN_VERSION:
+            raise ValueError(f"{path} is not a download plan this version can read")
+        entries = plan['datasets']
+
+    for entry in entries:
+        doc = {'id': entry['dataset_id'], 'version': entry['version'], 'source_id': [entry['model']]}
+        dataset = Dataset(DatasetResult(doc, None), data_home=data_home, manifest=manifest)
+        # Populate the file listing directly instead of searching for it
+        files = [_file(item, dataset) for item in entry['files']]
+        dataset._all_files = sorted(files, key=lambda f: f.filename)
+        yield dataset
+
+
+def _file(item: dict, dataset: Dataset) -> File:
+    """Rebuild a File from its plan entry."""
+    doc = {
+        'title': item['filename'],
+        'size': item['size'],
+        'url': [f"{url}|application/netcdf|HTTPServer" for url in item['urls'][:1]],
+    }
+    if item['checksum']:
+        doc['checksum'] = [item['checksum']]
+        doc['checksum_type'] = [item['checksum_type']]
+    file = File(FileResult(doc, None), dataset)
+    file.download_urls = list(item['urls'])
+    # Plans written before OPeNDAP URLs were kept derive them from the first URL
+    if item.get('opendap_urls') is not None:
+        file.opendap_urls = list(item['opendap_urls'])
+    return file
+
+
+def summarise(datasets: list) -> dict:
+    """
+    Totals of a plan, overall and per data node and model.
+
+    The data node of a file is the one it will be downloaded from first.
+
+    Returns
+    -------
+    dict
+        ``total`` plus ``nodes`` and ``models`` breakdowns, each holding
+        [files, bytes, files present, bytes present]
+    """
+    total = [0, 0, 0, 0]
+    nodes: dict[str, list] = {}
+    models: dict[str, list] = {}
+    for dataset in datasets:
+        model = models.setdefault(model_of(dataset), [0, 0, 0, 0])
+        for file in dataset.files:
+            host = host_of(file.download_urls[0]) if file.download_urls else "(no URL)"
+            node = nodes.setdefault(host, [0, 0, 0, 0])
+            size = file.size or 0
+            present = file.exists()
+            for counts in (total, node, model):
+                counts[0] += 1
+                counts[1] += size
+                if present:
+                    counts[2] += 1
+                    counts[3] += size
+    return {'total': total, 'nodes': nodes, 'models': models}
+
+
+def _write_parquet(entries: list, path: Path) -> None:
+    try:
+        import pyarrow as pa # type: ignore
+        import pyarrow.parquet as pq # type: ignore
+    except ImportError:
+        raise ImportError("Parquet plans require pyarrow: pip install esgf-download[plan]") from None
+    rows = [
+        (entry['dataset_id'], entry['version'], entry['model'], *(item[key] for key in COLUMNS[3:]))
+        for entry in entries for item in entry['files']
+    ]
+    table = pa.table({name: [row[i] for row in rows] for i, name in enumerate(COLUMNS)})
+    pq.write_table(table, path)
+
+
+def _read_parquet(path: Path) -> list:
+    try:
+        import pyarrow.parquet as pq # type: ignore
+    except ImportError:
+        raise ImportError("Parquet plans require pyarrow: pip install esgf-download[plan]") from None
+    entries: dict[str, dict] = {}
+    for row in pq.read_table(path).to_pylist():
+        entry = entries.setdefault(row['dataset_id'], {
+            'dataset_id': row['dataset_id'], 'version': row['version'], 'model': row['model'], 'files': []
+        })
+        entry['files'].append({key: row.get(key) for key in COLUMNS[3:]})
+    return list(entries.values())
@@ -0,0 +1,128 @@
+"""
+Order of the download queue. Files are handed to workers by user priority and
+then by size: with largest-first, the longest transfers start early and small
+files fill the gaps around them, instead of one huge file started last
+stretching the end of a run.
+"""
+
+import heapq
+import itertools
+from time import monotonic
+from queue import Queue, Empty
+from typing import Callable, Optional
+
+# local imports
+from esgf_download.classes import File
+
+ORDERS = ('largest', 'smallest', 'submitted')
+
+
+class FileOrder:
+    """
+    Sort key of a file in the download queue: its priority first (higher goes
+    first), then its size according to the order.
+    """
+
+    def __init__(self, order: str = 'submitted', priorities: Optional[dict] = None):
+
+        """
+        Parameters
+        ----------
+        order : str, optional
+            'largest' or 'smallest' first, or 'submitted' (default) to keep the
+            order files were queued in.
+        priorities : dict, optional
+            Priority of the files of each model, experiment, variable or other
+            facet of the dataset ID. Files with no listed facet have priority 0,
+            and a file matching several facets takes the highest.
+        """
+
+        if order not in ORDERS:
+            raise ValueError(f"Invalid download order '{order}' - expected one of {', '.join(ORDERS)}")
+        self.order = order
+        self.priorities = priorities or {}
+
+    def priority(self, file: File) -> int:
+        """User priority of a file, from the facets of its dataset ID."""
+        if not self.priorities:
+            return 0
+        facets = file.dataset.dataset_id.split('|')[0].split('.')
+        return max((self.priorities[facet] for facet in facets if facet in self.priorities), default=0)
+
+    def key(self, file: File) -> tuple:
+        """Sort key of a file, smallest first out of the queue."""
+        size = file.size or 0
+        if self.order == 'largest':
+            return -self.priority(file), -size
+        if self.order == 'smallest':
+            return -self.priority(file), size
+        return -self.priority(file),
+
+
+class FileQueue(Queue):
+    """
+    Queue of files handed out in ``FileOrder``, first come first served among
+    equals. ``None`` (the signal for a worker to stop) comes after every file.
+
+    ``get`` skips over files that ``ready`` rejects, such as files whose data
+    nodes are all at their cap, looking at most ``LOOKAHEAD`` files ahead, so
+    that a busy node holding the largest files doesn't keep workers waiting
+    while other nodes have files to send. If none of them is ready, ``get``
+    blocks until ``wake`` is called (when a node frees a slot) or another file
+    is put, leaving the files in place so that their order is kept.
+    """
+
+    LOOKAHEAD = 64
+
+    def __init__(self, order: FileOrder, ready: Optional[Callable[[File], bool]] = None):
+        self.order = order
+        self.ready = ready
+        super().__init__()
+
+    # Queue calls these with its mutex held
+    def _init(self, maxsize: int) -> None:
+        self.queue: list = []
+        self._count = itertools.count()
+
+    def _qsize(self) -> int:
+        return len(self.queue)
+
+    def _put(self, file: Optional[File]) -> None:
+        key = (1,) if file is None else (0, *self.order.key(file))
+        heapq.heappush(self.queue, (key, next(self._count), file))
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Optional[File]:
+        """Remove and return the first ready file, waiting for one if ``block``."""
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.not_empty:
+            while True:
+                entry = self._ready_entry()
+                if entry is not None:
+                    self.not_full.notify()
+                    return entry[2]
+                remaining = None if deadline is None else deadline - monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise Empty
+                self.not_empty.wait(remaining)
+
+    def wake(self) -> None:
+        """Have waiting ``get`` calls look for a ready file again."""
+        with self.not_empty:
+            self.not_empty.notify_all()
+
+    def _ready_entry(self) -> Optional[tuple]:
+        """Pop the first ready entry within ``LOOKAHEAD``, or None if there is none."""
+        skipped = []
+        found = None
+        while self.queue and len(skipped) < self.LOOKAHEAD:
+            entry = heapq.heappop(self.queue)
+            if entry[2] is None or self.ready is None or self.ready(entry[2]):
+                found = entry
+                break
+            skipped.append(entry)
+        for other in skipped:
+            heapq.heappush(self.queue, other)
+        return found
+
+    def _get(self) -> Optional[File]:
+        return heapq.heappop(self.queue)[2]
@@ -0,0 +1,322 @@
+"""
+Progress accounting for file transfers, decoupled from how it is displayed.
+
+Transfers only bump plain byte counters on a ``FileTask``. A renderer thread
+samples them on a fixed interval and draws either the rich progress display or,
+in headless mode, periodic JSON-lines summaries suited to batch job logs.
+"""
+
+import sys
+import json
+import threading
+from abc import ABC, abstractmethod
+from time import monotonic, strftime
+from contextlib import contextmanager
+from typing import Iterator, Optional, Union
+from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, \
+    TaskProgressColumn, TimeRemainingColumn, TaskID
+
+# local imports
+from esgf_download.classes import File
+from esgf_download.console import console, MAX_DISPLAY_ROWS
+from esgf_download.sessions import host_of
+
+
+class FileTask:
+    """
+    Progress and timings of a single file transfer.
+
+    Only the thread transferring the file writes to it, so updates need no lock;
+    renderers read it concurrently and may see a value one chunk out of date.
+    """
+
+    __slots__ = ('filename', 'dataset_id', 'total', 'completed', 'offset', '_earlier',
+                 'description', 'state', 'error', 'node', 'attempts', 'failed_nodes',
+                 'ttfb', 'transfer_time', 'started', 'ended')
+
+    def __init__(self, file: File):
+        self.filename = file.filename
+        self.dataset_id = file.dataset.dataset_id
+        self.total: Optional[int] = file.size
+        self.completed = 0       # bytes in the local file so far
+        self.offset = 0          # bytes already on disk when the transfer (re)started
+        self._earlier = 0        # bytes transferred by attempts that had to restart
+        self.description = f"[cyan]⬇ {file.filename}"
+        self.state = 'active'    # 'active', 'done', 'skipped' or 'failed'
+        self.error: Optional[str] = None
+        self.node: Optional[str] = None   # data node of the latest attempt
+        self.attempts = 0                 # transfers attempted, including failovers and retries
+        self.failed_nodes: list[str] = []  # data node of every failed attempt
+        self.ttfb: Optional[float] = None  # seconds to the response headers, latest attempt
+        self.transfer_time = 0.0          # seconds holding a connection, over all attempts
+        self.started = monotonic()
+        self.ended: Optional[float] = None
+
+    @property
+    def transferred(self) -> int:
+        """Bytes transferred over the network in this run."""
+        return self._earlier + self.completed - self.offset
+
+    def begin(self, total: Optional[int], offset: int = 0) -> None:
+        """A transfer (re)starts with ``offset`` bytes already on disk."""
+        self._earlier += self.completed - self.offset
+        self.total = total
+        self.completed = self.offset = offset
+
+    @contextmanager
+    def attempt(self, url: str) -> Iterator[None]:
+        """Time one transfer attempt from a URL."""
+        self.node = host_of(url)
+        self.attempts += 1
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.transfer_time += monotonic() - start
+
+    def describe(self, description: str) -> None:
+        """Set the status line shown for this file."""
+        self.description = description
+
+    def skip(self) -> None:
+        """The file already exists locally."""
+        self.state = 'skipped'
+        self._earlier += self.completed - self.offset
+        self.completed = self.offset = self.total or 0  # shown as complete, but nothing transferred
+        self.description = f"[yellow]⚠ {self.filename} (already exists)"
+
+    def succeed(self) -> None:
+        """The file was downloaded and moved into place."""
+        self.state = 'done'
+        self.description = f"[green]✓ {self.filename}"
+
+    def fail(self, error: str, description: Optional[str] = None) -> None:
+        """The file could not be downloaded."""
+        self.state = 'failed'
+        self.error = error
+        self.description = description or f"[red]✗ {self.filename} - {error}"
+
+
+class ProgressTracker:
+    """
+    Run-wide progress: the active file tasks plus counters of finished files.
+
+    The lock is only taken once when a file starts and once when it finishes,
+    never per chunk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: dict[FileTask, None] = {}  # insertion-ordered set
+        self._events: list[Union[FileTask, tuple]] = []  # finished files and datasets
+        self.started = monotonic()
+        self.files_total = 0
+        self.files_done = 0
+        self.files_skipped = 0
+        self.files_failed = 0
+        self._bytes_finished = 0
+
+    def expect(self, count: int) -> None:
+        """Files have been queued."""
+        with self._lock:
+            self.files_total += count
+
+    def add(self, file: File) -> FileTask:
+        """A file transfer is starting."""
+        task = FileTask(file)
+        with self._lock:
+            self._active[task] = None
+        return task
+
+    def finish(self, task: FileTask, success: bool) -> None:
+        """A file transfer has ended, successfully or not."""
+        if task.state == 'active':
+            task.state = 'done' if success else 'failed'
+        task.ended = monotonic()
+        with self._lock:
+            self._active.pop(task, None)
+            self._events.append(task)
+            self._bytes_finished += task.transferred
+            if task.state == 'done':
+                self.files_done += 1
+            elif task.state == 'skipped':
+                self.files_skipped += 1
+            else:
+                self.files_failed += 1
+
+    def dataset_done(self, dataset_id: str, failed: int, total: int) -> None:
+        """Every file of a dataset has finished."""
+        with self._lock:
+            self._events.append((dataset_id, failed, total))
+
+    def drain(self) -> tuple[list[FileTask], list]:
+        """The active tasks, and the events since the last call."""
+        with self._lock:
+            events, self._events = self._events, []
+            return list(self._active), events
+
+    def summary(self) -> dict:
+        """Counters for the whole run so far."""
+        with self._lock:
+            active = list(self._active)
+            summary = {
+                'files_total': self.files_total,
+                'files_done': self.files_done,
+                'files_skipped': self.files_skipped,
+                'files_failed': self.files_failed,
+                'files_active': len(active),
+            }
+            finished = self._bytes_finished
+        summary['bytes'] = finished + sum(task.transferred for task in active)
+        summary['elapsed'] = monotonic() - self.started
+        return summary
+
+
+class Renderer(ABC):
+    """Samples a ``ProgressTracker`` on a background thread every ``interval`` seconds."""
+
+    def __init__(self, tracker: ProgressTracker, interval: float):
+        self.tracker = tracker
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling after rendering a last time."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.render(final=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.render()
+
+    @abstractmethod
+    def render(self, final: bool = False) -> None:
+        """Show the tracker's state, for the last time if ``final``."""
+
+
+class RichRenderer(Renderer):
+    """
+    Rich progress display with one row per file.
+
+    Rows are created when a file starts, completed rows are dropped once more than
+    MAX_DISPLAY_ROWS are shown, and a dataset's rows are collapsed into a single
+    summary line once all of its files have finished.
+    """
+
+    def __init__(self, tracker: ProgressTracker, interval: float = 0.2):
+        super().__init__(tracker, interval)
+        self.progress = Progress(
+            SpinnerColumn(),
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TaskProgressColumn(),
+            TimeRemainingColumn(),
+            console=console,  # Use shared console for consistency
+            auto_refresh=False,  # refreshed by render() instead
+        )
+        self._rows: dict[FileTask, TaskID] = {}
+        self._datasets: dict[str, list[FileTask]] = {}
+
+    def start(self) -> None:
+        self.progress.start()
+        super().start()
+
+    def stop(self) -> None:
+        super().stop()
+        self.progress.stop()
+
+    def render(self, final: bool = False) -> None:
+        active, events = self.tracker.drain()
+        for task in active:
+            self._show(task, new=True)
+        for event in events:
+            if isinstance(event, FileTask):
+                self._show(event, new=len(self.progress.tasks) < MAX_DISPLAY_ROWS)
+                if event.state != 'failed' and len(self.progress.tasks) > MAX_DISPLAY_ROWS:
+                    self._remove(event)
+            else:
+                self._dataset_done(*event)
+        self.progress.refresh()
+
+    def _show(self, task: FileTask, new: bool) -> None:
+        """Update a file's row, creating it if there is none and ``new`` is set."""
+        row = self._rows.get(task)
+        if row is None:
+            if not new:
+                return
+            row = self._rows[task] = self.progress.add_task(task.description, total=task.total)
+            self._datasets.setdefault(task.dataset_id, []).append(task)
+        self.progress.update(row, description=task.description, total=task.total, completed=task.completed)
+
+    def _remove(self, task: FileTask) -> None:
+        row = self._rows.pop(task, None)
+        if row is not None:
+            self.progress.remove_task(row)
+
+    def _dataset_done(self, dataset_id: str, failed: int, total: int) -> None:
+        for task in self._datasets.pop(dataset_id, []):
+            self._remove(task)
+        id, _ = dataset_id.split('|')
+        if failed:
+            console.print(f"[red]✗ {id}[/red] [dim]({failed} of {total} files failed)[/dim]")
+        else:
+            console.print(f"[green]✓ {id}[/green] [dim](complete)[/dim]")
+
+
+class JsonRenderer(Renderer):
+    """
+    Headless progress for batch jobs: one JSON object per line on stdout.
+
+    Every ``interval`` seconds a summary line reports the bytes transferred, the
+    rate over the last interval and the number of files done, skipped, failed,
+    active and queued. Failed files and finished datasets get a line each as they
+    are sampled, and a final summary is written when the run ends.
+    """
+
+    def __init__(self, tracker: ProgressTracker, interval: float = 30.0, stream=None):
+        super().__init__(tracker, interval)
+        self.stream = stream or sys.stdout
+        self._last_bytes = 0
+        self._last_time = tracker.started
+
+    def render(self, final: bool = False) -> None:
+        _, events = self.tracker.drain()
+        for event in events:
+            if isinstance(event, FileTask):
+                if event.state == 'failed':
+                    self._emit({'event': 'failed', 'file': event.filename,
+                                'dataset_id': event.dataset_id, 'error': event.error})
+            else:
+                dataset_id, failed, total = event
+                self._emit({'event': 'dataset', 'dataset_id': dataset_id,
+                            'files': total, 'failed': failed})
+
+        summary = self.tracker.summary()
+        now = self.tracker.started + summary['elapsed']
+        seconds = now - self._last_time
+        rate = (summary['bytes'] - self._last_bytes) / seconds if seconds > 0 else 0.0
+        self._last_bytes, self._last_time = summary['bytes'], now
+        finished = summary['files_done'] + summary['files_skipped'] + summary['files_failed']
+        self._emit({
+            'event': 'summary' if final else 'progress',
+            'elapsed': round(summary['elapsed'], 1),
+            'bytes': summary['bytes'],
+            'rate': round(rate),
+            'average_rate': round(summary['bytes'] / summary['elapsed']) if summary['elapsed'] > 0 else 0,
+            'files_done': summary['files_done'],
+            'files_skipped': summary['files_skipped'],
+            'files_failed': summary['files_failed'],
+            'files_active': summary['files_active'],
+            'files_queued': summary['files_total'] - finished - summary['files_active'],
+        })
+
+    def _emit(self, record: dict) -> None:
+        record = {'time': strftime('%Y-%m-%dT%H:%M:%S'), **record}
+        self.stream.write(json.dumps(record) + "\n")
+        self.stream.flush()
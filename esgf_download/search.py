@@ -1,5 +1,10 @@
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from pyesgf.search import SearchConnection # type: ignore
+from pyesgf.search.results import DatasetResult # type: ignore
 from esgf_download.classes import Dataset
+from esgf_download.cache import SearchCache
+from esgf_download.manifest import Manifest
 
 
 def build_query(config, scenario: str, model: str, variable: str) -> dict:
@@ -16,8 +21,48 @@ def build_query(config, scenario: str, model: str, variable: str) -> dict:
         'grid_label': config.GRID_LABEL[variable],
         'latest': True,
     }
+
+def build_batch_query(config, model: str, scenarios: list, variables: list) -> dict:
+    """
+    Build a multi-valued search query covering several scenarios and variables
+    of one model in a single ESGF search.
+    """
+    return {
+        'project': config.PROJECT,
+        'source_id': model,
+        'variant_label': config.VARIANT_LABEL[model],
+        'experiment_id': list(scenarios),
+        'variable': list(variables),
+        'table_id': sorted({config.TABLE_ID[v] for v in variables}),
+        'frequency': config.FREQUENCY,
+        'data_node': config.DATA_NODE_PREFERENCE,
+        'grid_label': sorted({config.GRID_LABEL[v] for v in variables}),
+        'latest': True,
+    }
+
+def batch_key(config, model: str, variable: str) -> tuple:
+    """Key of the batched search that covers a model and variable."""
+    if config.SEARCH_BATCHING == 'model_table':
+        return (model, config.TABLE_ID[variable])
+    return (model,)
+
+def batch_groups(config) -> dict:
+    """
+    Group the configured variables into batched searches.
+
+    Returns
+    -------
+    dict
+        Mapping of batch key (see ``batch_key``) to the list of variables it covers
+    """
+    groups: dict = {}
+    for model in config.MODELS:
+        for variable in config.VARIABLES:
+            groups.setdefault(batch_key(config, model, variable), []).append(variable)
+    return groups
     
-def search_dataset(conn: SearchConnection, query: dict):
+def search_dataset(conn: SearchConnection, query: dict, fallback: bool = True,
+                   cache: Optional[SearchCache] = None):
     """
     Search for datasets with optional data node preference. If no results
     are found, try without data node preference.
@@ -28,60 +73,227 @@ def search_dataset(conn: SearchConnection, query: dict):
         ESGF search connection
     query : dict
         Query parameters
+    fallback : bool, optional
+        Whether to retry without the data node preference. Default is True.
+    cache : SearchCache, optional
+        On-disk cache to read results from and write them to.
         
     Returns
     -------
-    ResultSet | None
+    list | None
         Search results
     """
     # First try with data node preference
     context = conn.new_context(**query, facets=query.keys())
-    
-    if context.hit_count and context.hit_count > 0:
-        return context.search()
+
+    docs = cache.get_search(conn.url, query) if cache is not None else None
+    if docs is not None:
+        # Rebuild results against a fresh context so that file_context() still works
+        results = [DatasetResult(doc, context) for doc in docs]
+    elif context.hit_count and context.hit_count > 0:
+        results = list(context.search())
+    else:
+        results = []
+    if cache is not None and docs is None:
+        cache.put_search(conn.url, query, [result.json for result in results])
+
+    if results:
+        return results
     
     # If no results and we have a data node preference, try without it
-    if 'data_node' in query:
+    if fallback and 'data_node' in query:
         query.pop('data_node')
-        return search_dataset(conn, query)
+        return search_dataset(conn, query, cache=cache)
     
     # No datasets found
     return None
 
+def _facet_values(result, facet: str) -> list:
+    """Return the values of a facet in a result's json document as a list."""
+    value = result.json.get(facet)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def split_batch_results(results, config) -> dict:
+    """
+    Split the results of a batched search into per-combination buckets.
+
+    Results are only placed in a bucket if their table_id and grid_label match the
+    ones configured for the variable, since a multi-valued query also matches
+    every other combination of the facet values.
+
+    Parameters
+    ----------
+    results : iterable
+        Results of a batched search
+    config : object
+        Configuration object
+
+    Returns
+    -------
+    dict
+        Mapping of (scenario, variable) to a list of matching results
+    """
+    buckets: dict = {}
+    for result in results:
+        variables = _facet_values(result, 'variable_id') or _facet_values(result, 'variable')
+        for variable in variables:
+            if variable not in config.TABLE_ID:
+                continue
+            if config.TABLE_ID[variable] not in _facet_values(result, 'table_id'):
+                continue
+            if config.GRID_LABEL.get(variable) not in _facet_values(result, 'grid_label'):
+                continue
+            for scenario in _facet_values(result, 'experiment_id'):
+                buckets.setdefault((scenario, variable), []).append(result)
+    return buckets
+
+def search_batch(conn: SearchConnection, config, model: str, variables: list,
+                 cache: Optional[SearchCache] = None) -> dict:
+    """
+    Search for every configured scenario and the given variables of one model with
+    a single multi-valued query. Combinations with no results on the preferred
+    data node are searched again, together, without the data node preference.
+
+    Parameters
+    ----------
+    conn : SearchConnection
+        ESGF search connection
+    config : object
+        Configuration object
+    model : str
+        Climate model
+    variables : list
+        Variables covered by this batch
+    cache : SearchCache, optional
+        On-disk cache for search results
+
+    Returns
+    -------
+    dict
+        Mapping of (scenario, variable) to a list of results
+    """
+    query = build_batch_query(config, model, config.SCENARIOS, variables)
+    buckets = split_batch_results(search_dataset(conn, query, fallback=False, cache=cache) or [], config)
+
+    missing = [
+        (scenario, variable) for scenario in config.SCENARIOS for variable in variables
+        if (scenario, variable) not in buckets
+    ]
+    if missing:
+        query.pop('data_node')
+        query['experiment_id'] = sorted({scenario for scenario, _ in missing})
+        query['variable'] = sorted({variable for _, variable in missing})
+        query['table_id'] = sorted({config.TABLE_ID[v] for v in query['variable']})
+        query['grid_label'] = sorted({config.GRID_LABEL[v] for v in query['variable']})
+        fallback = split_batch_results(search_dataset(conn, query, cache=cache) or [], config)
+        for key in missing:
+            if key in fallback:
+                buckets[key] = fallback[key]
+
+    return buckets
+
+def find_replicas(conn: SearchConnection, dataset: Dataset, cache: Optional[SearchCache] = None) -> list:
+    """
+    Find the other copies of a dataset (same instance_id) on different data nodes.
+
+    Parameters
+    ----------
+    conn : SearchConnection
+        ESGF search connection
+    dataset : Dataset
+        Dataset to find replicas of
+    cache : SearchCache, optional
+        On-disk cache for search results
+
+    Returns
+    -------
+    list[Dataset]
+        Replica datasets, excluding the dataset itself
+    """
+    instance_id = dataset.instance_id
+    if not instance_id:
+        return []
+    query = {'instance_id': instance_id}
+    results = search_dataset(conn, query, fallback=False, cache=cache) or []
+    return [
+        Dataset(result, dataset.data_home, cache=cache)
+        for result in results if result.dataset_id != dataset.dataset_id
+    ]
+
 def should_filter_2300_extensions(scenario: str, config) -> bool:
     """Check if 2300 extensions should be filtered for a given scenario."""
     scenarios_to_2300 = ['ssp126', 'ssp585', 'ssp534-over']
     return config.EXTENSIONS_2300 and scenario in scenarios_to_2300
 
-def filter_2300_extensions(results, config) -> list:
+def _ends_by_2300(dataset: Dataset) -> bool:
+    """
+    Whether a dataset ends in the year 2299 or 2300, from its metadata if it has
+    an end date, otherwise from the name of its last file (which lists its files).
+    """
+    if dataset.end_date is not None:
+        return dataset.end_date.year >= 2299
+    # if dataset json has no end date, try to get the end date from the files
+    return bool(dataset.all_files) and dataset.all_files[-1].end_date.year >= 2299
+
+def filter_2300_extensions(results, config, cache: Optional[SearchCache] = None,
+                           manifest: Optional[Manifest] = None, latest: bool = False) -> list:
     """
     Filters a list of results to only include datasets that end in the year 2299 or 2300
-    
+
+    Results are returned as Datasets, so that a file listing fetched to find a
+    dataset's end date is kept and not searched for again. Datasets without an
+    end date in their metadata have their file listings fetched concurrently; the
+    index session keeps the queries in flight to SEARCH_WORKERS across all threads.
+
     Parameters
     ----------
     results : list
         List of search results
     config : object
         Configuration object
-        
+    cache : SearchCache, optional
+        On-disk cache for file listings
+    manifest : Manifest, optional
+        Manifest of completely downloaded files, for the returned Datasets
+    latest : bool, optional
+        Only the latest qualifying version is wanted. Candidates are then checked
+        a version at a time, latest first, stopping at the first version with a
+        qualifying dataset; versions older than one known to qualify from its
+        metadata are never listed. Default is False.
+
     Returns
     -------
-    list
-        Filtered list of results
+    list[Dataset]
+        Filtered datasets, latest version first
     """
     assert config.EXTENSIONS_2300, "2300_extensions flag not enabled - something has gone wrong"
-    filtered_results = []
-    for result in results:
-        dataset = Dataset(result, config.DATA_HOME)
-        if dataset.end_date is None:
-            # if dataset json has no end date, try to get the end date from the files
-            last_file = dataset.files[-1]
-            if last_file.end_date.year >= 2299:
-                filtered_results.append(result)
-            continue
-        elif dataset.end_date.year >= 2299:
-            filtered_results.append(result)
+    datasets = [
+        Dataset(result, config.DATA_HOME, cache=cache, manifest=manifest)
+        for result in sorted(results, key=lambda r: r.json['version'], reverse=True)
+    ]
 
+    # Versions at a time, latest first, or all candidates at once
+    if latest:
+        # Nothing older than a version that qualifies by its metadata can win
+        floor = next((d.version for d in datasets if d.end_date is not None and _ends_by_2300(d)), None)
+        waves: dict = {}
+        for dataset in datasets:
+            if floor is None or dataset.version >= floor:
+                waves.setdefault(dataset.version, []).append(dataset)
+        groups = list(waves.values())
+    else:
+        groups = [datasets]
+
+    filtered_results = []
+    with ThreadPoolExecutor(max_workers=config.SEARCH_WORKERS) as executor:
+        for group in groups:
+            filtered_results += [
+                dataset for dataset, ok in zip(group, executor.map(_ends_by_2300, group)) if ok
+            ]
+            if latest and filtered_results:
+                break
     return filtered_results
 
 
@@ -0,0 +1,191 @@
+"""
+Pooled HTTP sessions for downloading from ESGF data nodes, and the bounded
+session shared by every query to the ESGF index.
+"""
+
+import threading
+import requests
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+# local imports
+from esgf_download.console import console
+from esgf_download.throttle import AdaptiveLimiter, TokenBucket
+
+
+def host_of(url: str) -> str:
+    """Return the host name of a URL."""
+    return urlsplit(url).hostname or ""
+
+
+class IndexSession(requests.Session):
+    """
+    Session for the ESGF index, shared by every search thread, that lets at most
+    ``limit`` queries be in flight at once. Searches run on nested threads (the
+    combination workers, batched searches, and the file listings fetched while
+    filtering 2300 extensions), so the bound is kept here rather than by the
+    size of any one pool.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self._slots = threading.BoundedSemaphore(limit)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=limit)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        with self._slots:
+            return self._send(method, url, *args, **kwargs)
+
+    def _send(self, method, url, *args, **kwargs):
+        """Send a query once it holds a slot."""
+        return super().request(method, url, *args, **kwargs)
+
+
+class SessionPool:
+    """
+    One pooled ``requests.Session`` per data node, shared by all download workers,
+    so that connections (and their TLS handshakes) are reused across files.
+
+    Also limits the number of concurrent transfers from any single data node, since
+    some nodes throttle clients that open too many connections at once. With
+    ``adaptive`` the limit per node moves between 1 and ``max_per_node`` according
+    to how the node responds, and an optional ``bandwidth`` bucket caps the
+    aggregate transfer rate.
+    """
+
+    def __init__(self, max_per_node: int = 4, adaptive: bool = False,
+                 bandwidth: Optional[TokenBucket] = None,
+                 on_release: Optional[Callable[[], None]] = None):
+
+        """
+        Parameters
+        ----------
+        max_per_node : int, optional
+            Maximum number of concurrent transfers per data node. Default is 4.
+        adaptive : bool, optional
+            Adapt the limit per node to its throughput and errors. Default is False.
+        bandwidth : TokenBucket, optional
+            Global bandwidth cap shared by every transfer.
+        on_release : callable, optional
+            Called whenever a transfer slot frees up on any node, such as to
+            wake workers waiting for a node to have room.
+        """
+
+        self.max_per_node = max_per_node
+        self.adaptive = adaptive
+        self.bandwidth = bandwidth
+        self.on_release = on_release
+        self._lock = threading.Lock()
+        self._sessions: dict[str, requests.Session] = {}
+        self._limiters: dict[str, AdaptiveLimiter] = {}
+        self._requests: dict[str, int] = {}
+
+    def session(self, url: str) -> requests.Session:
+        """Return the shared session for the host of a URL, creating it if needed."""
+        host = host_of(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_per_node)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[host] = session
+                self._limiters[host] = AdaptiveLimiter(
+                    self.max_per_node, adaptive=self.adaptive, on_release=self.on_release
+                )
+                self._requests[host] = 0
+        return session
+
+    def limiter(self, url: str) -> AdaptiveLimiter:
+        """Return the concurrency limiter of the host of a URL."""
+        self.session(url)
+        return self._limiters[host_of(url)]
+
+    def has_capacity(self, url: str) -> bool:
+        """Whether a transfer from the host of a URL could start without waiting."""
+        with self._lock:
+            limiter = self._limiters.get(host_of(url))
+        return limiter is None or limiter.has_capacity()
+
+    def throttle(self, url: str, nbytes: int) -> None:
+        """
+        Account for bytes received from a URL: feeds the host's adaptive limit and
+        sleeps as needed to respect the global bandwidth cap.
+        """
+        self.limiter(url).add_bytes(nbytes)
+        if self.bandwidth is not None:
+            self.bandwidth.consume(nbytes)
+
+    def backoff(self, url: str) -> None:
+        """The host of a URL is throttling us or timing out: lower its limit."""
+        self.limiter(url).backoff()
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[requests.Session]:
+        """
+        Hold one of the host's transfer slots for the duration of the block.
+
+        Yields
+        ------
+        requests.Session
+            The shared session for the host
+        """
+        session = self.session(url)
+        limiter = self.limiter(url)
+        limiter.acquire()
+        try:
+            yield session
+        finally:
+            limiter.release()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Send a GET request through the host's shared session."""
+        session = self.session(url)
+        with self._lock:
+            self._requests[host_of(url)] += 1
+        return session.get(url, **kwargs)
+
+    def stats(self) -> dict[str, tuple[int, int]]:
+        """
+        Connection reuse statistics.
+
+        Returns
+        -------
+        dict[str, tuple[int, int]]
+            Mapping of host to (requests sent, connections opened)
+        """
+        stats = {}
+        with self._lock:
+            for host, session in self._sessions.items():
+                connections = 0
+                for adapter in {id(a): a for a in session.adapters.values()}.values():
+                    pools = adapter.poolmanager.pools
+                    for key in pools.keys():
+                        pool = pools[key]
+                        connections += getattr(pool, 'num_connections', 0)
+                stats[host] = (self._requests[host], connections)
+        return stats
+
+    def report(self) -> None:
+        """Print connection reuse statistics for every data node used."""
+        for host, (sent, opened) in sorted(self.stats().items()):
+            if sent == 0:
+                continue
+            reused = max(sent - opened, 0)
+            limit = f", limit {self._limiters[host].limit}" if self.adaptive else ""
+            console.print(
+                f"[blue]🔌 {host}:[/blue] {sent} requests over {opened} connections "
+                f"[dim]({reused} reused{limit})[/dim]"
+            )
+
+    def close(self) -> None:
+        """Close every session."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
@@ -0,0 +1,315 @@
+"""
+Sharded downloads: several processes, possibly on different hosts, splitting one
+configuration between them over a shared DATA_HOME.
+"""
+
+import os
+import json
+import uuid
+import socket
+import hashlib
+import threading
+from time import time
+from pathlib import Path
+from typing import Callable, Optional
+
+# local imports
+from esgf_download.classes import File
+from esgf_download.console import console
+
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    """
+    Parse a shard specification ``i/N`` (shard ``i`` of ``N``, counting from 0).
+
+    Raises
+    ------
+    ValueError
+        If the specification is malformed or ``i`` is not in ``0..N-1``
+    """
+    index, _, count = spec.partition('/')
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError(f"shard index must be between 0 and {count - 1}")
+    return index, count
+
+
+def shard_manifests(data_home: Path, lease_ttl: float = 300) -> tuple[list[Path], list[Path]]:
+    """
+    Manifests kept by the shards of sharded runs over a data directory.
+
+    Parameters
+    ----------
+    data_home : Path
+        Shared data directory.
+    lease_ttl : float, optional
+        Seconds without a status update after which an unfinished shard is
+        considered dead. Default is 300.
+
+    Returns
+    -------
+    tuple[list[Path], list[Path]]
+        Manifests of shards that finished or died, which can be merged, and
+        manifests of shards that are still running
+    """
+    done, running = [], []
+    now = time()
+    for path in sorted((Path(data_home) / '.esgf_shards').glob('manifest-*-of-*.sqlite')):
+        status_path = path.with_name(path.name.replace('manifest-', 'shard-', 1)).with_suffix('.json')
+        try:
+            status = json.loads(status_path.read_text())
+        except (FileNotFoundError, ValueError):
+            status = None
+        if status is not None and not status['finished'] and now - status['updated'] < lease_ttl:
+            running.append(path)
+        else:
+            done.append(path)
+    return done, running
+
+
+class Shard:
+    """
+    One shard of a sharded download run.
+
+    Files are partitioned between shards by a stable hash of their dataset's
+    instance ID and filename, so every shard computes the same partition. Before
+    downloading a file, a shard takes a lease on it: a ``.lease`` file next to it
+    on the shared filesystem, created exclusively and kept fresh by a heartbeat.
+    A lease that hasn't been refreshed for ``lease_ttl`` seconds belongs to a
+    shard that crashed, and can be taken over.
+
+    Each shard also keeps a status file under ``<DATA_HOME>/.esgf_shards`` with
+    its counters, used to find shards that crashed or never started (whose files
+    are then picked up by the others) and to report aggregate throughput.
+
+    SQLite locking is not reliable on network filesystems, so shards don't share
+    the manifest or search cache: each keeps its own next to its status file, and
+    ``reconcile`` merges the shard manifests into the main one once they finish.
+    """
+
+    def __init__(self, index: int, count: int, data_home: Path,
+                 lease_ttl: float = 300, heartbeat: float = 30):
+
+        """
+        Parameters
+        ----------
+        index : int
+            This shard's index, from 0 to ``count - 1``.
+        count : int
+            Total number of shards.
+        data_home : Path
+            Shared data directory.
+        lease_ttl : float, optional
+            Seconds without a heartbeat after which a lease or shard is considered
+            dead. Default is 300.
+        heartbeat : float, optional
+            Seconds between lease and status refreshes. Default is 30.
+        """
+
+        self.index = index
+        self.count = count
+        self.root = Path(data_home) / '.esgf_shards'
+        self.lease_ttl = lease_ttl
+        self.heartbeat = heartbeat
+        self.poll = heartbeat  # how often to re-check a file leased by another shard
+        self._identity = {'shard': index, 'host': socket.gethostname(), 'pid': os.getpid()}
+        self._held: set[Path] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._summary: Optional[Callable[[], dict]] = None
+        self._started = time()
+
+    def owner(self, file: File) -> int:
+        """Index of the shard a file belongs to."""
+        instance_id = file.dataset.dataset_id.split('|')[0]
+        digest = hashlib.sha1(f"{instance_id}/{file.filename}".encode()).digest()
+        return int.from_bytes(digest[:8], 'big') % self.count
+
+    def owns(self, file: File) -> bool:
+        """Whether a file belongs to this shard."""
+        return self.owner(file) == self.index
+
+    # Leases
+
+    def _fresh(self, path: Path) -> bool:
+        """Whether a lease file exists and has been refreshed recently."""
+        try:
+            return time() - path.stat().st_mtime < self.lease_ttl
+        except FileNotFoundError:
+            return False
+
+    def leased(self, file: File) -> bool:
+        """Whether a live shard holds the lease of a file."""
+        return self._fresh(file.lease_path)
+
+    def claim(self, file: File) -> bool:
+        """
+        Take the lease of a file, taking over a stale one.
+
+        Returns
+        -------
+        bool
+            False if another live shard holds the lease
+        """
+        path = file.lease_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._take_over(path):
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump({**self._identity, 'time': time()}, f)
+            with self._lock:
+                self._held.add(path)
+            return True
+        return False
+
+    def _take_over(self, path: Path) -> bool:
+        """
+        Move a stale lease out of the way. Renaming is atomic, so only one of the
+        shards racing for a stale lease moves it; if what was moved turns out to
+        be a fresh lease, it is put back.
+        """
+        if self._fresh(path):
+            return False
+        moved = path.with_name(f"{path.name}.stale-{uuid.uuid4().hex}")
+        try:
+            os.rename(path, moved)
+        except FileNotFoundError:
+            return True  # released in the meantime
+        if time() - moved.stat().st_mtime < self.lease_ttl and not path.exists():
+            os.rename(moved, path)
+            return False
+        moved.unlink(missing_ok=True)
+        return True
+
+    def release(self, file: File) -> None:
+        """Give up the lease of a file, if this shard holds it."""
+        path = file.lease_path
+        with self._lock:
+            if path not in self._held:
+                return
+            self._held.discard(path)
+        path.unlink(missing_ok=True)
+
+    # Heartbeat and status
+
+    @property
+    def status_path(self) -> Path:
+        return self.root / f"shard-{self.index}-of-{self.count}.json"
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.root / f"manifest-{self.index}-of-{self.count}.sqlite"
+
+    @property
+    def cache_path(self) -> Path:
+        return self.root / f"cache-{self.index}-of-{self.count}.sqlite"
+
+    def start(self, summary: Callable[[], dict]) -> None:
+        """Start refreshing the held leases and this shard's status file."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._summary = summary
+        self._write_status(finished=False)
+        self._thread = threading.Thread(target=self._beat, name="shard-heartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self, complete: bool) -> None:
+        """
+        Stop the heartbeat and release every lease still held.
+
+        Parameters
+        ----------
+        complete : bool
+            Whether this shard got through all of its files. An interrupted shard
+            is left unfinished, so that others pick up its files once it is stale.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            held, self._held = self._held, set()
+        for path in held:
+            path.unlink(missing_ok=True)
+        self._write_status(finished=complete)
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self.heartbeat):
+            with self._lock:
+                held = list(self._held)
+            for path in held:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass
+            self._write_status(finished=False)
+
+    def _write_status(self, finished: bool) -> None:
+        summary = self._summary() if self._summary is not None else {}
+        status = {
+            **self._identity,
+            'count': self.count,
+            'started': self._started,
+            'updated': time(),
+            'finished': finished,
+            'bytes': summary.get('bytes', 0),
+            'files_done': summary.get('files_done', 0),
+            'files_skipped': summary.get('files_skipped', 0),
+            'files_failed': summary.get('files_failed', 0),
+        }
+        tmp = self.status_path.with_name(self.status_path.name + f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(status))
+        os.replace(tmp, self.status_path)
+
+    def statuses(self) -> dict[int, dict]:
+        """Status of every shard of this run that has started, by index."""
+        statuses = {}
+        for index in range(self.count):
+            path = self.root / f"shard-{index}-of-{self.count}.json"
+            try:
+                statuses[index] = json.loads(path.read_text())
+            except (FileNotFoundError, ValueError):
+                continue
+        return statuses
+
+    def abandoned(self) -> set[int]:
+        """
+        Shards whose files nobody is working on: those that never started, and
+        those that stopped refreshing their status before finishing.
+        """
+        statuses = self.statuses()
+        now = time()
+        return {
+            index for index in range(self.count)
+            if index != self.index and (
+                index not in statuses
+                or (not statuses[index]['finished'] and now - statuses[index]['updated'] >= self.lease_ttl)
+            )
+        }
+
+    def report(self) -> None:
+        """Print the progress of every shard and their aggregate throughput."""
+        statuses = self.statuses()
+        if not statuses:
+            return
+        total = sum(status['bytes'] for status in statuses.values())
+        started = min(status['started'] for status in statuses.values())
+        updated = max(status['updated'] for status in statuses.values())
+        for index, status in sorted(statuses.items()):
+            seconds = status['updated'] - status['started']
+            rate = status['bytes'] / seconds / 1024**2 if seconds > 0 else 0.0
+            state = "finished" if status['finished'] else "running"
+            console.print(
+                f"[blue]🧩 Shard {index}/{self.count}[/blue] [dim]({status['host']}, {state})[/dim] "
+                f"{status['files_done']} files, {status['bytes'] / 1024**3:.1f} GB, {rate:.1f} MB/s"
+            )
+        rate = total / (updated - started) / 1024**2 if updated > started else 0.0
+        finished = sum(1 for status in statuses.values() if status['finished'])
+        console.print(
+            f"[blue]🌐 {finished} of {self.count} shards finished:[/blue] "
+            f"{total / 1024**3:.1f} GB at {rate:.1f} MB/s aggregate"
+        )
@@ -0,0 +1,138 @@
+"""
+Content-addressed blob store: the content of every verified download is kept
+once, under its checksum, and the DATA_HOME tree holds hard links to it. Files
+whose content is already stored (another version, replica or experiment with
+the same bytes) are linked into place instead of being downloaded.
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+# local imports
+from esgf_download.classes import File
+from esgf_download.checksum import new_hasher
+from esgf_download.progress import FileTask
+from esgf_download.console import console
+
+
+class BlobStore:
+    """
+    Blobs are stored at ``<root>/<checksum_type>/<ab>/<cd>/<checksum>``. A blob's
+    hard link count tells how many files in the tree still use it, so unused
+    blobs can be found without any index. The store must be on the same
+    filesystem as DATA_HOME.
+    """
+
+    def __init__(self, root: Path):
+
+        """
+        Parameters
+        ----------
+        root : Path
+            Directory of the store.
+        """
+
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.files = 0  # files linked from the store instead of downloaded
+        self.bytes = 0
+
+    def path(self, file: File) -> Optional[Path]:
+        """Path of the blob holding a file's content, or None if it has no usable checksum."""
+        if file.dataset.subset is not None or not file.checksum or new_hasher(file.checksum_type) is None:
+            return None
+        checksum = file.checksum.lower()
+        return self.root / file.checksum_type.lower().replace('-', '') / checksum[:2] / checksum[2:4] / checksum
+
+    def link(self, file: File, task: FileTask) -> bool:
+        """
+        Link a file into place from its blob, if the store holds it.
+
+        Returns
+        -------
+        bool
+            True if the file was linked into place
+        """
+        blob = self.path(file)
+        if blob is None or file.local_path.exists():
+            return False
+        try:
+            if file.size and blob.stat().st_size != file.size:
+                return False
+            file.part_path.unlink(missing_ok=True)
+            os.link(blob, file.part_path)
+        except OSError:
+            # Not stored (or just garbage collected): download it
+            return False
+        os.replace(file.part_path, file.local_path)
+        file.dataset.record(file)
+        task.skip()
+        task.describe(f"[blue]🗄 {file.filename} (in the store)")
+        with self._lock:
+            self.files += 1
+            self.bytes += file.size or 0
+        return True
+
+    def add(self, file: File) -> None:
+        """
+        Store a complete, verified file: its path becomes a hard link to the blob
+        of its content, which is created from the file if it isn't stored yet.
+        """
+        blob = self.path(file)
+        if blob is None:
+            return
+        try:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            self._link_to_blob(file, blob)
+        except OSError as e:
+            # The file stays in place, just not deduplicated
+            console.print(f"[yellow]⚠ Could not store {file.filename}:[/yellow] {e}")
+
+    def _link_to_blob(self, file: File, blob: Path) -> None:
+        """Make a file's path a hard link to its blob, storing the file as the blob if there is none."""
+        try:
+            os.link(file.local_path, blob)
+        except FileExistsError:
+            # Already stored: replace the file with a link to the existing blob
+            if os.path.samefile(blob, file.local_path):
+                return
+            file.part_path.unlink(missing_ok=True)
+            try:
+                os.link(blob, file.part_path)
+                os.replace(file.part_path, file.local_path)
+            finally:
+                file.part_path.unlink(missing_ok=True)
+
+    def gc(self) -> tuple[int, int]:
+        """
+        Delete the blobs that no file in the tree links to any more, and the
+        directories left empty.
+
+        Returns
+        -------
+        tuple[int, int]
+            Number of blobs removed, and bytes reclaimed
+        """
+        removed = reclaimed = 0
+        for directory, subdirectories, filenames in os.walk(self.root, topdown=False):
+            for name in filenames:
+                blob = Path(directory) / name
+                stat = blob.stat()
+                if stat.st_nlink == 1:
+                    blob.unlink()
+                    removed += 1
+                    reclaimed += stat.st_size
+            if directory != str(self.root) and not os.listdir(directory):
+                os.rmdir(directory)
+        return removed, reclaimed
+
+    def report(self) -> None:
+        """Print how many downloads the store saved."""
+        if self.files:
+            console.print(
+                f"[blue]🗄 Linked {self.files} files from the store[/blue] "
+                f"[dim]({self.bytes / 1024**3:.2f} GB not downloaded)[/dim]"
+            )
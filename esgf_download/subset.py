@@ -0,0 +1,416 @@
+"""
+Server-side subsetting over OPeNDAP: instead of downloading whole files, only
+the hyperslabs of a region, a range of levels and a range of years are read
+from the data node and written to a local NetCDF file.
+
+Selected with the ``subset`` section of the config file. Requires netCDF4
+(``pip install esgf-download[subset]``). The netCDF-C library is not thread-safe,
+so every file is subset in a pool of worker processes.
+"""
+
+import os
+import json
+import hashlib
+import multiprocessing
+from itertools import product
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait
+
+try:
+    import numpy as np # type: ignore
+    import netCDF4 # type: ignore
+except ImportError:  # optional dependency
+    netCDF4 = None
+
+# local imports
+import esgf_download.download as download
+from esgf_download.classes import File
+from esgf_download.progress import FileTask
+from esgf_download.mirrors import NodeHealth
+from esgf_download.sessions import SessionPool
+
+# Errors of a subset from one replica; netCDF-C reports DAP and network errors as OSError or RuntimeError
+SUBSET_ERRORS = (OSError, RuntimeError, ValueError, KeyError)
+
+
+def spawn_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Pool of worker processes for NetCDF work. Workers are spawned rather than
+    forked: the parent runs download threads, and a forked child would inherit
+    any lock one of them held at that moment, never to be released.
+    """
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+class Subset:
+    """
+    Region, levels and years to cut out of every file of a dataset. Each part is
+    optional; a dimension that isn't restricted is read whole.
+    """
+
+    def __init__(self, bbox: Optional[tuple] = None, levels: Optional[tuple] = None,
+                 years: Optional[tuple] = None, chunk_bytes: int = 64 * 1024**2):
+
+        """
+        Parameters
+        ----------
+        bbox : tuple, optional
+            (lon_min, lat_min, lon_max, lat_max) in degrees. A box with lon_min
+            greater than lon_max crosses the antimeridian (or the 0/360 seam).
+        levels : tuple, optional
+            (min, max) of the vertical coordinate, in its own units.
+        years : tuple, optional
+            (start year, end year), inclusive; either may be None.
+        chunk_bytes : int, optional
+            Upper bound on the bytes held in memory by each read. Default is 64 MB.
+        """
+
+        self.bbox = tuple(bbox) if bbox else None
+        self.levels = tuple(levels) if levels else None
+        self.years = tuple(years) if years else None
+        self.chunk_bytes = chunk_bytes
+
+    def spec(self) -> dict:
+        """The subset as plain data, to pass to worker processes and store in the output."""
+        return {'bbox': self.bbox, 'levels': self.levels, 'years': self.years}
+
+    @property
+    def tag(self) -> str:
+        """Short hash of the subset, so that different subsets of a file never collide."""
+        return hashlib.sha1(json.dumps(self.spec(), sort_keys=True).encode()).hexdigest()[:8]
+
+    def filename(self, filename: str) -> str:
+        """Local name of the subset of a file, e.g. ``thetao_..._201501-210012.subset-1a2b3c4d.nc``."""
+        stem, ext = os.path.splitext(filename)
+        return f"{stem}.subset-{self.tag}{ext}"
+
+
+class Subsetter:
+    """
+    Subsets files over OPeNDAP in a pool of worker processes, with the same
+    behaviour as ``download_file`` around it: existing files are skipped, output
+    is staged in a .part file, data node slots are respected, replicas are failed
+    over (skipping dead data nodes) and rounds are retried after a backoff.
+    """
+
+    def __init__(self, workers: int = 3, sessions: Optional[SessionPool] = None,
+                 health: Optional[NodeHealth] = None, retries: int = 0):
+
+        """
+        Parameters
+        ----------
+        workers : int, optional
+            Number of worker processes, and of files subset at once. Default is 3.
+        sessions : SessionPool, optional
+            Sessions whose per-node slots limit the concurrent requests to each
+            data node.
+        health : NodeHealth, optional
+            Data node health shared across the run, to order replicas by and to
+            record failures in. A private one is used if not given.
+        retries : int, optional
+            Number of retries, with jittered backoff, after every replica of a
+            file has failed. Default is 0.
+        """
+
+        if netCDF4 is None:
+            raise ImportError("Subsetting requires netCDF4: pip install esgf-download[subset]")
+        self.sessions = sessions or SessionPool(workers)
+        self.health = health or NodeHealth()
+        self.retries = retries
+        self._processes = spawn_pool(workers)
+        self._threads = ThreadPoolExecutor(workers, thread_name_prefix="subset")
+
+    def submit(self, file: File, task: FileTask) -> Future:
+        """
+        Subset a file in the background.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to True if the subset is present locally afterwards
+        """
+        return self._threads.submit(self.subset_file, file, task)
+
+    def close(self) -> None:
+        """Wait for running subsets and stop the worker processes."""
+        self._threads.shutdown()
+        self._processes.shutdown(cancel_futures=True)
+
+    def subset_file(self, file: File, task: FileTask) -> bool:
+        """
+        Subset a single file into its local path.
+
+        Returns
+        -------
+        bool
+            True if the subset is present locally afterwards, False otherwise.
+        """
+        if download._skip_existing(file, task):
+            return True
+
+        if not file.opendap_urls:
+            task.fail("no OPeNDAP URL", f"[red]✗ {file.filename} (no OPeNDAP URL)")
+            return False
+
+        file.local_path.parent.mkdir(parents=True, exist_ok=True)
+        description = f"[cyan]✂ {file.filename}"
+        task.describe(description)
+        return download._with_failover(
+            file, task, file.opendap_urls, lambda url: self._run(file, url, task), SUBSET_ERRORS,
+            self.sessions, self.health, self.retries, description, probe=False,
+        )
+
+    def _run(self, file: File, url: str, task: FileTask) -> bool:
+        """
+        Subset a file from one OPeNDAP URL into its .part file in a worker process,
+        following its progress from the size of the .part file, and move it into place.
+
+        Returns
+        -------
+        bool
+            False if interrupted, True once the subset is in place
+
+        Raises
+        ------
+        OSError, RuntimeError, ValueError, KeyError
+            If the subset failed; the .part file is discarded
+        """
+        subset = file.dataset.subset
+        part = file.part_path
+        try:
+            with self.sessions.slot(url), task.attempt(url):
+                task.begin(None, 0)
+                future = self._processes.submit(
+                    subset_to, url, file.filename.split('_')[0], subset.spec(), str(part), subset.chunk_bytes
+                )
+                while not wait([future], timeout=0.25).done:
+                    if download.keyboard_interrupt:
+                        return False
+                    try:
+                        task.completed = part.stat().st_size
+                    except FileNotFoundError:
+                        pass
+                size = future.result()
+        except SUBSET_ERRORS:
+            part.unlink(missing_ok=True)
+            raise
+        task.completed = task.total = size
+        # A success resets the node's failure count; subsetting speed says nothing of its throughput
+        self.health.record_success(url, 0, 0)
+        os.replace(part, file.local_path)
+        file.dataset.record(file, verified=False)
+        task.succeed()
+        return True
+
+
+def subset_to(url: str, variable: str, spec: dict, out: str, chunk_bytes: int) -> int:
+    """
+    Write the subset of a variable, with its coordinates and bounds, from an
+    OPeNDAP URL to a NetCDF4 file. Runs in a worker process.
+
+    Parameters
+    ----------
+    url : str
+        OPeNDAP URL of the file
+    variable : str
+        Name of the data variable
+    spec : dict
+        ``Subset.spec()`` of the subset
+    out : str
+        Path of the output file
+    chunk_bytes : int
+        Upper bound on the bytes of each read
+
+    Returns
+    -------
+    int
+        Size of the output file in bytes
+
+    Raises
+    ------
+    ValueError
+        If the subset selects nothing
+    KeyError
+        If the variable isn't in the file
+    """
+    with netCDF4.Dataset(url) as src:
+        src.set_auto_maskandscale(False)
+        var = src.variables[variable]
+        runs = _select(src, var, spec)
+        names = related_variables(src, var)
+
+        with netCDF4.Dataset(out, 'w', format='NETCDF4') as dst:
+            dst.setncatts({key: src.getncattr(key) for key in src.ncattrs()})
+            dst.setncattr('esgf_download_subset', json.dumps(spec))
+            dst.setncattr('esgf_download_source', url)
+            dims = dict.fromkeys(dim for name in names for dim in src.variables[name].dimensions)
+            for dim in dims:
+                size = sum(stop - start for start, stop in runs[dim]) if dim in runs else len(src.dimensions[dim])
+                dst.createDimension(dim, size)
+            for name in names:
+                source = src.variables[name]
+                attributes = {key: source.getncattr(key) for key in source.ncattrs()}
+                fill_value = attributes.pop('_FillValue', None)
+                target = dst.createVariable(
+                    name, source.dtype, source.dimensions, zlib=True, complevel=1, fill_value=fill_value
+                )
+                target.setncatts(attributes)
+                copy_blocks(source, target, runs, chunk_bytes)
+    return os.path.getsize(out)
+
+
+def axis_of(src, name: str) -> Optional[str]:
+    """CF axis (T, Z, Y or X) of a coordinate variable, if it is one."""
+    if name not in src.variables:
+        return None
+    var = src.variables[name]
+    attributes = {key: var.getncattr(key) for key in var.ncattrs()}
+    axis = str(attributes.get('axis', '')).upper()
+    if axis in ('T', 'Z', 'Y', 'X'):
+        return axis
+    standard_name = attributes.get('standard_name', '')
+    units = str(attributes.get('units', ''))
+    if standard_name == 'time' or ' since ' in units:
+        return 'T'
+    if standard_name == 'latitude' or units in ('degrees_north', 'degree_north', 'degree_N'):
+        return 'Y'
+    if standard_name == 'longitude' or units in ('degrees_east', 'degree_east', 'degree_E'):
+        return 'X'
+    if 'positive' in attributes:
+        return 'Z'
+    return None
+
+
+def _select(src, var, spec: dict) -> dict:
+    """
+    Index runs to read along each restricted dimension of a variable.
+
+    Returns
+    -------
+    dict
+        Mapping of dimension to a list of (start, stop) runs, in output order
+    """
+    runs = {}
+    axes = {dim: axis_of(src, dim) for dim in var.dimensions}
+    for dim, axis in axes.items():
+        if axis is None:
+            continue
+        values = src.variables[dim][:]
+        if axis == 'T' and spec['years']:
+            time = src.variables[dim]
+            dates = netCDF4.num2date(values, time.units, getattr(time, 'calendar', 'standard'))
+            years = np.array([date.year for date in dates])
+            first, last = spec['years']
+            runs[dim] = _cover((first is None or years >= first) & (last is None or years <= last))
+        elif axis == 'Z' and spec['levels']:
+            low, high = sorted(spec['levels'])
+            runs[dim] = _cover((values >= low) & (values <= high))
+        elif axis == 'Y' and spec['bbox']:
+            runs[dim] = _cover(_lat_mask(values, spec['bbox']))
+        elif axis == 'X' and spec['bbox']:
+            runs[dim] = _runs(_lon_mask(values, spec['bbox']))
+
+    # Curvilinear grids: 2-D latitude and longitude over the last two dimensions
+    if spec['bbox'] and len(var.dimensions) >= 2 and not {'X', 'Y'} & set(axes.values()):
+        coordinates = getattr(var, 'coordinates', '').split()
+        lat = next((name for name in coordinates if axis_of(src, name) == 'Y'), None)
+        lon = next((name for name in coordinates if axis_of(src, name) == 'X'), None)
+        if lat is not None and lon is not None and src.variables[lat].dimensions == var.dimensions[-2:]:
+            mask = _lat_mask(src.variables[lat][:], spec['bbox']) & _lon_mask(src.variables[lon][:], spec['bbox'])
+            row, column = var.dimensions[-2:]
+            runs[row] = _cover(mask.any(axis=1))
+            runs[column] = _runs(mask.any(axis=0))
+
+    for dim, dim_runs in runs.items():
+        if not dim_runs:
+            raise ValueError(f"the subset selects nothing along {dim}")
+    return runs
+
+
+def _lat_mask(lat, bbox: tuple):
+    _, south, _, north = bbox
+    return (lat >= min(south, north)) & (lat <= max(south, north))
+
+
+def _lon_mask(lon, bbox: tuple):
+    """Longitudes inside a box, whichever convention (-180..180 or 0..360) either uses."""
+    west, _, east, _ = bbox
+    width = (east - west) % 360
+    if width == 0 and east != west:
+        return np.ones(np.shape(lon), dtype=bool)
+    return (np.asarray(lon) - west) % 360 <= width
+
+
+def _cover(mask) -> list:
+    """A single run covering every selected index."""
+    selected = np.flatnonzero(np.ma.filled(mask, False))
+    return [(int(selected[0]), int(selected[-1]) + 1)] if len(selected) else []
+
+
+def _runs(mask) -> list:
+    """
+    Runs of selected indices along a periodic (longitude) dimension. A selection
+    wrapping around the end of the dimension is returned as its end run followed
+    by its start run, so the output stays contiguous across the seam.
+    """
+    selected = np.flatnonzero(np.ma.filled(mask, False))
+    if not len(selected):
+        return []
+    breaks = np.flatnonzero(np.diff(selected) > 1)
+    starts = [selected[0], *selected[breaks + 1]]
+    stops = [*selected[breaks] + 1, selected[-1] + 1]
+    runs = [(int(start), int(stop)) for start, stop in zip(starts, stops)]
+    if len(runs) == 2 and runs[0][0] == 0 and runs[1][1] == len(mask):
+        return [runs[1], runs[0]]
+    return _cover(mask)
+
+
+def related_variables(src, var) -> list:
+    """Names of a variable, its coordinate variables and auxiliary coordinates, and their bounds."""
+    names = [var.name]
+    names += [dim for dim in var.dimensions if dim in src.variables]
+    names += [name for name in getattr(var, 'coordinates', '').split() if name in src.variables]
+    for name in list(names):
+        bounds = getattr(src.variables[name], 'bounds', None)
+        if bounds in src.variables:
+            names.append(bounds)
+    return list(dict.fromkeys(names))
+
+
+def copy_blocks(source, target, runs: dict, chunk_bytes: int, offsets: Optional[dict] = None) -> None:
+    """
+    Copy the selected runs of a variable, reading at most about ``chunk_bytes`` at
+    a time: whole leading dimensions are split until a block fits. The runs of each
+    dimension are written one after the other, from ``offsets`` (0 by default).
+    """
+    dims = source.dimensions
+    if not dims:
+        target[...] = source[...]
+        return
+    # (start, stop, output offset) of each run, per dimension
+    per_dim = []
+    for dim, size in zip(dims, source.shape):
+        offset, placed = (offsets or {}).get(dim, 0), []
+        for start, stop in runs.get(dim, [(0, size)]):
+            placed.append((start, stop, offset))
+            offset += stop - start
+        per_dim.append(placed)
+
+    lengths = [sum(stop - start for start, stop, _ in placed) for placed in per_dim]
+    split = 0
+    block = source.dtype.itemsize * int(np.prod(lengths[1:], dtype=np.int64))
+    while split < len(dims) - 1 and block > chunk_bytes:
+        split += 1
+        block //= max(lengths[split], 1)
+    step = max(1, chunk_bytes // max(block, 1))
+
+    pieces = []
+    for i, placed in enumerate(per_dim):
+        size = 1 if i < split else step if i == split else None
+        pieces.append(placed if size is None else [
+            (begin, min(begin + size, stop), offset + begin - start)
+            for start, stop, offset in placed for begin in range(start, stop, size)
+        ])
+    for combination in product(*pieces):
+        target[tuple(slice(offset, offset + stop - start) for start, stop, offset in combination)] = \
+            source[tuple(slice(start, stop) for start, stop, _ in combination)]
@@ -0,0 +1,192 @@
+"""
+Adaptive per-node concurrency, global bandwidth limiting and retry backoff.
+"""
+
+import random
+import threading
+from time import monotonic, sleep
+from typing import Callable, Optional
+
+import requests
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for one data node that adapts to how the node responds.
+
+    The limit starts low and is raised by one each time the node's throughput over
+    a measurement window improves while every slot is in use (additive increase).
+    It is halved when the node throttles or times out (multiplicative decrease),
+    and lowered by one when throughput falls noticeably.
+    """
+
+    def __init__(self, maximum: int, initial: Optional[int] = None, adaptive: bool = True,
+                 window: float = 10.0, on_release: Optional[Callable[[], None]] = None):
+
+        """
+        Parameters
+        ----------
+        maximum : int
+            Upper bound on the number of concurrent transfers.
+        initial : int, optional
+            Starting limit. Defaults to 2 (or ``maximum`` if not adaptive).
+        adaptive : bool, optional
+            If False, the limit stays fixed at ``maximum``. Default is True.
+        window : float, optional
+            Length of a throughput measurement window in seconds. Default is 10.
+        on_release : callable, optional
+            Called, without the limiter's lock held, whenever a slot frees up:
+            when one is released or the limit is raised.
+        """
+
+        self.maximum = maximum
+        self.adaptive = adaptive
+        self.limit = min(initial or 2, maximum) if adaptive else maximum
+        self.active = 0
+        self.window = window
+        self.on_release = on_release
+        self._cond = threading.Condition()
+        self._bytes = 0
+        self._window_start = monotonic()
+        self._saturated = False  # every slot was in use at some point in the window
+        self._last_rate: Optional[float] = None
+
+    def acquire(self) -> None:
+        """Block until a slot is free, then take it."""
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self._take()
+
+    def try_acquire(self) -> bool:
+        """Take a slot if one is free. Returns True on success."""
+        with self._cond:
+            if self.active >= self.limit:
+                return False
+            self._take()
+            return True
+
+    def _take(self) -> None:
+        self.active += 1
+        if self.active >= self.limit:
+            self._saturated = True
+
+    def release(self) -> None:
+        """Give a slot back."""
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+        if self.on_release is not None:
+            self.on_release()
+
+    def has_capacity(self) -> bool:
+        """Whether a slot is free right now."""
+        with self._cond:
+            return self.active < self.limit
+
+    def add_bytes(self, nbytes: int) -> None:
+        """Account for transferred bytes, adjusting the limit at the end of each window."""
+        if not self.adaptive:
+            return
+        raised = False
+        with self._cond:
+            self._bytes += nbytes
+            now = monotonic()
+            elapsed = now - self._window_start
+            if elapsed < self.window:
+                return
+            rate = self._bytes / elapsed
+            if self._last_rate is not None and rate < 0.8 * self._last_rate:
+                self.limit = max(1, self.limit - 1)
+            elif self._saturated and (self._last_rate is None or rate > 1.05 * self._last_rate):
+                raised = self.limit < self.maximum
+                self.limit = min(self.maximum, self.limit + 1)
+                self._cond.notify()
+            self._last_rate = rate
+            self._bytes = 0
+            self._window_start = now
+            self._saturated = self.active >= self.limit
+        if raised and self.on_release is not None:
+            self.on_release()
+
+    def backoff(self) -> None:
+        """The node throttled us or timed out: halve the limit."""
+        if not self.adaptive:
+            return
+        with self._cond:
+            self.limit = max(1, self.limit // 2)
+            self._last_rate = None
+
+
+class TokenBucket:
+    """
+    Global bandwidth cap shared by every transfer, in bytes per second.
+
+    Transfers reserve bytes as they receive them; a reservation beyond the available
+    budget returns how long the caller should pause to stay under the cap.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+
+        """
+        Parameters
+        ----------
+        rate : float
+            Maximum aggregate transfer rate in bytes/s.
+        burst : float, optional
+            Largest burst allowed above the rate, in bytes. Defaults to one second's worth.
+        """
+
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._last = monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> float:
+        """Reserve bytes from the budget. Returns the delay in seconds to wait."""
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            return max(0.0, -self._tokens / self.rate)
+
+    def consume(self, nbytes: int) -> None:
+        """Reserve bytes from the budget, sleeping as long as needed."""
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            sleep(delay)
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0,
+                  retry_after: Optional[float] = None) -> float:
+    """
+    Retry delay with full jitter: uniform between 0 and ``base * 2**attempt``
+    (capped), but never shorter than a server's Retry-After.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+def is_throttled(error: Exception) -> bool:
+    """Whether an error means the data node is overloaded (429/503) or timing out."""
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status is None:
+        status = getattr(error, 'status', None)  # aiohttp.ClientResponseError
+    return status in (429, 503)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """The Retry-After header (in seconds) of a throttled response, if any."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None) or {}
+    value = headers.get('Retry-After')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
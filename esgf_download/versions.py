@@ -0,0 +1,148 @@
+"""
+Incremental version sync: when a newer version of an already downloaded dataset
+is published, files that are unchanged since an earlier version are hard-linked
+(or reflinked) from its version directory instead of being downloaded again.
+"""
+
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Optional, TYPE_CHECKING
+
+# local imports
+from esgf_download.classes import Dataset, File
+from esgf_download.checksum import new_hasher, update_from_file, matches
+from esgf_download.progress import FileTask
+from esgf_download.console import console
+
+if TYPE_CHECKING:
+    from esgf_download.manifest import Manifest
+
+# ioctl cloning a whole file on Linux filesystems with reflinks (Btrfs, XFS)
+FICLONE = 0x40049409
+
+VERSION_PATTERN = re.compile(r"v\d+")
+
+
+class VersionSync:
+    """
+    Links files of a dataset version from other versions of the same dataset
+    under DATA_HOME, and counts the files and bytes that didn't need downloading.
+
+    A copy is only linked if it has the file's size and checksum. The checksum is
+    taken from the manifest when the copy was verified there, and otherwise
+    computed from the copy on disk, which is still much cheaper than downloading it.
+    """
+
+    def __init__(self, manifest: Optional["Manifest"] = None):
+        self.manifest = manifest
+        self._lock = threading.Lock()
+        self._versions: dict[Path, list] = {}  # dataset directory -> other version directories
+        self._completed: dict[str, dict] = {}  # instance ID -> manifest entries
+        self.files = 0
+        self.bytes = 0
+
+    def previous_versions(self, dataset: Dataset) -> list:
+        """Other downloaded version directories of a dataset, newest first."""
+        version_dir = dataset.local_path
+        with self._lock:
+            versions = self._versions.get(version_dir)
+        if versions is None:
+            try:
+                versions = sorted(
+                    (path for path in version_dir.parent.iterdir()
+                     if path != version_dir and VERSION_PATTERN.fullmatch(path.name) and path.is_dir()),
+                    key=lambda path: int(path.name[1:]), reverse=True,
+                )
+            except FileNotFoundError:
+                versions = []
+            with self._lock:
+                self._versions[version_dir] = versions
+        return versions
+
+    def link(self, file: File, task: FileTask) -> bool:
+        """
+        Link a file from the newest other version holding an identical copy.
+
+        Returns
+        -------
+        bool
+            True if the file was linked into place
+        """
+        if file.dataset.subset is not None or not file.checksum or new_hasher(file.checksum_type) is None \
+                or file.local_path.exists():
+            return False
+        for version_dir in self.previous_versions(file.dataset):
+            copy = version_dir / file.filename
+            if not self._identical(copy, file):
+                continue
+            if not _link(copy, file.part_path):
+                return False
+            os.replace(file.part_path, file.local_path)
+            file.dataset.record(file)
+            task.skip()
+            task.describe(f"[blue]🔗 {file.filename} (unchanged since {version_dir.name})")
+            with self._lock:
+                self.files += 1
+                self.bytes += file.size or 0
+            return True
+        return False
+
+    def _identical(self, copy: Path, file: File) -> bool:
+        """Whether a file on disk has the size and checksum of ``file``."""
+        try:
+            if file.size and copy.stat().st_size != file.size:
+                return False
+        except FileNotFoundError:
+            return False
+        instance_id = f"{_unversioned_id(file.dataset)}.{copy.parent.name}"
+        entry = self._recorded(instance_id).get(copy.name)
+        if entry is not None and entry[1] == file.checksum:
+            return True
+        hasher = new_hasher(file.checksum_type)
+        update_from_file(hasher, copy)
+        return matches(hasher, file.checksum)
+
+    def _recorded(self, instance_id: str) -> dict:
+        """Manifest entries of a dataset version, loaded once."""
+        if self.manifest is None:
+            return {}
+        with self._lock:
+            entries = self._completed.get(instance_id)
+        if entries is None:
+            entries = self.manifest.completed(instance_id)
+            with self._lock:
+                self._completed[instance_id] = entries
+        return entries
+
+    def report(self) -> None:
+        """Print how much linking unchanged files saved."""
+        if self.files:
+            console.print(
+                f"[blue]🔗 Linked {self.files} unchanged files from earlier versions[/blue] "
+                f"[dim]({self.bytes / 1024**3:.2f} GB not downloaded)[/dim]"
+            )
+
+
+def _unversioned_id(dataset: Dataset) -> str:
+    """Instance ID of a dataset without its version, e.g. ``CMIP6.ScenarioMIP.<...>.gn``."""
+    return dataset.dataset_id.split('|')[0].rsplit('.', 1)[0]
+
+
+def _link(source: Path, target: Path) -> bool:
+    """Hard-link ``source`` to ``target``, or reflink it where hard links aren't possible."""
+    target.unlink(missing_ok=True)
+    try:
+        os.link(source, target)
+        return True
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except (ImportError, OSError):
+        target.unlink(missing_ok=True)
+        return False
@@ -0,0 +1,104 @@
+"""
+Shared fixtures. Tests run against the fake ESGF federation of the benchmark
+suite (``benchmarks.fake_esgf``), and build their datasets from plans, so that
+nothing is searched for on a real index.
+"""
+
+import json
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from benchmarks.fake_esgf import Catalog, FakeDataNode, FakeIndex
+from esgf_download import download
+from esgf_download.classes import Dataset
+from esgf_download.manifest import Manifest
+from esgf_download.plan import load_plan, PLAN_VERSION
+
+
+@pytest.fixture(autouse=True)
+def no_interrupt():
+    """Every test starts, and leaves, without a pending keyboard interrupt."""
+    download.keyboard_interrupt = False
+    yield
+    download.keyboard_interrupt = False
+
+
+@pytest.fixture
+def catalog() -> Catalog:
+    return Catalog()
+
+
+@pytest.fixture
+def node(catalog):
+    """A well-behaved fake data node serving the catalog."""
+    server = FakeDataNode(catalog, host="127.0.0.2").start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def index(catalog):
+    """A fake index answering searches of the catalog, for data nodes node-0 and node-1."""
+    server = FakeIndex(catalog).start()
+    server.data_nodes = {"node-0": "http://127.0.0.2:9", "node-1": "http://127.0.0.3:9"}
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def data_home(tmp_path) -> Path:
+    return tmp_path / "data"
+
+
+@pytest.fixture
+def manifest(data_home):
+    manifest = Manifest(data_home / ".esgf_manifest.sqlite")
+    yield manifest
+    manifest.close()
+
+
+@pytest.fixture
+def datasets(tmp_path, data_home):
+    """
+    Build the datasets of a catalog as a download run would see them, with their
+    files served by the given data nodes (base URLs), in catalog order.
+    """
+    def build(catalog: Catalog, *base_urls: str, manifest: Optional[Manifest] = None) -> list[Dataset]:
+        base_urls = base_urls or ("http://127.0.0.1:9",)
+        entries = [
+            {
+                'dataset_id': f"{instance_id}|node-0",
+                'version': instance_id.rsplit('.v', 1)[1],
+                'model': instance_id.split('.')[3],
+                'files': [
+                    {
+                        'filename': file.filename,
+                        'size': file.size,
+                        'checksum': file.checksum,
+                        'checksum_type': "SHA256",
+                        'urls': [f"{base_url}/data/{file.path}" for base_url in base_urls],
+                    }
+                    for file in files
+                ],
+            }
+            for instance_id, files in catalog.files.items()
+        ]
+        path = tmp_path / "catalog-plan.json"
+        path.write_text(json.dumps({'plan_version': PLAN_VERSION, 'datasets': entries}))
+        return list(load_plan(path, data_home, manifest))
+    return build
+
+
+@pytest.fixture
+def publish(catalog):
+    """Publish a monthly dataset of the given file sizes in the catalog. Returns its instance ID."""
+    def add(sizes: list[int], variable: str = "tas", version: str = "20200101",
+            nodes: tuple = ("node-0",)) -> str:
+        table = "Omon" if variable in ("thetao", "so") else "Amon"
+        return catalog.add_dataset(
+            "CMIP6", "MODEL-0", "ssp585", variable, table, "gn", "r1i1p1f1", "mon", sizes, list(nodes),
+            version=version,
+        )
+    return add
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+from time import monotonic
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from esgf_download import async_download
+from esgf_download.async_download import AsyncEngine
+from esgf_download.progress import FileTask
+
+from tests.test_download import _content
+
+
+def test_backoff_is_interrupted():
+    engine = AsyncEngine()
+    engine.start()
+    try:
+        threading.Timer(0.1, engine.interrupt).start()
+        start = monotonic()
+        slept = asyncio.run_coroutine_threadsafe(engine._sleep(30), engine.loop).result(timeout=10)
+    finally:
+        engine.close()
+    assert not slept
+    assert monotonic() - start < 5
+
+
+def test_download_writes_and_hashes_off_the_loop(catalog, node, publish, datasets, monkeypatch):
+    publish([3 * 1024**2 + 100])
+    file, = datasets(catalog, node.base_url)[0].files
+    file.part_path.parent.mkdir(parents=True)
+    file.part_path.write_bytes(_content(file)[:100_000])
+    writers = set()
+    write = async_download._write
+
+    def record(f, hasher, data):
+        writers.add(threading.current_thread())
+        write(f, hasher, data)
+
+    monkeypatch.setattr(async_download, "_write", record)
+    engine = AsyncEngine()
+    engine.start()
+    try:
+        task = FileTask(file)
+        assert engine.submit(file, task).result(timeout=30)
+    finally:
+        engine.close()
+    assert task.state == 'done'
+    assert file.local_path.read_bytes() == _content(file)
+    assert node.bytes_sent == file.size - 100_000
+    assert writers and engine._thread not in writers
@@ -0,0 +1,44 @@
+"""
+The benchmark scenarios, run end to end at a small scale: a search on the fake
+index, then downloads from the fake data nodes through ``DownloadManager``.
+"""
+
+import pytest
+
+from benchmarks.run import BASE_CONFIG, SCENARIOS, problems, run_scenario
+
+
+@pytest.fixture(autouse=True)
+def data_home_env(monkeypatch):
+    """run_scenario points DATA_HOME at its own directory; restore it afterwards."""
+    monkeypatch.setenv('DATA_HOME', "")
+
+
+def test_flaky_nodes_fail_over_and_retry():
+    scenario = SCENARIOS['flaky_nodes']
+    result = run_scenario(scenario, scale=0.05)
+    assert result['errors_injected'] > 0
+    assert problems(scenario, result) == []
+
+
+def test_async_engine_recovers_from_faults():
+    pytest.importorskip("aiohttp")
+    scenario = SCENARIOS['flaky_nodes']
+    result = run_scenario(scenario, scale=0.05, overrides=[{'download': {'engine': "async"}}])
+    assert result['errors_injected'] > 0
+    assert problems(scenario, result) == []
+
+
+def test_search_fanout_stays_within_search_workers():
+    scenario = SCENARIOS['search_fanout']
+    result = run_scenario(scenario, scale=0.05, overrides=[{'esgf': {'search_workers': 2}}])
+    assert problems(scenario, result) == []
+    assert 1 <= result['search_peak'] <= 2
+    assert BASE_CONFIG['esgf']['search_workers'] == 4  # overrides don't leak into the base
+
+
+def test_problems():
+    scenario = SCENARIOS['flaky_nodes']
+    result = {'files': 10, 'complete': 9, 'errors_injected': 0}
+    assert len(problems(scenario, result)) == 2
+    assert problems(SCENARIOS['mixed_sizes'], {**result, 'complete': 10}) == []
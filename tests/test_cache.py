@@ -0,0 +1,69 @@
+import pytest
+
+from esgf_download import cache
+from esgf_download.cache import SearchCache
+
+QUERY = {'project': "CMIP6", 'variable_id': ["tas", "pr"]}
+DOCS = [{'id': "CMIP6.A.v1|node-0"}, {'id': "CMIP6.B.v1|node-0"}]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """The cache's clock, set by hand."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(cache, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def search_cache(tmp_path):
+    search_cache = SearchCache(tmp_path / "cache.sqlite", ttl=60)
+    yield search_cache
+    search_cache.close()
+
+
+def test_search_key_ignores_ordering():
+    reordered = {'variable_id': ("pr", "tas"), 'project': "CMIP6"}
+    assert SearchCache.search_key("index", QUERY) == SearchCache.search_key("index", reordered)
+    assert SearchCache.search_key("index", QUERY) != SearchCache.search_key("other", QUERY)
+
+
+def test_entries_expire(search_cache, clock):
+    search_cache.put_search("index", QUERY, DOCS)
+    clock[0] += 59
+    assert search_cache.get_search("index", QUERY) == DOCS
+    clock[0] += 2
+    assert search_cache.get_search("index", QUERY) is None
+
+
+def test_refresh_ignores_entries_but_writes_new_ones(tmp_path):
+    SearchCache(tmp_path / "cache.sqlite").put_files("CMIP6.A.v1|node-0", [{'title': "old"}])
+    refreshing = SearchCache(tmp_path / "cache.sqlite", refresh=True)
+    assert refreshing.get_files("CMIP6.A.v1|node-0") is None
+    refreshing.put_files("CMIP6.A.v1|node-0", [{'title': "new"}])
+    assert SearchCache(tmp_path / "cache.sqlite").get_files("CMIP6.A.v1|node-0") == [{'title': "new"}]
+
+
+def test_invalidate_removes_listing_and_searches(search_cache):
+    search_cache.put_search("index", QUERY, DOCS)
+    search_cache.put_search("index", {'project': "CMIP6"}, DOCS[1:])
+    search_cache.put_files("CMIP6.A.v1|node-0", [])
+
+    assert search_cache.invalidate("CMIP6.A.v1") == 2
+    assert search_cache.get_search("index", QUERY) is None
+    assert search_cache.get_search("index", {'project': "CMIP6"}) == DOCS[1:]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    docs = [{'title': "x" * 100}]
+    search_cache = SearchCache(tmp_path / "cache.sqlite", max_size=250)
+    search_cache.put_files("a", docs)
+    clock[0] += 1
+    search_cache.put_files("b", docs)
+    clock[0] += 1
+    search_cache.get_files("a")
+    clock[0] += 1
+    search_cache.put_files("c", docs)
+
+    assert search_cache.get_files("b") is None
+    assert search_cache.get_files("a") == search_cache.get_files("c") == docs
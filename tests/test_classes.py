@@ -0,0 +1,101 @@
+import pytest
+from pyesgf.search import SearchConnection
+
+from esgf_download.classes import Dataset
+from esgf_download.progress import FileTask
+from tests.test_download import _content
+
+
+@pytest.fixture
+def dataset(catalog, publish, datasets, manifest):
+    """A dataset of four files: 2015-2035, 2036-2056, 2057-2077 and 2078-2100."""
+    publish([100] * 4)
+    dataset, = datasets(catalog, manifest=manifest)
+    dataset.local_path.mkdir(parents=True)
+    return dataset
+
+
+@pytest.mark.parametrize("time_range, expected", [
+    ((2030, 2040), True),
+    ((2035, 2035), True),
+    ((2036, 2050), False),
+    ((None, 2015), True),
+    ((None, 2014), False),
+    ((2036, None), False),
+    ((None, None), True),
+])
+def test_overlaps(dataset, time_range, expected):
+    assert dataset.files[0].overlaps(time_range) is expected
+
+
+def test_file_without_dates_always_overlaps(dataset):
+    fixed = dataset.files[0]
+    fixed.filename = "sftlf_fx_MODEL-0_ssp585_r1i1p1f1_gn.nc"
+    assert fixed.overlaps((2040, 2050))
+
+
+def test_time_range_selects_the_files_of_a_dataset(dataset):
+    dataset.time_range = (2040, 2060)
+    assert [file.filename[-16:] for file in dataset.files] == ["203601-205612.nc", "205701-207712.nc"]
+    assert len(dataset.all_files) == 4
+
+    # The dataset is complete once the files in its range are present
+    for file in dataset.files:
+        file.local_path.write_bytes(_content(file))
+    assert dataset.exists()
+
+
+def test_exists_from_the_manifest(dataset, manifest):
+    file = dataset.files[0]
+    dataset.record(file)
+    assert file.exists()  # recorded, even though nothing is on disk
+
+
+def test_complete_file_on_disk_is_recorded_unverified(dataset, manifest):
+    file = dataset.files[0]
+    file.local_path.write_bytes(_content(file))
+
+    assert file.exists()
+    assert manifest.completed(dataset.dataset_id) == {file.filename: (file.size, None)}
+
+
+def test_file_of_the_wrong_size_does_not_exist(dataset, manifest):
+    file = dataset.files[0]
+    file.local_path.write_bytes(_content(file)[:50])
+
+    assert not file.exists()
+    assert manifest.completed(dataset.dataset_id) == {}
+
+
+def test_manifest_entry_with_another_checksum_is_checked_on_disk(dataset, manifest):
+    file = dataset.files[0]
+    dataset.record(file)
+    file.checksum = "0" * 64  # republished with different content
+    assert not file.exists()
+
+
+def test_records_are_slotted(dataset):
+    file = dataset.files[0]
+    for record in (dataset, file, FileTask(file)):
+        assert not hasattr(record, '__dict__')
+        with pytest.raises(AttributeError):
+            record.json = {}
+
+
+def test_searched_dataset_keeps_its_metadata_but_not_its_result(catalog, publish, index, data_home):
+    publish([100, 200])
+    conn = SearchConnection(index.url, distrib=False)
+    result, = conn.new_context(project="CMIP6", variable_id="tas").search()
+    dataset = Dataset(result, data_home)
+    assert dataset.dataset_id == result.dataset_id
+    assert (dataset.version, dataset.model) == ("20200101", "MODEL-0")
+    assert (dataset.start_date.year, dataset.end_date.year) == (2015, 2100)
+    assert all(getattr(dataset, slot, None) is not result for slot in Dataset.__slots__)
+
+    # Files are still searched for through the result's context
+    first, second = dataset.all_files
+    assert (first.size, second.size) == (100, 200)
+    url, = first.download_urls
+    assert url.startswith("http://127.0.0.2:9/data/") and url.endswith(first.filename)
+    # The algorithm name is shared by every file
+    assert first.checksum_type is second.checksum_type
@@ -0,0 +1,44 @@
+import pytest
+
+import esgf_download.__main__ as cli_module
+from esgf_download.__main__ import cli
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """The command each CLI invocation runs, and its arguments."""
+    calls = []
+    for command in ("main", "plan", "verify", "reconcile", "gc"):
+        monkeypatch.setattr(cli_module, command, lambda *args, command=command: calls.append((command, args)))
+    return calls
+
+
+@pytest.mark.parametrize("argv", [
+    ["config.yaml", "--login"],
+    ["--login", "config.yaml"],
+    ["download", "--login", "config.yaml"],
+])
+def test_download_is_the_default_command(calls, argv):
+    cli(argv)
+    (command, args), = calls
+    assert command == "main"
+    assert args[:2] == ("config.yaml", True)
+
+
+def test_options_before_the_config(calls):
+    cli(["--headless", "--invalidate", "CMIP6.A.v1", "config.yaml"])
+    (command, args), = calls
+    assert args[0] == "config.yaml"
+    assert args[3:5] == (("CMIP6.A.v1",), True)
+
+
+def test_subcommands(calls):
+    cli(["verify", "--delete", "config.yaml"])
+    cli(["reconcile", "config.yaml"])
+    assert calls == [("verify", ("config.yaml", None, True, False)), ("reconcile", ("config.yaml",))]
+
+
+def test_version(capsys):
+    with pytest.raises(SystemExit):
+        cli(["--version"])
+    assert "0.1.0" in capsys.readouterr().out
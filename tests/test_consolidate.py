@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import pytest
+
+np = pytest.importorskip("numpy")
+netCDF4 = pytest.importorskip("netCDF4")
+
+from esgf_download.consolidate import Consolidator, consolidate
+
+
+def _write(path, first: int, steps: int, units: str = "days since 1850-01-01") -> None:
+    """A monthly tas file of ``steps`` time steps, whose values are the step numbers from ``first``."""
+    with netCDF4.Dataset(path, 'w') as dst:
+        dst.createDimension('time', None)
+        dst.createDimension('lat', 3)
+        dst.createDimension('lon', 4)
+        time = dst.createVariable('time', 'f8', ('time',))
+        time.setncatts({'axis': 'T', 'units': units, 'calendar': 'standard'})
+        dates = [datetime(2015 + (first + i) // 12, (first + i) % 12 + 1, 16) for i in range(steps)]
+        time[:] = netCDF4.date2num(dates, units, 'standard')
+        lat = dst.createVariable('lat', 'f8', ('lat',))
+        lat.units = "degrees_north"
+        lat[:] = [-30, 0, 30]
+        lon = dst.createVariable('lon', 'f8', ('lon',))
+        lon.units = "degrees_east"
+        lon[:] = [0, 90, 180, 270]
+        tas = dst.createVariable('tas', 'f4', ('time', 'lat', 'lon'))
+        tas[:] = np.arange(first, first + steps, dtype='f4')[:, None, None] * np.ones((3, 4), 'f4')
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = [tmp_path / f"tas_Amon_M_ssp585_r1i1p1f1_gn_{i}.nc" for i in range(3)]
+    for i, path in enumerate(paths):
+        # The last file counts time from another reference date
+        _write(path, 12 * i, 12, "days since 1850-01-01" if i < 2 else "days since 2000-01-01")
+    return [str(path) for path in paths]
+
+
+def _read(path) -> tuple:
+    with netCDF4.Dataset(path) as store:
+        return store['tas'][:, 0, 0].tolist(), store['time'].units, netCDF4.num2date(
+            store['time'][:], store['time'].units, 'standard')
+
+
+def test_files_are_appended_in_order(files, tmp_path):
+    out = tmp_path / "tas.nc"
+    assert consolidate(files, 'tas', str(out), 'netcdf', {'time': 12}, 4, 1024) == 3
+
+    values, units, dates = _read(out)
+    assert values == list(range(36))
+    assert units == "days since 1850-01-01"
+    assert [(date.year, date.month) for date in dates[22:26]] == [(2016, 11), (2016, 12), (2017, 1), (2017, 2)]
+
+
+def test_store_is_updated_incrementally(files, tmp_path):
+    out = tmp_path / "tas.nc"
+    assert consolidate(files[:2], 'tas', str(out), 'netcdf', {'time': 12}, 4, 1024) == 2
+    assert consolidate(files, 'tas', str(out), 'netcdf', {'time': 12}, 4, 1024) == 1
+    assert consolidate(files, 'tas', str(out), 'netcdf', {'time': 12}, 4, 1024) == 0
+    assert _read(out)[0] == list(range(36))
+
+
+def test_store_is_rebuilt_when_a_file_comes_before_its_last(files, tmp_path):
+    out = tmp_path / "tas.nc"
+    consolidate([files[0], files[2]], 'tas', str(out), 'netcdf', {'time': 12}, 4, 1024)
+    assert consolidate(files, 'tas', str(out), 'netcdf', {'time': 12}, 4, 1024) == 3
+    assert _read(out)[0] == list(range(36))
+
+
+def test_zarr_store(files, tmp_path):
+    zarr = pytest.importorskip("zarr")
+    out = tmp_path / "tas.zarr"
+    assert consolidate(files, 'tas', str(out), 'zarr', {'time': 12}, 4, 1024) == 3
+    group = zarr.open_group(str(out), mode='r')
+    assert group['tas'][:, 0, 0].tolist() == list(range(36))
+    assert group['tas'].attrs['_ARRAY_DIMENSIONS'] == ['time', 'lat', 'lon']
+
+
+def test_store_is_named_after_the_files_without_dates(catalog, publish, datasets):
+    publish([10, 20])
+    dataset, = datasets(catalog)
+    consolidator = Consolidator('netcdf')
+    try:
+        assert consolidator.path(dataset) == dataset.local_path / "tas_Amon_MODEL-0_ssp585_r1i1p1f1_gn.nc"
+    finally:
+        consolidator.close()
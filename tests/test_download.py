@@ -0,0 +1,186 @@
+import hashlib
+import json
+import threading
+
+import pytest
+
+from benchmarks.fake_esgf import FakeDataNode, Faults, file_bytes
+from esgf_download import download
+from esgf_download.download import DownloadScheduler, download_file
+from esgf_download.metrics import RunMetrics
+from esgf_download.mirrors import NodeHealth
+from esgf_download.priority import FileOrder
+from esgf_download.progress import FileTask
+from esgf_download.sessions import SessionPool
+
+
+def _content(file) -> bytes:
+    return file_bytes(file.filename, 0, file.size)
+
+
+def test_download_verifies_and_records(catalog, node, publish, datasets, manifest):
+    publish([300_000])
+    file, = datasets(catalog, node.base_url, manifest=manifest)[0].files
+    task = FileTask(file)
+
+    assert download_file(file, task)
+    assert task.state == 'done'
+    assert file.local_path.read_bytes() == _content(file)
+    assert not file.part_path.exists()
+    assert manifest.completed(file.dataset.dataset_id) == {file.filename: (file.size, file.checksum)}
+
+
+def test_existing_file_is_skipped(catalog, node, publish, datasets):
+    publish([1000])
+    file, = datasets(catalog, node.base_url)[0].files
+    file.local_path.parent.mkdir(parents=True)
+    file.local_path.write_bytes(_content(file))
+    task = FileTask(file)
+
+    assert download_file(file, task)
+    assert task.state == 'skipped'
+    assert node.requests == 0
+
+
+def test_part_file_is_resumed(catalog, node, publish, datasets):
+    publish([200_000])
+    file, = datasets(catalog, node.base_url)[0].files
+    file.part_path.parent.mkdir(parents=True)
+    file.part_path.write_bytes(_content(file)[:150_000])
+
+    assert download_file(file, FileTask(file))
+    assert node.bytes_sent == 50_000
+    assert hashlib.sha256(file.local_path.read_bytes()).hexdigest() == file.checksum
+
+
+def test_corrupt_part_file_is_discarded_and_downloaded_again(catalog, node, publish, datasets):
+    publish([100_000])
+    file, = datasets(catalog, node.base_url)[0].files
+    file.part_path.parent.mkdir(parents=True)
+    file.part_path.write_bytes(b"x" * 50_000)
+    task = FileTask(file)
+
+    assert download_file(file, task, retries=1)
+    assert task.attempts == 2
+    assert file.local_path.read_bytes() == _content(file)
+
+
+def test_segmented_download(catalog, node, publish, datasets):
+    publish([1_000_000])
+    file, = datasets(catalog, node.base_url)[0].files
+
+    assert download_file(file, FileTask(file), segments=4)
+    assert node.requests == 5  # a one-byte Range probe, then one request per segment
+    assert file.local_path.read_bytes() == _content(file)
+    assert not file.segments_path.exists()
+
+
+def test_segmented_download_resumes_each_segment(catalog, node, publish, datasets):
+    size = 400_000
+    publish([size])
+    file, = datasets(catalog, node.base_url)[0].files
+    content = _content(file)
+    file.part_path.parent.mkdir(parents=True)
+    # Half of the first segment and all of the second are already on disk
+    with open(file.part_path, 'wb') as f:
+        f.truncate(size)
+        f.write(content[:100_000])
+        f.seek(200_000)
+        f.write(content[200_000:300_000])
+    state = [[0, 200_000, 100_000], [200_000, 300_000, 100_000], [300_000, size, 0]]
+    file.segments_path.write_text(json.dumps(state))
+
+    assert download_file(file, FileTask(file), segments=3)
+    assert node.bytes_sent == 1 + 200_000  # the Range probe, then the missing ranges
+    assert file.local_path.read_bytes() == content
+
+
+def test_segmented_download_falls_back_on_a_node_ignoring_ranges(catalog, publish, datasets):
+    size = 400_000
+    publish([size])
+    # A segmented download started on another replica, resumed on one that ignores Range
+    plain = FakeDataNode(catalog, host="127.0.0.3", faults=Faults(ranges=False)).start()
+    try:
+        file, = datasets(catalog, plain.base_url)[0].files
+        file.part_path.parent.mkdir(parents=True)
+        with open(file.part_path, 'wb') as f:
+            f.truncate(size)
+            f.write(_content(file)[:100_000])
+        file.segments_path.write_text(json.dumps([[0, 200_000, 100_000], [200_000, size, 0]]))
+
+        assert download_file(file, FileTask(file), segments=2)
+    finally:
+        plain.stop()
+    assert file.local_path.read_bytes() == _content(file)
+    assert not file.segments_path.exists()
+
+
+def test_failover_to_replica(catalog, node, publish, datasets, monkeypatch):
+    publish([100_000])
+    broken = FakeDataNode(catalog, host="127.0.0.3", faults=Faults(error_rate=1.0)).start()
+    health = NodeHealth()
+    # Try the replicas in the order given, rather than the broken one last after probing
+    monkeypatch.setattr(health, "rank", lambda urls, sessions, probe=True: list(urls))
+    try:
+        file, = datasets(catalog, broken.base_url, node.base_url)[0].files
+        task = FileTask(file)
+        assert download_file(file, task, SessionPool(), health)
+    finally:
+        broken.stop()
+    assert broken.requests > 0
+    assert task.failed_nodes == ["127.0.0.3"]
+    assert task.node == "127.0.0.2"
+    assert file.local_path.read_bytes() == _content(file)
+
+
+def test_scheduler_downloads_largest_first(catalog, node, publish, datasets, monkeypatch):
+    publish([10, 30, 20], variable="tas")
+    publish([25], variable="pr")
+    started = []
+
+    def fake_download(file, task, *args):
+        started.append(file.size)
+        task.succeed()
+        return True
+
+    monkeypatch.setattr(download, "download_file", fake_download)
+    with DownloadScheduler(max_workers=1, headless=True, order=FileOrder('largest')) as scheduler:
+        # The single worker may start as soon as a file is queued, so hold it until
+        # everything is submitted
+        gate = threading.Event()
+        original = scheduler._ready
+        monkeypatch.setattr(scheduler.queue, "ready", lambda file: gate.is_set() and original(file))
+        for dataset in datasets(catalog, node.base_url):
+            scheduler.submit(dataset)
+        gate.set()
+        scheduler.queue.wake()
+        assert not scheduler.wait()
+    assert started == [30, 25, 20, 10]
+
+
+def test_scheduler_with_more_workers_than_node_slots(catalog, node, publish, datasets):
+    publish([50_000] * 12)
+    dataset, = datasets(catalog, node.base_url)
+    with DownloadScheduler(max_workers=4, max_per_node=1, headless=True) as scheduler:
+        scheduler.submit(dataset)
+        assert not scheduler.wait()
+    assert scheduler.tracker.files_done == 12
+    assert all(file.local_path.stat().st_size == file.size for file in dataset.files)
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_scheduler_finishes_a_file_whose_bookkeeping_fails(catalog, node, publish, datasets, monkeypatch):
+    publish([1000])
+    dataset, = datasets(catalog, node.base_url)
+    metrics = RunMetrics()
+
+    def record_file(task):
+        raise RuntimeError("metrics failed")
+
+    monkeypatch.setattr(metrics, "record_file", record_file)
+    with DownloadScheduler(max_workers=1, headless=True, metrics=metrics) as scheduler:
+        scheduler.submit(dataset)
+        waiter = threading.Thread(target=scheduler.wait, daemon=True)
+        waiter.start()
+        waiter.join(timeout=10)
+        assert not waiter.is_alive()
@@ -0,0 +1,70 @@
+from esgf_download.manifest import Manifest
+
+
+def _download(file) -> None:
+    file.local_path.parent.mkdir(parents=True, exist_ok=True)
+    file.local_path.write_bytes(b"\0" * file.size)
+
+
+def test_record_and_completed(catalog, publish, datasets, manifest):
+    publish([10, 20])
+    dataset, = datasets(catalog, manifest=manifest)
+    first, second = dataset.files
+    _download(first)
+    manifest.record(first)
+    _download(second)
+    manifest.record(second, verified=False)
+
+    # Replicas of a dataset share their entries
+    replica = dataset.dataset_id.replace("|node-0", "|node-1")
+    assert manifest.completed(replica) == {
+        first.filename: (10, first.checksum),
+        second.filename: (20, None),
+    }
+    entry = manifest.entries()[0]
+    assert (entry.dataset_id, entry.local_path, entry.checksum_type) == (
+        Manifest.instance_id(dataset.dataset_id), first.local_path, "SHA256"
+    )
+
+
+def test_forget(catalog, publish, datasets, manifest):
+    publish([10])
+    dataset, = datasets(catalog, manifest=manifest)
+    file, = dataset.files
+    _download(file)
+    manifest.record(file)
+    manifest.forget(file)
+    assert manifest.completed(dataset.dataset_id) == {}
+
+
+def test_reconcile_drops_missing_and_truncated_files(catalog, publish, datasets, manifest):
+    publish([10, 20, 30])
+    dataset, = datasets(catalog, manifest=manifest)
+    for file in dataset.files:
+        _download(file)
+        manifest.record(file)
+    missing, truncated, intact = dataset.files
+    missing.local_path.unlink()
+    truncated.local_path.write_bytes(b"\0" * 5)
+
+    assert manifest.reconcile() == (3, 2)
+    assert list(manifest.completed(dataset.dataset_id)) == [intact.filename]
+
+
+def test_merge(catalog, publish, datasets, manifest, data_home):
+    publish([10, 20])
+    dataset, = datasets(catalog, manifest=manifest)
+    first, second = dataset.files
+    for file in dataset.files:
+        _download(file)
+    manifest.record(first, verified=False)
+    shard = Manifest(data_home / ".esgf_shards" / "manifest-0-of-2.sqlite")
+    shard.record(first)
+    shard.record(second)
+    shard.close()
+
+    assert manifest.merge(shard.path) == 2
+    assert manifest.completed(dataset.dataset_id) == {
+        first.filename: (10, first.checksum),
+        second.filename: (20, second.checksum),
+    }
@@ -0,0 +1,100 @@
+import json
+from types import SimpleNamespace
+
+from esgf_download.metrics import RunMetrics, openmetrics, search_kind
+from esgf_download.progress import FileTask
+
+
+def _task(metrics: RunMetrics, filename: str, node=None, state='done', size=100, dataset_id="ds.v1|node-0",
+          start=0.0, wall=1.0, transfer=1.0, failed_nodes=()) -> FileTask:
+    """A finished transfer of ``size`` bytes, started ``start`` seconds into the run."""
+    file = SimpleNamespace(filename=filename, size=size, dataset=SimpleNamespace(dataset_id=dataset_id))
+    task = FileTask(file)
+    task.node = node
+    task.state = state
+    task.completed = size if state == 'done' else 0
+    task.attempts = 1 + len(failed_nodes)
+    task.failed_nodes = list(failed_nodes)
+    task.ttfb = 0.25 if node is not None else None
+    task.transfer_time = transfer
+    task.started = metrics.started + start
+    task.ended = task.started + wall
+    return task
+
+
+def test_search_kind():
+    assert search_kind("http://index/search?type=File&dataset_id=x") == 'files'
+    assert search_kind("http://index/search?type=Dataset&limit=0") == 'count'
+    assert search_kind("http://index/search?type=Dataset&limit=50") == 'datasets'
+
+
+def test_summary_per_node_and_dataset():
+    metrics = RunMetrics()
+    metrics.record_search("http://index/search?type=File", 0.5, 200, 10)
+    metrics.record_search("http://index/search?type=File", 1.5, None, 0)
+    metrics.record_file(_task(metrics, "a.nc", node="n1", size=100, transfer=2.0))
+    # Failed on n2 first, then came from n1: the failed attempt is charged to n2
+    metrics.record_file(_task(metrics, "b.nc", node="n1", size=300, transfer=1.0, failed_nodes=["n2"]))
+    metrics.record_file(_task(metrics, "c.nc", node="n2", state='failed', dataset_id="other.v1|node-0",
+                              failed_nodes=["n2", "n2"]))
+
+    summary = metrics.summary()
+    assert summary['run']['files'] == 3
+    assert summary['run']['files_failed'] == 1
+    assert summary['run']['bytes'] == 400
+    assert summary['searches']['files']['count'] == 2
+    assert summary['searches']['files']['errors'] == 1
+    assert summary['searches']['files']['max'] == 1.5
+    n1, n2 = summary['nodes']["n1"], summary['nodes']["n2"]
+    assert (n1['files'], n1['done'], n1['bytes'], n1['retries'], n1['errors']) == (2, 2, 400, 1, 0)
+    assert n1['throughput'] == round(400 / 3.0)
+    assert (n2['files'], n2['failed'], n2['errors']) == (1, 1, 3)
+    assert summary['datasets']["ds.v1|node-0"]['files'] == 2
+
+
+def test_metrics_files(tmp_path):
+    metrics = RunMetrics()
+    metrics.record_file(_task(metrics, "a.nc", node="n1"))
+    metrics.write_json(tmp_path / "metrics.json")
+    metrics.write_openmetrics(tmp_path / "metrics.prom")
+
+    written = json.loads((tmp_path / "metrics.json").read_text())
+    assert [file['filename'] for file in written['file_log']] == ["a.nc"]
+    text = (tmp_path / "metrics.prom").read_text()
+    assert 'esgf_download_node_bytes{node="n1"} 100' in text
+    assert text.endswith("# EOF\n")
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_openmetrics_escapes_labels_and_skips_missing_values():
+    metrics = RunMetrics()
+    metrics.record_file(_task(metrics, "a.nc", node='n"1', transfer=0.0))
+    text = openmetrics(metrics.summary())
+    assert 'node="n\\"1"' in text
+    assert "esgf_download_node_throughput_bytes_per_second" not in text  # no transfer time
+
+
+def test_makespan_bound():
+    metrics = RunMetrics()
+    metrics.set_slots(4, 1)
+    metrics.record_file(_task(metrics, "a.nc", node="n1", start=0.0, wall=3.0, transfer=3.0))
+    metrics.record_file(_task(metrics, "b.nc", node="n1", start=3.0, wall=2.0, transfer=2.0))
+    metrics.record_file(_task(metrics, "c.nc", node="n2", start=1.0, wall=1.0, transfer=1.0))
+
+    run = metrics.summary()['run']
+    assert run['makespan'] == 5.0
+    assert run['makespan_bound'] == 5.0  # n1 has one slot for 5 s of transfers
+
+
+def test_makespan_of_a_run_without_transfers(tmp_path):
+    # Every file was already there, or linked from another version: none has a node
+    metrics = RunMetrics()
+    metrics.set_slots(4, 1)
+    metrics.record_file(_task(metrics, "a.nc", state='skipped', transfer=0.0))
+    metrics.record_file(_task(metrics, "b.nc", state='skipped', transfer=0.0))
+
+    run = metrics.summary()['run']
+    assert run['makespan_bound'] == 0.0
+    metrics.report()
+    metrics.write_json(tmp_path / "metrics.json")
+    metrics.write_openmetrics(tmp_path / "metrics.prom")
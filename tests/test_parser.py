@@ -0,0 +1,41 @@
+from pathlib import Path
+
+import pytest
+import yaml
+
+from esgf_download.parser import load_config
+
+CONFIG = Path(__file__).parent.parent / "config.yaml"
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Load the example config, without the given ``section.key`` settings, as an older config would."""
+    def load(*missing: str):
+        data = yaml.safe_load(CONFIG.read_text())
+        for setting in missing:
+            section, key = setting.split('.')
+            del data[section][key]
+        path = tmp_path / "config.yaml"
+        path.write_text(yaml.safe_dump(data))
+        return load_config(str(path))
+    return load
+
+
+def test_example_config_loads(config):
+    assert config().SEARCH_WORKERS > 0
+
+
+def test_search_cache_is_opt_in(config):
+    assert not config().CACHE_ENABLED
+    assert not config('cache.enabled').CACHE_ENABLED
+
+
+def test_failed_files_are_not_retried_unless_configured(config):
+    assert config().RETRIES == 3
+    assert config('download.retries').RETRIES == 0
+
+
+def test_files_are_queued_in_submission_order_unless_configured(config):
+    assert config().ORDER == 'largest'
+    assert config('download.order').ORDER == 'submitted'
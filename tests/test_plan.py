@@ -0,0 +1,97 @@
+import json
+
+import pytest
+import yaml
+
+from esgf_download.console import console
+from esgf_download.manager import DownloadManager
+from esgf_download.parser import load_config
+from esgf_download.plan import load_plan, summarise, write_plan, PLAN_VERSION
+from esgf_download.search import _ends_by_2300
+from tests.test_parser import CONFIG
+
+
+def test_round_trip(catalog, node, publish, datasets, tmp_path, data_home):
+    publish([10, 20])
+    publish([30], variable="pr")
+    planned = datasets(catalog, node.base_url, "http://127.0.0.3:9")
+    path = tmp_path / "plan.json"
+    write_plan(planned, path)
+
+    loaded = list(load_plan(path, data_home))
+    assert [dataset.dataset_id for dataset in loaded] == [dataset.dataset_id for dataset in planned]
+    for before, after in zip(planned, loaded):
+        assert after.version == before.version
+        assert [
+            (file.filename, file.size, file.checksum, file.checksum_type, file.download_urls,
+             file.opendap_urls, file.local_path)
+            for file in after.files
+        ] == [
+            (file.filename, file.size, file.checksum, file.checksum_type, file.download_urls,
+             file.opendap_urls, file.local_path)
+            for file in before.files
+        ]
+
+
+def test_replica_opendap_urls_round_trip(catalog, publish, datasets, tmp_path, data_home):
+    publish([10])
+    dataset, = datasets(catalog)
+    file, = dataset.files
+    file.opendap_urls = ["http://a/thredds/dodsC/f.nc", "http://b/thredds/dodsC/f.nc"]
+    path = tmp_path / "plan.json"
+    write_plan([dataset], path)
+
+    loaded, = load_plan(path, data_home)
+    assert loaded.files[0].opendap_urls == file.opendap_urls
+
+
+def test_planned_datasets_are_filtered_without_searching(catalog, datasets, tmp_path, data_home):
+    for years in ((2015, 2100), (2015, 2300)):
+        catalog.add_dataset("CMIP6", f"MODEL-{years[1]}", "ssp585", "tas", "Amon", "gn", "r1i1p1f1", "mon",
+                            [10] * 4, ["node-0"], years=years)
+    path = tmp_path / "plan.json"
+    write_plan(datasets(catalog), path)
+
+    short, extended = load_plan(path, data_home)
+    assert not _ends_by_2300(short)
+    assert _ends_by_2300(extended)
+    extended.time_range = (2200, None)
+    assert [file.end_date.year for file in extended.files] == [2227, 2300]
+
+
+def test_run_from_plan_downloads_the_configured_time_range(catalog, node, publish, datasets, tmp_path,
+                                                            data_home, monkeypatch):
+    publish([1000] * 4)  # 2015-2035, 2036-2056, 2057-2077 and 2078-2100
+    path = tmp_path / "plan.json"
+    write_plan(datasets(catalog, node.base_url), path)
+    data = yaml.safe_load(CONFIG.read_text())
+    data['data']['time_range'] = {'ssp585': [2040, 2060]}
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(yaml.safe_dump(data))
+    monkeypatch.setenv('DATA_HOME', str(data_home))
+    monkeypatch.setattr(console, "_file", None)  # restored after use_stderr()
+
+    DownloadManager(load_config(str(config_path)), headless=True).run(plan=path)
+    assert sorted(nc.name[-16:] for nc in data_home.rglob("*.nc")) == [
+        "203601-205612.nc", "205701-207712.nc",
+    ]
+
+
+def test_newer_plan_is_rejected(tmp_path, data_home):
+    path = tmp_path / "plan.json"
+    path.write_text(json.dumps({'plan_version': PLAN_VERSION + 1, 'datasets': []}))
+    with pytest.raises(ValueError):
+        list(load_plan(path, data_home))
+
+
+def test_summarise(catalog, publish, datasets):
+    publish([10, 20])
+    dataset, = datasets(catalog, "http://127.0.0.2:9")
+    present = dataset.files[1]
+    present.local_path.parent.mkdir(parents=True)
+    present.local_path.write_bytes(b"\0" * 20)
+
+    summary = summarise([dataset])
+    assert summary['total'] == [2, 30, 1, 20]
+    assert summary['nodes'] == {"127.0.0.2": [2, 30, 1, 20]}
+    assert summary['models'] == {"MODEL-0": [2, 30, 1, 20]}
@@ -0,0 +1,87 @@
+import threading
+from queue import Empty
+from types import SimpleNamespace
+
+import pytest
+
+from esgf_download.priority import FileOrder, FileQueue
+
+DATASET = "CMIP6.ScenarioMIP.FAKE.MODEL-0.ssp585.r1i1p1f1.Amon.tas.gn.v20200101|node-0"
+
+
+def _file(name: str, size: int, dataset_id: str = DATASET):
+    """Just what the queue looks at of a File."""
+    return SimpleNamespace(filename=name, size=size, dataset=SimpleNamespace(dataset_id=dataset_id))
+
+
+def _drain(queue: FileQueue) -> list:
+    names = []
+    while True:
+        try:
+            file = queue.get_nowait()
+        except Empty:
+            return names
+        names.append(None if file is None else file.filename)
+
+
+@pytest.mark.parametrize("order, expected", [
+    ('largest', ['c', 'b', 'a', 'd']),
+    ('smallest', ['a', 'd', 'b', 'c']),
+    ('submitted', ['a', 'b', 'c', 'd']),
+])
+def test_queue_order(order, expected):
+    queue = FileQueue(FileOrder(order))
+    for name, size in [('a', 1), ('b', 5), ('c', 9), ('d', 1)]:
+        queue.put(_file(name, size))
+    assert _drain(queue) == expected
+
+
+def test_priority_beats_size():
+    queue = FileQueue(FileOrder('largest', {'thetao': 10}))
+    queue.put(_file('big', 100))
+    queue.put(_file('ocean', 1, DATASET.replace('Amon.tas', 'Omon.thetao')))
+    assert _drain(queue) == ['ocean', 'big']
+
+
+def test_priority_is_highest_of_matching_facets():
+    order = FileOrder('largest', {'thetao': 10, 'MODEL-0': 20})
+    assert order.priority(_file('a', 1, DATASET.replace('Amon.tas', 'Omon.thetao'))) == 20
+    assert order.priority(_file('b', 1, DATASET.replace('MODEL-0', 'MODEL-1'))) == 0
+
+
+def test_invalid_order():
+    with pytest.raises(ValueError):
+        FileOrder('random')
+
+
+def test_stop_signal_comes_last():
+    queue = FileQueue(FileOrder())
+    queue.put(None)
+    queue.put(_file('a', 1))
+    assert _drain(queue) == ['a', None]
+
+
+def test_get_skips_files_that_are_not_ready_and_keeps_their_place():
+    busy = {'b'}
+    queue = FileQueue(FileOrder('submitted'), ready=lambda file: file.filename not in busy)
+    for name in 'abc':
+        queue.put(_file(name, 1))
+    assert queue.get_nowait().filename == 'a'
+    assert queue.get_nowait().filename == 'c'
+    busy.clear()
+    assert queue.get_nowait().filename == 'b'
+
+
+def test_get_blocks_until_woken():
+    ready = threading.Event()
+    queue = FileQueue(FileOrder(), ready=lambda file: ready.is_set())
+    queue.put(_file('a', 1))
+    with pytest.raises(Empty):
+        queue.get(timeout=0.1)
+
+    def free_a_slot():
+        ready.set()
+        queue.wake()
+
+    threading.Timer(0.1, free_a_slot).start()
+    assert queue.get(timeout=5).filename == 'a'
@@ -0,0 +1,64 @@
+import io
+import json
+
+from benchmarks.run import SCENARIOS, run_scenario
+from esgf_download.console import console
+from esgf_download.progress import JsonRenderer, ProgressTracker
+
+
+def _lines(stream: io.StringIO) -> list[dict]:
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_json_renderer(catalog, publish, datasets):
+    publish([100, 200, 300, 400])
+    dataset, = datasets(catalog)
+    done, skipped, failed, active = dataset.files
+    tracker = ProgressTracker()
+    tracker.expect(5)
+    for file in dataset.files:
+        task = tracker.add(file)
+        task.begin(file.size)
+        if file is done:
+            task.completed = file.size
+            tracker.finish(task, True)
+        elif file is skipped:
+            task.skip()
+            tracker.finish(task, True)
+        elif file is failed:
+            task.completed = 50
+            task.fail("checksum mismatch")
+            tracker.finish(task, False)
+        else:
+            task.completed = 10
+    tracker.dataset_done(dataset.dataset_id, 1, 3)
+    stream = io.StringIO()
+    renderer = JsonRenderer(tracker, interval=3600, stream=stream)
+
+    renderer.render()
+    failure, finished, progress = _lines(stream)
+    assert failure['event'] == 'failed'
+    assert (failure['file'], failure['error']) == (failed.filename, "checksum mismatch")
+    assert (finished['event'], finished['files'], finished['failed']) == ('dataset', 3, 1)
+    assert progress['event'] == 'progress'
+    assert progress['bytes'] == 100 + 50 + 10  # nothing transferred for the skipped file
+    assert [progress[key] for key in ('files_done', 'files_skipped', 'files_failed', 'files_active',
+                                      'files_queued')] == [1, 1, 1, 1, 1]
+
+    renderer.start()
+    renderer.stop()
+    final = _lines(stream)[-1]
+    assert final['event'] == 'summary'
+    assert final['rate'] == 0  # nothing transferred since the last line
+
+
+def test_headless_run_keeps_stdout_to_json_lines(capsys, monkeypatch):
+    monkeypatch.setenv('DATA_HOME', "")
+    monkeypatch.setattr(console, "_file", None)  # restored after use_stderr()
+    result = run_scenario(SCENARIOS['mixed_sizes'], scale=0.01)
+    assert result['complete'] == result['files']
+
+    out = capsys.readouterr().out
+    records = [json.loads(line) for line in out.splitlines()]
+    assert records[-1]['event'] == 'summary'
+    assert records[-1]['files_done'] == result['files']
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest
+from pyesgf.search import SearchConnection
+
+from esgf_download.search import search_batch, split_batch_results
+
+
+@pytest.fixture
+def config():
+    """Just what searches look at of a Config."""
+    return SimpleNamespace(
+        PROJECT="CMIP6", FREQUENCY="mon", SCENARIOS=["ssp585", "ssp245"], DATA_NODE_PREFERENCE="node-0",
+        VARIANT_LABEL={"MODEL-0": "r1i1p1f1"}, TABLE_ID={"tas": "Amon", "thetao": "Omon"},
+        GRID_LABEL={"tas": "gn", "thetao": "gn"},
+    )
+
+
+def _result(**facets):
+    return SimpleNamespace(json=facets)
+
+
+def test_split_keeps_only_the_configured_table_and_grid(config):
+    wanted = _result(experiment_id=["ssp585"], variable_id=["tas"], table_id=["Amon"], grid_label=["gn"])
+    other_table = _result(experiment_id=["ssp585"], variable_id=["tas"], table_id=["Omon"], grid_label=["gn"])
+    other_grid = _result(experiment_id=["ssp245"], variable="thetao", table_id="Omon", grid_label="gr")
+    unconfigured = _result(experiment_id=["ssp245"], variable_id=["pr"], table_id=["Amon"], grid_label=["gn"])
+
+    buckets = split_batch_results([wanted, other_table, other_grid, unconfigured], config)
+    assert buckets == {("ssp585", "tas"): [wanted]}
+
+
+def test_search_batch_falls_back_for_missing_combinations_only(catalog, index, config):
+    catalog.add_dataset("CMIP6", "MODEL-0", "ssp585", "tas", "Amon", "gn", "r1i1p1f1", "mon", [1], ["node-0"])
+    catalog.add_dataset("CMIP6", "MODEL-0", "ssp245", "tas", "Amon", "gn", "r1i1p1f1", "mon", [1],
+                        ["node-1", "node-0"])
+    # Only published on another node
+    catalog.add_dataset("CMIP6", "MODEL-0", "ssp585", "thetao", "Omon", "gn", "r1i1p1f1", "mon", [1], ["node-1"])
+    conn = SearchConnection(index.url, distrib=False)
+
+    buckets = search_batch(conn, config, "MODEL-0", ["tas", "thetao"])
+    nodes = {key: [result.json['data_node'] for result in results] for key, results in buckets.items()}
+    assert nodes == {
+        ("ssp585", "tas"): ["node-0"],
+        ("ssp245", "tas"): ["node-0"],
+        ("ssp585", "thetao"): ["node-1"],
+    }
@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_esgf import FakeIndex
+from esgf_download.sessions import IndexSession
+
+
+def test_index_queries_are_bounded_across_pools(catalog, publish):
+    publish([1])
+    index = FakeIndex(catalog, latency=0.05).start()
+    index.data_nodes = {"node-0": "http://127.0.0.2:9"}
+    session = IndexSession(3)
+
+    def search(_):
+        return session.get(f"{index.url}/search", params={'type': "Dataset", 'format': "application/solr+json"})
+
+    try:
+        # Nested pools, as with searches that list files while filtering results
+        with ThreadPoolExecutor(4) as outer:
+            def fan_out(_):
+                with ThreadPoolExecutor(4) as inner:
+                    return list(inner.map(search, range(4)))
+            responses = [response for batch in outer.map(fan_out, range(4)) for response in batch]
+    finally:
+        index.stop()
+    assert all(response.ok for response in responses)
+    assert index.requests == 16
+    assert index.peak == 3
@@ -0,0 +1,93 @@
+import json
+import os
+from time import time
+
+import pytest
+
+from esgf_download.shards import Shard, parse_shard, shard_manifests
+
+
+@pytest.mark.parametrize("spec, expected", [("0/1", (0, 1)), ("2/3", (2, 3))])
+def test_parse_shard(spec, expected):
+    assert parse_shard(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["3/3", "-1/2", "1", "a/b"])
+def test_parse_invalid_shard(spec):
+    with pytest.raises(ValueError):
+        parse_shard(spec)
+
+
+def test_every_file_has_exactly_one_owner(catalog, publish, datasets, data_home):
+    publish([1] * 30)
+    publish([1] * 30, variable="pr")
+    files = [file for dataset in datasets(catalog) for file in dataset.files]
+    shards = [Shard(index, 3, data_home) for index in range(3)]
+
+    owners = [[shard.owns(file) for shard in shards] for file in files]
+    assert all(sum(owned) == 1 for owned in owners)
+    assert all(any(owned[index] for owned in owners) for index in range(3))
+    # Another process computes the same partition
+    assert [Shard(0, 3, data_home).owns(file) for file in files] == [owned[0] for owned in owners]
+
+
+def test_lease_is_exclusive_until_released(catalog, publish, datasets, data_home):
+    publish([1])
+    file, = datasets(catalog)[0].files
+    first, second = Shard(0, 2, data_home), Shard(1, 2, data_home)
+
+    assert first.claim(file)
+    assert second.leased(file)
+    assert not second.claim(file)
+    second.release(file)  # not held by the second shard: left alone
+    assert file.lease_path.exists()
+    first.release(file)
+    assert not file.lease_path.exists()
+    assert second.claim(file)
+
+
+def test_stale_lease_is_taken_over(catalog, publish, datasets, data_home):
+    publish([1])
+    file, = datasets(catalog)[0].files
+    crashed, survivor = Shard(0, 2, data_home, lease_ttl=60), Shard(1, 2, data_home, lease_ttl=60)
+    assert crashed.claim(file)
+    old = time() - 120
+    os.utime(file.lease_path, (old, old))
+
+    assert not survivor.leased(file)
+    assert survivor.claim(file)
+    assert json.loads(file.lease_path.read_text())['shard'] == 1
+    assert not list(file.lease_path.parent.glob("*.stale-*"))
+
+
+def test_abandoned_shards(data_home):
+    shards = [Shard(index, 3, data_home, lease_ttl=60) for index in range(3)]
+    shards[0].start(dict)
+    shards[1].start(dict)
+    try:
+        # Shard 2 never started, and shard 1 stops refreshing its status
+        status = json.loads(shards[1].status_path.read_text())
+        status['updated'] -= 120
+        shards[1].status_path.write_text(json.dumps(status))
+        assert shards[0].abandoned() == {1, 2}
+    finally:
+        shards[0].stop(complete=True)
+        shards[1].stop(complete=False)
+    assert shards[2].abandoned() == set()
+
+
+def test_shard_manifests_leave_running_shards_out(data_home):
+    shards = [Shard(index, 3, data_home) for index in range(3)]
+    for shard in shards:
+        shard.root.mkdir(parents=True, exist_ok=True)
+        shard.manifest_path.touch()
+    shards[0].start(dict)
+    shards[0].stop(complete=True)
+    shards[1].start(dict)  # still running
+    try:
+        done, running = shard_manifests(data_home)
+    finally:
+        shards[1].stop(complete=True)
+    # Shard 2 has a manifest but no status: it died before writing one
+    assert done == [shards[0].manifest_path, shards[2].manifest_path]
+    assert running == [shards[1].manifest_path]
@@ -0,0 +1,103 @@
+import errno
+import os
+
+import pytest
+
+from esgf_download.progress import FileTask
+from esgf_download.store import BlobStore
+
+from tests.test_download import _content
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(tmp_path / "data" / ".esgf_store")
+
+
+def _download(file) -> None:
+    file.local_path.parent.mkdir(parents=True, exist_ok=True)
+    file.local_path.write_bytes(_content(file))
+
+
+def test_add_and_link(catalog, publish, datasets, store, manifest):
+    publish([1000])
+    publish([1000], version="20210101")
+    old, new = (dataset.files[0] for dataset in datasets(catalog, manifest=manifest))
+    assert old.checksum == new.checksum
+    _download(old)
+    store.add(old)
+    blob = store.path(old)
+    assert blob.samefile(old.local_path)
+
+    new.dataset.local_path.mkdir(parents=True)  # as the scheduler does on submit
+    task = FileTask(new)
+    assert store.link(new, task)
+    assert task.state == 'skipped'
+    assert new.local_path.samefile(blob)
+    assert manifest.completed(new.dataset.dataset_id) == {new.filename: (1000, new.checksum)}
+    assert (store.files, store.bytes) == (1, 1000)
+
+
+def test_add_replaces_a_duplicate_with_a_link(catalog, publish, datasets, store):
+    publish([1000])
+    publish([1000], version="20210101")
+    old, new = (dataset.files[0] for dataset in datasets(catalog))
+    for file in (old, new):
+        _download(file)
+        store.add(file)
+    assert new.local_path.samefile(old.local_path)
+
+
+def test_add_replaces_a_duplicate_despite_a_stale_part_file(catalog, publish, datasets, store):
+    publish([1000])
+    publish([1000], version="20210101")
+    old, new = (dataset.files[0] for dataset in datasets(catalog))
+    _download(old)
+    store.add(old)
+    _download(new)
+    new.part_path.write_bytes(b"stale")
+    store.add(new)
+    assert new.local_path.samefile(old.local_path)
+    assert not new.part_path.exists()
+
+
+def test_add_keeps_the_file_when_it_cannot_be_linked(catalog, publish, datasets, store, monkeypatch):
+    publish([1000])
+    publish([1000], version="20210101")
+    old, new = (dataset.files[0] for dataset in datasets(catalog))
+    _download(old)
+    store.add(old)
+    _download(new)
+    link = os.link
+
+    def too_many_links(src, dst):
+        if src == store.path(new):
+            raise OSError(errno.EMLINK, "Too many links")
+        link(src, dst)
+
+    monkeypatch.setattr(os, "link", too_many_links)
+    store.add(new)
+    assert new.local_path.read_bytes() == _content(new)
+    assert not new.local_path.samefile(old.local_path)
+    assert not new.part_path.exists()
+
+
+def test_link_needs_the_blob(catalog, publish, datasets, store):
+    publish([1000])
+    file, = datasets(catalog)[0].files
+    assert not store.link(file, FileTask(file))
+    assert not file.part_path.exists()
+
+
+def test_gc_removes_unreferenced_blobs(catalog, publish, datasets, store):
+    publish([1000, 2000])
+    kept, deleted = datasets(catalog)[0].files
+    for file in (kept, deleted):
+        _download(file)
+        store.add(file)
+    deleted.local_path.unlink()
+
+    assert store.gc() == (1, 2000)
+    assert store.path(kept).exists()
+    assert not store.path(deleted).parent.exists()
+    assert store.gc() == (0, 0)
@@ -0,0 +1,103 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("netCDF4")
+
+from benchmarks.fake_esgf import Catalog, FakeDataNode
+from esgf_download.mirrors import NodeHealth
+from esgf_download.progress import FileTask
+from esgf_download.subset import Subset, Subsetter, _cover, _lat_mask, _lon_mask, _runs
+
+
+def _selected(lon, bbox):
+    """Longitudes selected by a box, in output order."""
+    return np.concatenate([lon[start:stop] for start, stop in _runs(_lon_mask(lon, bbox))])
+
+
+def test_box_within_the_grid():
+    lon = np.arange(0, 360, 30)
+    assert _runs(_lon_mask(lon, (40, -10, 130, 10))) == [(2, 5)]
+
+
+@pytest.mark.parametrize("lon", [np.arange(0, 360, 30), np.arange(-180, 180, 30)], ids=["0..360", "-180..180"])
+def test_box_across_the_antimeridian(lon):
+    # Contiguous across the seam, from the west edge of the box eastwards
+    assert list(_selected(lon, (150, -10, -150, 10)) % 360) == [150, 180, 210]
+
+
+@pytest.mark.parametrize("lon", [np.arange(0, 360, 30), np.arange(-180, 180, 30)], ids=["0..360", "-180..180"])
+def test_box_across_the_greenwich_meridian(lon):
+    selected = _selected(lon, (-40, -10, 40, 10))
+    assert list(selected % 360) == [330, 0, 30]
+
+
+def test_whole_circle():
+    lon = np.arange(-180, 180, 30)
+    assert _runs(_lon_mask(lon, (-180, -90, 180, 90))) == [(0, 12)]
+
+
+def test_latitude_cover_of_a_descending_axis():
+    lat = np.arange(90, -91, -30)
+    assert _cover(_lat_mask(lat, (0, 10, 0, -40))) == [(3, 5)]
+    assert _cover(_lat_mask(lat, (0, 10, 0, 20))) == []
+
+
+def test_subset_filename_depends_on_the_subset():
+    first, second = Subset(bbox=(0, 0, 10, 10)), Subset(bbox=(0, 0, 10, 20))
+    assert first.filename("tas_Amon.nc").startswith("tas_Amon.subset-")
+    assert first.filename("tas_Amon.nc").endswith(".nc")
+    assert first.filename("tas_Amon.nc") != second.filename("tas_Amon.nc")
+    assert first.tag == Subset(bbox=[0, 0, 10, 10]).tag
+
+
+@pytest.fixture
+def subset_files(catalog, publish, datasets):
+    """Build the subset files of a dataset, with OPeNDAP URLs on the given data nodes."""
+    def build(*base_urls: str, count: int = 1) -> list:
+        instance_id = publish([1000] * count, variable="thetao")
+        dataset, = datasets(catalog)
+        dataset.subset = Subset(bbox=(-80, 0, 20, 70), levels=(0, 700))
+        for file, fake in zip(dataset.files, catalog.files[instance_id]):
+            file.opendap_urls = [f"{base_url}/thredds/dodsC/{fake.path}" for base_url in base_urls]
+        return dataset.files
+    return build
+
+
+def test_subset_fails_over_to_a_replica_and_skips_a_dead_node(catalog, node, subset_files):
+    # An empty node answers 404 to every OPeNDAP request
+    empty = FakeDataNode(Catalog(), host="127.0.0.3").start()
+    health = NodeHealth(max_failures=1)
+    subsetter = Subsetter(1, health=health)
+    try:
+        first, second = subset_files(empty.base_url, node.base_url, count=2)
+        task = FileTask(first)
+        assert subsetter.subset_file(first, task)
+        assert task.failed_nodes == ["127.0.0.3"]
+        assert health.is_dead(empty.base_url)
+
+        requests = empty.requests
+        task = FileTask(second)
+        assert subsetter.subset_file(second, task)
+        assert empty.requests == requests
+        assert task.failed_nodes == []
+    finally:
+        subsetter.close()
+        empty.stop()
+    assert first.local_path.name.startswith(first.filename[:-3] + ".subset-")
+    assert first.local_path.stat().st_size > 0
+    assert not first.part_path.exists()
+
+
+def test_subset_fails_once_every_replica_has(catalog, subset_files):
+    empty = FakeDataNode(Catalog(), host="127.0.0.3").start()
+    subsetter = Subsetter(1)
+    try:
+        file, = subset_files(empty.base_url)
+        task = FileTask(file)
+        assert not subsetter.subset_file(file, task)
+    finally:
+        subsetter.close()
+        empty.stop()
+    assert task.state == 'failed'
+    assert not file.local_path.exists()
+    assert not file.part_path.exists()
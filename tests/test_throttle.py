@@ -0,0 +1,94 @@
+import pytest
+import requests
+
+from esgf_download import throttle
+from esgf_download.throttle import AdaptiveLimiter, TokenBucket, backoff_delay, is_throttled, retry_after
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """The limiters' clock, set by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(throttle, "monotonic", lambda: now[0])
+    return now
+
+
+def test_fixed_limit():
+    released = []
+    limiter = AdaptiveLimiter(3, adaptive=False, on_release=lambda: released.append(True))
+    assert [limiter.try_acquire() for _ in range(4)] == [True, True, True, False]
+    limiter.add_bytes(10**9)
+    limiter.backoff()
+    assert limiter.limit == 3
+    limiter.release()
+    assert released == [True]
+    assert limiter.has_capacity()
+
+
+def test_limit_grows_while_throughput_improves_and_shrinks_when_it_drops(clock):
+    raised = []
+    limiter = AdaptiveLimiter(4, window=10, on_release=lambda: raised.append(limiter.limit))
+    assert limiter.limit == 2
+    limiter.try_acquire()
+    limiter.try_acquire()  # every slot in use
+
+    clock[0] += 10
+    limiter.add_bytes(1000)
+    assert limiter.limit == 3
+    assert raised == [3]  # a waiting worker can take the new slot
+
+    limiter.try_acquire()
+    clock[0] += 10
+    limiter.add_bytes(2000)
+    assert limiter.limit == 4
+
+    clock[0] += 10
+    limiter.add_bytes(1000)  # half the previous window's throughput
+    assert limiter.limit == 3
+
+
+def test_limit_only_grows_when_saturated(clock):
+    limiter = AdaptiveLimiter(4, window=10)
+    limiter.try_acquire()
+    clock[0] += 10
+    limiter.add_bytes(1000)
+    assert limiter.limit == 2
+
+
+def test_backoff_halves_the_limit():
+    limiter = AdaptiveLimiter(8, initial=5)
+    limiter.backoff()
+    assert limiter.limit == 2
+    limiter.backoff()
+    limiter.backoff()
+    assert limiter.limit == 1
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(rate=100)
+    assert bucket.reserve(100) == 0
+    assert bucket.reserve(50) == pytest.approx(0.5)
+    clock[0] += 1.5
+    assert bucket.reserve(100) == 0
+
+
+def test_backoff_delay():
+    assert all(0 <= backoff_delay(attempt) <= min(60, 2 ** attempt) for attempt in range(10))
+    assert backoff_delay(0, retry_after=5) >= 5
+    assert backoff_delay(0, retry_after=600) == 60
+
+
+def _http_error(status: int, headers: dict) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers)
+    return requests.HTTPError(response=response)
+
+
+def test_throttled_errors():
+    assert is_throttled(_http_error(503, {}))
+    assert is_throttled(_http_error(429, {}))
+    assert is_throttled(requests.exceptions.ReadTimeout())
+    assert not is_throttled(_http_error(404, {}))
+    assert retry_after(_http_error(503, {'Retry-After': "7"})) == 7
+    assert retry_after(_http_error(503, {'Retry-After': "Wed, 21 Oct 2026 07:28:00 GMT"})) is None
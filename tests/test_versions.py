@@ -0,0 +1,56 @@
+from esgf_download.progress import FileTask
+from esgf_download.versions import VersionSync
+
+from tests.test_download import _content
+
+
+def _download(file, content: bytes) -> None:
+    file.local_path.parent.mkdir(parents=True, exist_ok=True)
+    file.local_path.write_bytes(content)
+
+
+def test_unchanged_file_is_linked_from_the_newest_earlier_version(catalog, publish, datasets):
+    for version in ("20190101", "20200101", "20210101"):
+        publish([1000], version=version)
+    oldest, older, new = (dataset.files[0] for dataset in datasets(catalog))
+    _download(oldest, _content(oldest))
+    _download(older, _content(older))
+
+    new.dataset.local_path.mkdir(parents=True)  # as the scheduler does on submit
+    sync = VersionSync()
+    assert [path.name for path in sync.previous_versions(new.dataset)] == ["v20200101", "v20190101"]
+    task = FileTask(new)
+    assert sync.link(new, task)
+    assert task.state == 'skipped'
+    assert new.local_path.samefile(older.local_path)
+    assert (sync.files, sync.bytes) == (1, 1000)
+
+
+def test_changed_file_is_not_linked(catalog, publish, datasets):
+    publish([1000], version="20200101")
+    publish([1000], version="20210101")
+    old, new = (dataset.files[0] for dataset in datasets(catalog))
+    new.dataset.local_path.mkdir(parents=True)
+    _download(old, _content(old)[:-1])  # a different size
+    sync = VersionSync()
+    assert not sync.link(new, FileTask(new))
+
+    _download(old, b"x" * 1000)  # the same size, but a different checksum
+    sync = VersionSync()
+    assert not sync.link(new, FileTask(new))
+    assert not new.local_path.exists()
+
+
+def test_checksum_of_a_verified_copy_comes_from_the_manifest(catalog, publish, datasets, manifest, monkeypatch):
+    publish([1000], version="20200101")
+    publish([1000], version="20210101")
+    old, new = (dataset.files[0] for dataset in datasets(catalog, manifest=manifest))
+    _download(old, _content(old))
+    manifest.record(old)
+    new.dataset.local_path.mkdir(parents=True)
+
+    def hashed(*args):
+        raise AssertionError("the copy was hashed again")
+
+    monkeypatch.setattr("esgf_download.versions.update_from_file", hashed)
+    assert VersionSync(manifest).link(new, FileTask(new))